@@ -1,8 +1,19 @@
+import asyncio
+import atexit
+import contextvars
+import inspect
+import random
 import subprocess
+import threading
 import time
 import json
-from typing import Dict, Any
-from dataclasses import dataclass
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from typing import Callable, Dict, Any, Optional, Tuple
+from dataclasses import dataclass, replace
+from ..core.metrics import REGISTRY
+from .cache import ResultCache
+from .threads import ThreadPool
+from .workers import WorkerError, WorkerPool, WorkerTimeout
 
 
 @dataclass
@@ -11,39 +22,386 @@ class ActivityResult:
     output: str
     error: str
     duration: float
+    error_type: str = ""  # class name of the exception, or "ActivityTimeout"
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 3  # including the first attempt
+    initial_interval: float = 1.0
+    backoff_coefficient: float = 2.0
+    max_interval: float = 100.0
+    jitter: float = 0.2  # each delay varies by up to this fraction either way
+    # Exception class names that fail the activity without another attempt
+    non_retryable_errors: Tuple[str, ...] = ()
+
+    def delay(self, failures: int, rng: random.Random = random) -> float:
+        base = min(self.initial_interval * self.backoff_coefficient ** (failures - 1), self.max_interval)
+        return max(0.0, base * (1 + rng.uniform(-self.jitter, self.jitter)))
+
+    def should_retry(self, failures: int, error_type: str) -> bool:
+        return (failures < self.max_attempts
+                and error_type not in self.non_retryable_errors
+                and error_type != NonRetryableError.__name__)
+
+
+@dataclass
+class ExecutionPolicy:
+    mode: str = "thread"  # "inline", "thread", "process", "subprocess"
+    pool: str = "default"  # activities naming the same pool share its workers
+    max_workers: int = 4
+    max_concurrency: Optional[int] = None  # per activity, across all pools
+    retry: Optional[RetryPolicy] = None
+    # Seconds from the attempt starting to run to its result before it is
+    # abandoned; waiting for a concurrency slot or a pool worker is not counted
+    start_to_close_timeout: Optional[float] = None
+    # Seconds an activity may go without calling heartbeat(); not enforced
+    # in process mode
+    heartbeat_timeout: Optional[float] = None
+    # Subprocess mode only: calls before a worker process is replaced
+    max_tasks_per_child: Optional[int] = None
+    # A pure activity's successful result may be reused by any workflow
+    # while it is in the runner's result cache
+    pure: bool = False
+
+
+class NonRetryableError(Exception):
+    pass
+
+
+class ActivityCancelled(Exception):
+    pass
+
+
+ACTIVITY_QUEUE_SECONDS = REGISTRY.histogram(
+    "localflow_activity_queue_seconds",
+    "Time from an activity being requested to it starting, concurrency limits and pool waits included",
+    labels=("activity",)
+)
+
+
+class ActivityContext:
+    def __init__(self, activity_name: str, queued_at: Optional[float] = None):
+        self.activity_name = activity_name
+        # Both deadline clocks start when the attempt starts running
+        self.started_at: Optional[float] = None
+        self.last_heartbeat: Optional[float] = None
+        self.details: Any = None
+        self.cancelled = False
+        self.queued_at = queued_at if queued_at is not None else time.perf_counter()
+
+    def started(self):
+        self.started_at = self.last_heartbeat = time.monotonic()
+        if REGISTRY.enabled:
+            ACTIVITY_QUEUE_SECONDS.labels(self.activity_name).observe(time.perf_counter() - self.queued_at)
+
+    def heartbeat(self, details: Any = None):
+        # An abandoned attempt learns about it here, which frees its thread
+        if self.cancelled:
+            raise ActivityCancelled(f"Activity {self.activity_name} was cancelled")
+        self.last_heartbeat = time.monotonic()
+        self.details = details
+
+
+_current_context: contextvars.ContextVar = contextvars.ContextVar("activity_context", default=None)
+
+
+def activity_context() -> Optional[ActivityContext]:
+    return _current_context.get()
+
+
+def heartbeat(details: Any = None):
+    # Called from inside an activity; a no-op outside of one
+    context = _current_context.get()
+    if context is not None:
+        context.heartbeat(details)
+
+
+_pools: Dict[Tuple[str, str], Executor] = {}
+_pools_lock = threading.Lock()
+# Prefix of the thread pools for run_activity attempts with a timeout, one
+# per policy pool. Their callers are often threads of the activity pools,
+# so attempts must not queue behind them.
+TIMED_POOL = "timed"
+# How often a supervisor checks whether a queued attempt has started
+QUEUE_POLL_SECONDS = 0.05
+
+
+def get_pool(mode: str, name: str = "default", max_workers: int = 4,
+             max_tasks_per_child: Optional[int] = None) -> Executor:
+    # Pools are process-wide and shared by every runner and executor; the
+    # first caller for a given (mode, name) decides its size
+    key = (mode, name)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            if mode == "thread":
+                pool = ThreadPool(max_workers, name)
+            elif mode == "process":
+                pool = ProcessPoolExecutor(max_workers=max_workers)
+            elif mode == "subprocess":
+                pool = WorkerPool(max_workers, max_tasks_per_child, name)
+            else:
+                raise ValueError(f"Unknown pool mode: {mode}")
+            _pools[key] = pool
+        return pool
+
+
+def shutdown_pools(wait: bool = True):
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=wait)
+
+
+atexit.register(shutdown_pools)
+
+
+def _run_timed(func) -> ActivityResult:
+    start_time = time.time()
+    try:
+        result = func()
+        duration = time.time() - start_time
+        return ActivityResult(
+            success=True,
+            output=str(result),
+            error="",
+            duration=duration
+        )
+    except Exception as e:
+        duration = time.time() - start_time
+        return ActivityResult(
+            success=False,
+            output="",
+            error=str(e),
+            duration=duration,
+            error_type=type(e).__name__
+        )
+
+
+def _run_in_context(func, context: ActivityContext) -> ActivityResult:
+    context.started()
+    token = _current_context.set(context)
+    try:
+        return _run_timed(func)
+    finally:
+        _current_context.reset(token)
+
+
+def _next_deadline(context: ActivityContext, start_to_close: Optional[float],
+                   heartbeat_timeout: Optional[float]) -> Optional[Tuple[float, str, float]]:
+    # The earliest (deadline, kind, seconds) of a running attempt, or None
+    # while it is still queued
+    if context.started_at is None:
+        return None
+    deadlines = []
+    if start_to_close:
+        deadlines.append((context.started_at + start_to_close, "start-to-close", start_to_close))
+    if heartbeat_timeout:
+        deadlines.append((context.last_heartbeat + heartbeat_timeout, "heartbeat", heartbeat_timeout))
+    return min(deadlines) if deadlines else None
+
+
+def _worker_failure(error: WorkerError, activity_name: str, timeout: Optional[float],
+                    duration: float) -> ActivityResult:
+    if isinstance(error, WorkerTimeout):
+        return _timed_out(activity_name, "start-to-close", timeout, duration)
+    return ActivityResult(success=False, output="", error=str(error), duration=duration,
+                          error_type=error.error_type)
+
+
+def _timed_out(activity_name: str, kind: str, seconds: float, duration: float) -> ActivityResult:
+    return ActivityResult(
+        success=False,
+        output="",
+        error=f"Activity {activity_name} exceeded its {kind} timeout of {seconds}s",
+        duration=duration,
+        error_type="ActivityTimeout"
+    )
 
 
 class ActivityRunner:
-    def __init__(self):
+    def __init__(self, default_policy: Optional[ExecutionPolicy] = None,
+                 result_cache: Optional[ResultCache] = None):
         self.activities = {}
+        self.policies: Dict[str, ExecutionPolicy] = {}
+        self.default_policy = default_policy or ExecutionPolicy()
+        self.result_cache = result_cache
+        # activity name -> (event loop, semaphore); semaphores are bound to
+        # the loop they were first used on
+        self._limits: Dict[str, Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = {}
 
-    def register_activity(self, name: str, func):
+    def register_activity(self, name: str, func, policy: Optional[ExecutionPolicy] = None):
         self.activities[name] = func
+        if policy is not None:
+            self.policies[name] = policy
+
+    def policy_for(self, activity_name: str) -> ExecutionPolicy:
+        return self.policies.get(activity_name, self.default_policy)
+
+    def _cached(self, activity_name: str, policy: ExecutionPolicy) -> Optional[ActivityResult]:
+        # Activities take no arguments, so a pure activity's result is keyed
+        # by its name alone
+        if not policy.pure or self.result_cache is None:
+            return None
+        result = self.result_cache.get(activity_name)
+        return replace(result, duration=0.0) if result is not None else None
+
+    def _remember(self, activity_name: str, policy: ExecutionPolicy, result: ActivityResult) -> ActivityResult:
+        if policy.pure and self.result_cache is not None and result.success:
+            self.result_cache.put(activity_name, result)
+        return result
+
+    def run_activity(self, activity_name: str, timeout_seconds: Optional[float] = 30) -> ActivityResult:
+        if activity_name not in self.activities:
+            raise ValueError(f"Activity {activity_name} not registered")
+
+        policy = self.policy_for(activity_name)
+        cached = self._cached(activity_name, policy)
+        if cached is not None:
+            return cached
+        if not timeout_seconds:
+            return self._remember(activity_name, policy, _run_timed(self.activities[activity_name]))
+        # The attempt runs on a shared pool, so the caller can stop waiting
+        # at the deadline without a thread started per call. The deadline
+        # runs from when the attempt starts, as in _supervise; an abandoned
+        # attempt's thread is replaced in the pool right away.
+        context = ActivityContext(activity_name)
+        pool = get_pool("thread", f"{TIMED_POOL}-{policy.pool}", policy.max_workers)
+        future = pool.submit(_run_in_context, self.activities[activity_name], context)
+        while True:
+            deadline = _next_deadline(context, timeout_seconds, None)
+            remaining = QUEUE_POLL_SECONDS if deadline is None else deadline[0] - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                return self._remember(activity_name, policy, future.result(remaining))
+            except FutureTimeout:
+                continue
+        context.cancelled = True
+        pool.abandon(future)
+        return _timed_out(activity_name, "start-to-close", timeout_seconds, time.monotonic() - context.started_at)
+
+    def _limit(self, activity_name: str, policy: ExecutionPolicy) -> Optional[asyncio.Semaphore]:
+        if policy.max_concurrency is None:
+            return None
+        loop = asyncio.get_running_loop()
+        entry = self._limits.get(activity_name)
+        if entry is None or entry[0] is not loop:
+            entry = (loop, asyncio.Semaphore(policy.max_concurrency))
+            self._limits[activity_name] = entry
+        return entry[1]
 
-    def run_activity(self, activity_name: str, timeout_seconds: int = 30) -> ActivityResult:
+    async def run_activity_async(self, activity_name: str,
+                                 timeout_seconds: Optional[float] = None) -> ActivityResult:
+        # ``timeout_seconds`` overrides the policy's start-to-close timeout
         if activity_name not in self.activities:
             raise ValueError(f"Activity {activity_name} not registered")
 
+        policy = self.policy_for(activity_name)
+        cached = self._cached(activity_name, policy)
+        if cached is not None:
+            return cached
+        queued_at = time.perf_counter()
+        limit = self._limit(activity_name, policy)
+        if limit is None:
+            result = await self._dispatch(activity_name, policy, timeout_seconds, queued_at)
+        else:
+            async with limit:
+                result = await self._dispatch(activity_name, policy, timeout_seconds, queued_at)
+        return self._remember(activity_name, policy, result)
+
+    async def _run_inline(self, func, context: ActivityContext) -> ActivityResult:
+        context.started()
         start_time = time.time()
+        token = _current_context.set(context)
         try:
-            result = self.activities[activity_name]()
-            duration = time.time() - start_time
-            return ActivityResult(
-                success=True,
-                output=str(result),
-                error="",
-                duration=duration
-            )
+            result = func()
+            if inspect.isawaitable(result):
+                result = await result
+            return ActivityResult(success=True, output=str(result), error="",
+                                  duration=time.time() - start_time)
         except Exception as e:
-            duration = time.time() - start_time
-            return ActivityResult(
-                success=False,
-                output="",
-                error=str(e),
-                duration=duration
-            )
+            return ActivityResult(success=False, output="", error=str(e),
+                                  duration=time.time() - start_time, error_type=type(e).__name__)
+        finally:
+            _current_context.reset(token)
 
-    def run_activity_subprocess(self, activity_name: str, timeout_seconds: int = 30) -> ActivityResult:
+    async def _dispatch(self, activity_name: str, policy: ExecutionPolicy,
+                        timeout_seconds: Optional[float] = None,
+                        queued_at: Optional[float] = None) -> ActivityResult:
+        func = self.activities[activity_name]
+        if policy.mode == "subprocess":
+            # The pool enforces the deadline itself, by killing the worker
+            timeout = timeout_seconds or policy.start_to_close_timeout
+            pool = get_pool("subprocess", policy.pool, policy.max_workers, policy.max_tasks_per_child)
+            start_time = time.time()
+            try:
+                output = await asyncio.wrap_future(pool.submit_call(func, timeout=timeout))
+            except WorkerError as e:
+                return _worker_failure(e, activity_name, timeout, time.time() - start_time)
+            return ActivityResult(success=True, output=str(output), error="",
+                                  duration=time.time() - start_time)
+        context = ActivityContext(activity_name, queued_at)
+        pool: Optional[Executor] = None
+        submitted: Optional[Future] = None
+        if policy.mode == "inline":
+            future = asyncio.ensure_future(self._run_inline(func, context))
+        else:
+            pool = get_pool(policy.mode, policy.pool, policy.max_workers)
+            if policy.mode == "thread":
+                submitted = pool.submit(_run_in_context, func, context)
+            else:
+                # Process pools need a picklable, module-level activity function
+                submitted = pool.submit(_run_timed, func)
+            future = asyncio.wrap_future(submitted)
+        return await self._supervise(activity_name, future, context, policy, timeout_seconds, pool, submitted)
+
+    async def _supervise(self, activity_name: str, future: asyncio.Future, context: ActivityContext,
+                         policy: ExecutionPolicy, timeout_seconds: Optional[float],
+                         pool: Optional[Executor] = None, submitted: Optional[Future] = None) -> ActivityResult:
+        # Deadlines are enforced from the event loop. An attempt that misses
+        # one is abandoned at once: the workflow and the concurrency slot
+        # move on, a thread pool replaces the attempt's thread, and the
+        # attempt itself stops at its next heartbeat.
+        start_to_close = timeout_seconds or policy.start_to_close_timeout
+        heartbeat_timeout = policy.heartbeat_timeout if policy.mode != "process" else None
+        if not start_to_close and not heartbeat_timeout:
+            return await future
+        while True:
+            if context.started_at is None and policy.mode == "process" and submitted.running():
+                # No context crosses into a worker process; the pool marks a
+                # call running as it hands it to one
+                context.started()
+            deadline = _next_deadline(context, start_to_close, heartbeat_timeout)
+            remaining = QUEUE_POLL_SECONDS if deadline is None else deadline[0] - time.monotonic()
+            if remaining > 0:
+                done, _ = await asyncio.wait({future}, timeout=remaining)
+                if done:
+                    return future.result()
+                continue
+            context.cancelled = True
+            future.cancel()
+            if isinstance(pool, ThreadPool):
+                pool.abandon(submitted)
+            _, kind, seconds = deadline
+            return _timed_out(activity_name, kind, seconds, time.monotonic() - context.started_at)
+
+    def run_activity_subprocess(self, activity_name: str, timeout_seconds: int = 30,
+                                on_output: Optional[Callable[[str], None]] = None) -> ActivityResult:
+        # Activities registered in subprocess mode run on a warm worker
+        # process; anything they print is passed to on_output as it arrives
+        if activity_name in self.activities and self.policy_for(activity_name).mode == "subprocess":
+            policy = self.policy_for(activity_name)
+            pool = get_pool("subprocess", policy.pool, policy.max_workers, policy.max_tasks_per_child)
+            start_time = time.time()
+            try:
+                output = pool.call(self.activities[activity_name], timeout=timeout_seconds, on_output=on_output)
+            except WorkerError as e:
+                return _worker_failure(e, activity_name, timeout_seconds, time.time() - start_time)
+            return ActivityResult(success=True, output=str(output), error="",
+                                  duration=time.time() - start_time)
         try:
             # In a real implementation, this would call an external process
             # For now, simulate with a subprocess call
@@ -0,0 +1,99 @@
+import queue
+import threading
+from concurrent.futures import Executor, Future
+from typing import Callable, Dict, Optional
+
+
+class ThreadPool(Executor):
+    # A thread pool that keeps its capacity when a task hangs. Python cannot
+    # stop a running thread, so abandon() gives up on a task instead: its
+    # thread leaves the pool once the task returns, and a new thread takes
+    # its place at once. Threads are daemons, so an abandoned task that
+    # never returns does not hold up interpreter exit either.
+    def __init__(self, max_workers: int = 4, name: str = "default"):
+        if max_workers <= 0:
+            raise ValueError("max_workers must be greater than 0")
+        self.max_workers = max_workers
+        self.name = name
+        self.abandoned = 0
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._idle = threading.Semaphore(0)
+        # Threads that count towards max_workers, and the future each one
+        # is running
+        self._threads: Dict[threading.Thread, Optional[Future]] = {}
+        self._spawned = 0
+        self._closed = False
+
+    def submit(self, fn: Callable, /, *args, **kwargs) -> Future:
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            self._queue.put((future, fn, args, kwargs))
+            self._adjust()
+        return future
+
+    def _adjust(self):
+        # Called with the lock held
+        if self._idle.acquire(blocking=False):
+            return
+        if len(self._threads) < self.max_workers:
+            self._spawned += 1
+            thread = threading.Thread(target=self._work, name=f"activity-{self.name}_{self._spawned}", daemon=True)
+            self._threads[thread] = None
+            thread.start()
+
+    def _work(self):
+        thread = threading.current_thread()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            if future.set_running_or_notify_cancel():
+                with self._lock:
+                    self._threads[thread] = future
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+                with self._lock:
+                    if thread not in self._threads:
+                        # Abandoned; a replacement already took this place
+                        return
+                    self._threads[thread] = None
+            self._idle.release()
+
+    def abandon(self, future: Future):
+        # The caller has stopped waiting for a running task; its thread no
+        # longer counts towards max_workers
+        with self._lock:
+            for thread, running in self._threads.items():
+                if running is future:
+                    del self._threads[thread]
+                    self.abandoned += 1
+                    # Otherwise the next submit starts the replacement
+                    if not self._closed and not self._queue.empty():
+                        self._adjust()
+                    return
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        with self._lock:
+            self._closed = True
+            threads = list(self._threads)
+        if cancel_futures:
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    item[0].cancel()
+        for _ in threads:
+            self._queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,239 @@
+import io
+import os
+import pickle
+import select
+import struct
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Every message is a 4-byte big-endian length followed by a pickle. The
+# parent sends (function, args, kwargs); functions are pickled by reference,
+# so they must be importable, module-level functions. The worker answers
+# with any number of ("output", text) frames and then exactly one
+# ("result", value) or ("error", message, error_type) frame.
+FRAME = struct.Struct(">I")
+
+
+class WorkerError(Exception):
+    def __init__(self, message: str, error_type: str = ""):
+        super().__init__(message)
+        self.error_type = error_type
+
+
+class WorkerTimeout(WorkerError):
+    pass
+
+
+class WorkerCrashed(WorkerError):
+    pass
+
+
+def _frame(message: Any) -> bytes:
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    return FRAME.pack(len(data)) + data
+
+
+class _Worker:
+    def __init__(self, command: List[str], env: Dict[str, str]):
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+        self.tasks = 0
+        self._fd = self.process.stdout.fileno()
+        self._buffer = bytearray()
+
+    def send(self, frame: bytes):
+        try:
+            self.process.stdin.write(frame)
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            raise WorkerCrashed(f"Worker {self.process.pid} exited with {self.process.poll()}")
+
+    def receive(self, deadline: Optional[float]) -> Tuple:
+        while True:
+            if len(self._buffer) >= FRAME.size:
+                (length,) = FRAME.unpack_from(self._buffer)
+                end = FRAME.size + length
+                if len(self._buffer) >= end:
+                    message = pickle.loads(self._buffer[FRAME.size:end])
+                    del self._buffer[:end]
+                    return message
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise WorkerTimeout("Worker call timed out", "ActivityTimeout")
+            ready, _, _ = select.select([self._fd], [], [], remaining)
+            if not ready:
+                continue
+            chunk = os.read(self._fd, 65536)
+            if not chunk:
+                raise WorkerCrashed(f"Worker {self.process.pid} exited with {self.process.wait()}")
+            self._buffer += chunk
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+        self.process.stdin.close()
+        self.process.stdout.close()
+
+    def close(self, timeout: float = 1.0):
+        # End of input is the worker's signal to exit
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+
+
+class WorkerPool(Executor):
+    # Long-lived Python worker processes that are reused across calls, so a
+    # call pays for a pipe round trip rather than a process spawn. A worker
+    # whose call times out is killed and replaced; a worker is also replaced
+    # after max_tasks_per_child calls, to bound leaks in activity code.
+    def __init__(self, max_workers: int = 4, max_tasks_per_child: Optional[int] = None,
+                 name: str = "default"):
+        self.max_workers = max_workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self.spawned = 0
+        self._idle: List[_Worker] = []
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._lock = threading.Lock()
+        self._closed = False
+        # Blocking calls for submit() run on these threads; each waits on
+        # its worker's pipe, not on CPU
+        self._dispatcher = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"subprocess-{name}")
+        self._command = [sys.executable, "-m", __name__]
+        # The worker sees the parent's import path, so it can import the
+        # same activity modules
+        self._env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+
+    def _spawn(self) -> _Worker:
+        self.spawned += 1
+        return _Worker(self._command, self._env)
+
+    def _acquire(self) -> _Worker:
+        self._slots.acquire()
+        with self._lock:
+            if self._closed:
+                self._slots.release()
+                raise RuntimeError("Worker pool is shut down")
+            if self._idle:
+                return self._idle.pop()
+            try:
+                return self._spawn()
+            except Exception:
+                self._slots.release()
+                raise
+
+    def _release(self, worker: _Worker, healthy: bool):
+        if not healthy:
+            worker.kill()
+        elif self.max_tasks_per_child and worker.tasks >= self.max_tasks_per_child:
+            worker.close()
+            healthy = False
+        with self._lock:
+            if self._closed:
+                if healthy:
+                    worker.close()
+            elif healthy:
+                self._idle.append(worker)
+            else:
+                # Spawning returns as soon as the process exists; the new
+                # interpreter starts up while this slot is idle
+                self._idle.append(self._spawn())
+        self._slots.release()
+
+    def call(self, fn: Callable, args: tuple = (), kwargs: Optional[Dict[str, Any]] = None,
+             timeout: Optional[float] = None, on_output: Optional[Callable[[str], None]] = None) -> Any:
+        # Pickling first means a bad function or argument never costs a worker
+        frame = _frame((fn, args, kwargs or {}))
+        worker = self._acquire()
+        # The deadline starts once a worker is free, as for the thread pools
+        deadline = None if timeout is None else time.monotonic() + timeout
+        healthy = False
+        try:
+            worker.send(frame)
+            while True:
+                message = worker.receive(deadline)
+                if message[0] == "output":
+                    if on_output is not None:
+                        on_output(message[1])
+                    continue
+                healthy = True
+                worker.tasks += 1
+                if message[0] == "result":
+                    return message[1]
+                raise WorkerError(message[1], message[2])
+        finally:
+            self._release(worker, healthy)
+
+    def submit_call(self, fn: Callable, args: tuple = (), kwargs: Optional[Dict[str, Any]] = None,
+                    timeout: Optional[float] = None,
+                    on_output: Optional[Callable[[str], None]] = None) -> Future:
+        return self._dispatcher.submit(self.call, fn, args, kwargs, timeout, on_output)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        return self.submit_call(fn, args, kwargs)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        self._dispatcher.shutdown(wait=wait, cancel_futures=cancel_futures)
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.close()
+
+
+class _OutputStream(io.TextIOBase):
+    # Replaces sys.stdout in a worker: each write is sent to the parent as
+    # it happens
+    def __init__(self, channel):
+        self.channel = channel
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if text:
+            self.channel.write(_frame(("output", text)))
+            self.channel.flush()
+        return len(text)
+
+
+def _read_exact(stream, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            return b""
+        data += chunk
+    return data
+
+
+def serve():
+    # Frames go out on the original stdout; anything else that writes to
+    # file descriptor 1 ends up on stderr instead of corrupting the stream
+    channel = os.fdopen(os.dup(1), "wb")
+    os.dup2(2, 1)
+    sys.stdout = _OutputStream(channel)
+    requests = sys.stdin.buffer
+    while True:
+        header = _read_exact(requests, FRAME.size)
+        if not header:
+            return
+        (length,) = FRAME.unpack(header)
+        try:
+            fn, args, kwargs = pickle.loads(_read_exact(requests, length))
+            reply = ("result", fn(*args, **kwargs))
+            frame = _frame(reply)
+        except Exception as e:
+            frame = _frame(("error", str(e), type(e).__name__))
+        channel.write(frame)
+        channel.flush()
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,70 @@
+import argparse
+import random
+import time
+from ..core.workflow import WorkflowEvent
+from ..state.codec import BinaryCodec, JsonCodec
+
+
+def _sample_events(count: int):
+    rng = random.Random(42)
+    activities = ["charge_card", "send_email", "update_crm"]
+    events = []
+    for i in range(count):
+        if i % 10 == 9:
+            events.append(WorkflowEvent(i + 1, time.time(), "TimerStarted",
+                                        {"timer_id": f"timer-{i}", "duration": 60, "fire_time": time.time() + 60}))
+        else:
+            events.append(WorkflowEvent(i + 1, time.time(), "ActivityCompleted", {
+                "step": i % 3,
+                "activity": rng.choice(activities),
+                "result": {"status": "ok", "amount": rng.random() * 100, "items": list(range(i % 5))}
+            }))
+    return events
+
+
+def _mb_per_sec(size: int, elapsed: float) -> float:
+    return size / elapsed / (1024 * 1024)
+
+
+def bench_codec(codec, events, rounds: int):
+    payloads = [codec.encode(event) for event in events]
+    size = sum(len(p) for p in payloads)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for event in events:
+            codec.encode(event)
+    encode = _mb_per_sec(size * rounds, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for payload in payloads:
+            codec.decode(payload).data
+    decode = _mb_per_sec(size * rounds, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for payload in payloads:
+            codec.decode_header(payload)
+    header = len(payloads) * rounds / (time.perf_counter() - start)
+
+    print(f"  {codec.name:<8} {size / len(events):>10.1f} {encode:>12.1f} {decode:>12.1f} {header:>16.0f}")
+    return size
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Event codec throughput and size")
+    parser.add_argument('--events', type=int, default=50000)
+    parser.add_argument('--rounds', type=int, default=3)
+    parsed_args = parser.parse_args(args)
+
+    events = _sample_events(parsed_args.events)
+    print(f"{parsed_args.events} events, {parsed_args.rounds} rounds")
+    print(f"  {'codec':<8} {'bytes/event':>10} {'encode MB/s':>12} {'decode MB/s':>12} {'headers/sec':>16}")
+    json_size = bench_codec(JsonCodec(), events, parsed_args.rounds)
+    binary_size = bench_codec(BinaryCodec(), events, parsed_args.rounds)
+    print(f"  binary is {binary_size / json_size:.0%} of the JSON size on disk")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Optional
+from ..activities.runner import ActivityRunner, ExecutionPolicy
+from ..core.clock import VirtualClock
+from ..core.workflow import WorkflowEngine, WorkflowStatus
+from ..dsl.parser import PlanCache, WorkflowParser
+from ..engine.executor import WorkflowExecutor
+from ..engine.worker import WorkflowWorker, percentile
+from ..state.persistence import StatePersistence
+from ..timers.scheduler import TimerScheduler
+
+
+def workflow_source(steps: int, waits: int, fanout: int) -> str:
+    # Waits are spread evenly between the sequential steps; a fan-out adds
+    # one parallel step at the end
+    lines = []
+    every = steps // (waits + 1) if waits else None
+    placed = 0
+    for index in range(steps):
+        if every and index and index % every == 0 and placed < waits:
+            lines.append("    wait 1h;")
+            placed += 1
+        lines.append(f"    step activity_{index};")
+    lines.extend("    wait 1h;" for _ in range(waits - placed))
+    if fanout > 1:
+        lines.append("    parallel {")
+        lines.extend(f"        step branch_{index};" for index in range(fanout))
+        lines.append("    }")
+    return "workflow BenchFlow {\n" + "\n".join(lines) + "\n}\n"
+
+
+def _storage_bytes(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def _peak_rss_bytes() -> int:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_benchmark(workflows: int = 1000, steps: int = 5, waits: int = 0, fanout: int = 0,
+                  payload_bytes: int = 64, max_inflight: int = 64, activity_mode: str = "inline",
+                  durable: bool = True, storage_path: Optional[str] = None) -> Dict[str, Any]:
+    storage = storage_path or tempfile.mkdtemp(prefix="lf-bench-")
+    try:
+        persistence = StatePersistence(storage, durable=durable)
+        # Waits are durable timers on a virtual clock, so a wait costs its
+        # bookkeeping rather than its duration
+        engine = WorkflowEngine(persistence, clock=VirtualClock(time.time()))
+        payload = "x" * payload_bytes
+        runner = ActivityRunner(ExecutionPolicy(mode=activity_mode))
+        source = workflow_source(steps, waits, fanout)
+        name, plan = WorkflowParser(PlanCache()).parse(source)
+        for step in plan:
+            for activity in [step] + list(step.branches or []):
+                if activity.type == "step":
+                    runner.register_activity(activity.name, lambda: payload)
+        executor = WorkflowExecutor(engine, runner, TimerScheduler(engine))
+        executor.register_definition(name, plan)
+
+        started = time.perf_counter()
+        for _ in range(workflows):
+            engine.create_workflow(name)
+        # As with `lf run`, the worker finds work in the catalog and loads
+        # each workflow on demand
+        for workflow_id in list(engine.instances):
+            engine.evict(workflow_id, snapshot=False)
+        report = asyncio.run(WorkflowWorker(executor, max_inflight=max_inflight).run())
+        elapsed = time.perf_counter() - started
+
+        completed = persistence.catalog.count(status=WorkflowStatus.COMPLETED.value)
+        events = persistence.event_total()
+        persistence.close()
+        written = _storage_bytes(storage)
+    finally:
+        if storage_path is None:
+            shutil.rmtree(storage)
+
+    latencies = report.step_latencies
+    return {
+        "shape": {
+            "workflows": workflows, "steps": steps, "waits": waits, "fanout": fanout,
+            "payload_bytes": payload_bytes, "max_inflight": max_inflight,
+            "activity_mode": activity_mode, "durable": durable
+        },
+        "results": {
+            "completed": completed,
+            "failed": report.failed,
+            "events": events,
+            "timers_fired": report.timers_fired,
+            "elapsed": elapsed,
+            "workflows_per_sec": completed / elapsed if elapsed else 0.0,
+            "events_per_sec": events / elapsed if elapsed else 0.0,
+            "step_p50_ms": percentile(latencies, 50) * 1000,
+            "step_p95_ms": percentile(latencies, 95) * 1000,
+            "step_p99_ms": percentile(latencies, 99) * 1000,
+            "bytes_per_event": written / events if events else 0.0,
+            "peak_rss_bytes": _peak_rss_bytes()
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.time()
+        }
+    }
+
+
+# (result key, label, format, higher is better)
+METRICS = [
+    ("workflows_per_sec", "workflows/sec", "{:.0f}", True),
+    ("events_per_sec", "events/sec", "{:.0f}", True),
+    ("step_p50_ms", "step p50 ms", "{:.3f}", False),
+    ("step_p95_ms", "step p95 ms", "{:.3f}", False),
+    ("step_p99_ms", "step p99 ms", "{:.3f}", False),
+    ("bytes_per_event", "bytes/event", "{:.1f}", False),
+    ("peak_rss_bytes", "peak RSS MiB", "{:.1f}", False),
+]
+
+
+def _display(key: str, value: float) -> float:
+    return value / (1024 * 1024) if key == "peak_rss_bytes" else value
+
+
+def format_results(run: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> str:
+    results = run["results"]
+    lines = [
+        f"{results['completed']} workflows, {results['events']} events, "
+        f"{results['timers_fired']} timers in {results['elapsed']:.2f}s"
+    ]
+    for key, label, fmt, higher_is_better in METRICS:
+        line = f"  {label:<14} {fmt.format(_display(key, results[key])):>12}"
+        if baseline is not None and baseline["results"].get(key):
+            change = results[key] / baseline["results"][key] - 1
+            if change:
+                verdict = "better" if (change > 0) == higher_is_better else "worse"
+                line += f"  {change:+.1%} vs baseline ({verdict})"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--workflows', type=int, default=1000)
+    parser.add_argument('--steps', type=int, default=5, help='Sequential steps per workflow')
+    parser.add_argument('--waits', type=int, default=0, help='Timer waits per workflow')
+    parser.add_argument('--fanout', type=int, default=0, help='Branches of a final parallel step')
+    parser.add_argument('--payload-bytes', type=int, default=64, help='Size of each activity result')
+    parser.add_argument('--max-inflight', type=int, default=64)
+    parser.add_argument('--activity-mode', choices=["inline", "thread"], default="inline")
+    parser.add_argument('--no-fsync', action='store_true', help='Skip fsync on group commit')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare against results saved with --output')
+
+
+def run_from_args(parsed_args: argparse.Namespace):
+    run = run_benchmark(
+        workflows=parsed_args.workflows,
+        steps=parsed_args.steps,
+        waits=parsed_args.waits,
+        fanout=parsed_args.fanout,
+        payload_bytes=parsed_args.payload_bytes,
+        max_inflight=parsed_args.max_inflight,
+        activity_mode=parsed_args.activity_mode,
+        durable=not parsed_args.no_fsync
+    )
+    baseline = None
+    if parsed_args.baseline:
+        with open(parsed_args.baseline) as f:
+            baseline = json.load(f)
+    print(format_results(run, baseline))
+    if parsed_args.output:
+        with open(parsed_args.output, 'w') as f:
+            json.dump(run, f, indent=2)
+    return run
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="End-to-end engine throughput and latency")
+    add_arguments(parser)
+    run_from_args(parser.parse_args(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from ..core.workflow import WorkflowEngine
+from ..state.persistence import StatePersistence
+
+
+def bench_append_log(total_events: int, window: int, durable: bool):
+    storage = tempfile.mkdtemp(prefix="lf-bench-")
+    try:
+        persistence = StatePersistence(storage, durable=durable)
+        engine = WorkflowEngine(persistence)
+        workflow = engine.create_workflow("BenchFlow")
+
+        print(f"append-only log (durable={durable})")
+        print(f"  {'events':>10}  {'events/sec':>12}")
+        recorded = 0
+        while recorded < total_events:
+            start = time.perf_counter()
+            for i in range(window):
+                engine.record_event(workflow.id, "ActivityCompleted", {"activity": "charge_card", "n": i})
+            persistence.sync()
+            elapsed = time.perf_counter() - start
+            recorded += window
+            print(f"  {recorded:>10}  {window / elapsed:>12.0f}")
+        persistence.close()
+    finally:
+        shutil.rmtree(storage)
+
+
+def bench_whole_file_rewrite(total_events: int, window: int):
+    # The previous layout rewrote <id>.json with the full history on every save.
+    storage = tempfile.mkdtemp(prefix="lf-bench-")
+    try:
+        path = os.path.join(storage, "workflow.json")
+        events = []
+        print("whole-file rewrite (previous layout)")
+        print(f"  {'events':>10}  {'events/sec':>12}")
+        while len(events) < total_events:
+            start = time.perf_counter()
+            for i in range(window):
+                events.append({
+                    "id": str(len(events)),
+                    "timestamp": time.time(),
+                    "type": "ActivityCompleted",
+                    "data": {"activity": "charge_card", "n": i}
+                })
+                with open(path, 'w') as f:
+                    json.dump({"events": events}, f)
+            elapsed = time.perf_counter() - start
+            print(f"  {len(events):>10}  {window / elapsed:>12.0f}")
+    finally:
+        shutil.rmtree(storage)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Event log write throughput")
+    parser.add_argument('--events', type=int, default=200000)
+    parser.add_argument('--window', type=int, default=10000)
+    parser.add_argument('--no-fsync', action='store_true', help='Skip fsync on group commit')
+    parser.add_argument('--rewrite-events', type=int, default=2000,
+                        help='History length for the whole-file rewrite baseline')
+    parsed_args = parser.parse_args(args)
+
+    bench_append_log(parsed_args.events, parsed_args.window, not parsed_args.no_fsync)
+    if parsed_args.rewrite_events:
+        bench_whole_file_rewrite(parsed_args.rewrite_events, max(parsed_args.rewrite_events // 5, 1))
+
+
+if __name__ == '__main__':
+    main()
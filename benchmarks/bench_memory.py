@@ -0,0 +1,110 @@
+import argparse
+import gc
+import shutil
+import tempfile
+import time
+import tracemalloc
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict
+from ..core.workflow import WorkflowEngine, WorkflowStatus
+from ..state.persistence import StatePersistence
+
+
+@dataclass
+class _LegacyEvent:
+    # The previous representation: a regular dataclass with a uuid string id
+    id: str
+    timestamp: float
+    type: str
+    data: Dict[str, Any]
+
+
+def _measure(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return used
+
+
+def _event_data(i: int) -> Dict[str, Any]:
+    return {"step": i % 8, "activity": "charge_card", "result": None}
+
+
+def bench_events(count: int):
+    def legacy():
+        history, event_log = [], []
+        for i in range(count):
+            event = _LegacyEvent(str(uuid.uuid4()), time.time(), "ActivityCompleted", _event_data(i))
+            history.append(event)
+            event_log.append(event)
+        return history, event_log
+
+    def compact():
+        engine = WorkflowEngine()
+        workflow = engine.create_workflow("BenchFlow")
+        for i in range(count):
+            engine.record_event(workflow.id, "ActivityCompleted", _event_data(i))
+        return engine
+
+    def stored(storage):
+        def build():
+            persistence = StatePersistence(storage, durable=False)
+            engine = WorkflowEngine(persistence)
+            workflow = engine.create_workflow("BenchFlow")
+            for i in range(count):
+                engine.record_event(workflow.id, "ActivityCompleted", _event_data(i))
+            return persistence, engine
+        return build
+
+    print(f"bytes per event ({count} events in one workflow)")
+    print(f"  legacy dataclass, two lists  {_measure(legacy) / count:>10.1f}")
+    print(f"  slotted event, no store      {_measure(compact) / count:>10.1f}")
+    storage = tempfile.mkdtemp(prefix="lf-bench-")
+    try:
+        print(f"  slotted event, with store    {_measure(stored(storage)) / count:>10.1f}")
+    finally:
+        shutil.rmtree(storage)
+
+
+def bench_idle_workflows(count: int, max_finished: int):
+    def build(finish):
+        def run():
+            persistence = StatePersistence(storage, durable=False)
+            engine = WorkflowEngine(persistence, max_finished=max_finished)
+            for _ in range(count):
+                workflow = engine.create_workflow("BenchFlow")
+                engine.record_event(workflow.id, "ActivityCompleted", _event_data(0))
+                if finish:
+                    engine.update_status(workflow.id, WorkflowStatus.COMPLETED)
+            persistence.sync()
+            return persistence, engine
+        return run
+
+    print(f"bytes per workflow ({count} workflows, max_finished={max_finished})")
+    for label, finish in (("pending", False), ("completed", True)):
+        storage = tempfile.mkdtemp(prefix="lf-bench-")
+        try:
+            print(f"  {label:<27}  {_measure(build(finish)) / count:>10.1f}")
+        finally:
+            shutil.rmtree(storage)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Engine memory footprint")
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--workflows', type=int, default=2000)
+    parser.add_argument('--max-finished', type=int, default=256)
+    parsed_args = parser.parse_args(args)
+
+    bench_events(parsed_args.events)
+    bench_idle_workflows(parsed_args.workflows, parsed_args.max_finished)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+from ..cli.main import cli_command, cli_env, parse_importtime
+from ..core.workflow import WorkflowEngine, WorkflowStatus
+from ..state.persistence import StatePersistence
+
+WORKFLOW_ID = "bench-startup"
+
+# name -> `lf` arguments; "python" is a bare interpreter, the floor for
+# every other command
+COMMANDS = {
+    "python": None,
+    "help": ["--help"],
+    "inspect": ["inspect", WORKFLOW_ID],
+    "list": ["list", "--limit", "10"],
+    "history": ["history", WORKFLOW_ID],
+}
+
+
+def _prepare(path: str, events: int):
+    persistence = StatePersistence(os.path.join(path, "storage"))
+    engine = WorkflowEngine(persistence)
+    engine.create_workflow("PurchaseFlow", WORKFLOW_ID)
+    engine.record_events(WORKFLOW_ID, [
+        ("ActivityCompleted", {"activity": f"step_{index}", "step": index, "result": "done"})
+        for index in range(events)
+    ])
+    engine.update_status(WORKFLOW_ID, WorkflowStatus.COMPLETED)
+    persistence.close()
+
+
+def _command(args: Optional[List[str]], python_flags=()) -> List[str]:
+    if args is None:
+        return [sys.executable, *python_flags, "-c", "pass"]
+    return cli_command(args, python_flags)
+
+
+def _time(command: List[str], cwd: str, env: Dict[str, str]) -> float:
+    started = time.perf_counter()
+    subprocess.run(command, cwd=cwd, env=env, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - started
+
+
+def _modules(args: Optional[List[str]], cwd: str, env: Dict[str, str]) -> int:
+    result = subprocess.run(_command(args, ("-X", "importtime")), cwd=cwd, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    return len(parse_importtime(result.stderr)[0])
+
+
+def run_benchmark(runs: int = 20, commands: Optional[List[str]] = None, events: int = 20) -> Dict[str, Any]:
+    names = commands or list(COMMANDS)
+    path = tempfile.mkdtemp(prefix="lf-startup-")
+    env = cli_env()
+    results = {}
+    try:
+        _prepare(path, events)
+        for name in names:
+            command = _command(COMMANDS[name])
+            # One untimed run, so every command starts with a warm page cache
+            _time(command, path, env)
+            timings = sorted(_time(command, path, env) * 1000 for _ in range(runs))
+            results[name] = {
+                "median_ms": timings[len(timings) // 2],
+                "p90_ms": timings[min(len(timings) - 1, int(len(timings) * 0.9))],
+                "min_ms": timings[0],
+                "modules": _modules(COMMANDS[name], path, env)
+            }
+    finally:
+        shutil.rmtree(path)
+    return {
+        "shape": {"runs": runs, "events": events},
+        "results": results,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.time()
+        }
+    }
+
+
+def format_results(run: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> str:
+    lines = [f"{'command':<10} {'median ms':>10} {'p90 ms':>8} {'min ms':>8} {'modules':>8}"]
+    for name, result in run["results"].items():
+        line = (f"{name:<10} {result['median_ms']:>10.1f} {result['p90_ms']:>8.1f} "
+                f"{result['min_ms']:>8.1f} {result['modules']:>8}")
+        previous = (baseline or {}).get("results", {}).get(name)
+        if previous:
+            change = result["median_ms"] / previous["median_ms"] - 1
+            line += f"  {change:+.1%} vs baseline"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def regressions(run: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    # Commands whose median grew by more than `tolerance` (0.2 is 20%)
+    # relative to the baseline
+    slower = []
+    for name, result in run["results"].items():
+        previous = baseline["results"].get(name)
+        if previous and result["median_ms"] > previous["median_ms"] * (1 + tolerance):
+            slower.append(name)
+    return slower
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Cold-start time of lf commands")
+    parser.add_argument('--runs', type=int, default=20, help='Timed runs per command')
+    parser.add_argument('--command', action='append', dest='commands', choices=list(COMMANDS),
+                        help='Only time this command (repeatable)')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare against results saved with --output')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='With --baseline, fail if a median is this fraction slower')
+    parsed_args = parser.parse_args(args)
+
+    run = run_benchmark(parsed_args.runs, parsed_args.commands)
+    baseline = None
+    if parsed_args.baseline:
+        with open(parsed_args.baseline) as f:
+            baseline = json.load(f)
+    print(format_results(run, baseline))
+    if parsed_args.output:
+        with open(parsed_args.output, 'w') as f:
+            json.dump(run, f, indent=2)
+    if baseline is not None:
+        slower = regressions(run, baseline, parsed_args.tolerance)
+        if slower:
+            print(f"Slower than baseline by more than {parsed_args.tolerance:.0%}: {', '.join(slower)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
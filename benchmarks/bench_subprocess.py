@@ -0,0 +1,44 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+from ..activities.workers import WorkerPool
+
+
+def bench_spawn(calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        subprocess.run([sys.executable, "-c", "pass"], capture_output=True)
+    return calls / (time.perf_counter() - start)
+
+
+def bench_pool(calls: int, workers: int) -> float:
+    pool = WorkerPool(max_workers=workers)
+    try:
+        # Warm every worker before timing
+        for future in [pool.submit(os.getpid) for _ in range(workers)]:
+            future.result()
+        start = time.perf_counter()
+        for future in [pool.submit(os.getpid) for _ in range(calls)]:
+            future.result()
+        return calls / (time.perf_counter() - start)
+    finally:
+        pool.shutdown()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Subprocess activity throughput: spawn per call vs worker pool")
+    parser.add_argument('--spawn-calls', type=int, default=50)
+    parser.add_argument('--pool-calls', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=4)
+    parsed_args = parser.parse_args(args)
+
+    spawn = bench_spawn(parsed_args.spawn_calls)
+    print(f"spawn per call:          {spawn:>10.0f} calls/sec")
+    pooled = bench_pool(parsed_args.pool_calls, parsed_args.workers)
+    print(f"worker pool ({parsed_args.workers} workers):  {pooled:>10.0f} calls/sec ({pooled / spawn:.0f}x)")
+
+
+if __name__ == '__main__':
+    main()
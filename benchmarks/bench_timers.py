@@ -0,0 +1,67 @@
+import argparse
+import random
+import shutil
+import tempfile
+import time
+from ..core.workflow import WorkflowEngine
+from ..state.persistence import StatePersistence
+from ..timers.scheduler import TimerScheduler
+
+
+def _rate(count: int, elapsed: float) -> str:
+    return f"{count / elapsed:>12.0f}/s"
+
+
+def bench_timers(count: int, cancel_fraction: float, batch: int, persistence=None):
+    engine = WorkflowEngine(persistence)
+    scheduler = TimerScheduler(engine)
+    rng = random.Random(42)
+
+    start = time.perf_counter()
+    timers = [scheduler.schedule_timer(f"workflow-{i}", rng.randint(1, 3600)) for i in range(count)]
+    print(f"  schedule {count:>9} timers  {_rate(count, time.perf_counter() - start)}")
+
+    cancelled = rng.sample(timers, int(count * cancel_fraction))
+    start = time.perf_counter()
+    for timer in cancelled:
+        scheduler.remove_timer(timer.id)
+    print(f"  cancel   {len(cancelled):>9} timers  {_rate(len(cancelled), time.perf_counter() - start)}")
+
+    # Fire everything by polling with a clock far in the future
+    now = time.time() + 7200
+    fired = 0
+    start = time.perf_counter()
+    while True:
+        ready = scheduler.get_ready_timers(limit=batch, now=now)
+        if not ready:
+            break
+        for timer in ready:
+            scheduler.remove_timer(timer.id)
+        fired += len(ready)
+    print(f"  fire     {fired:>9} timers  {_rate(fired, time.perf_counter() - start)}")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Timer scheduler throughput")
+    parser.add_argument('--timers', type=int, default=1000000)
+    parser.add_argument('--cancel-fraction', type=float, default=0.1)
+    parser.add_argument('--batch', type=int, default=1000)
+    parser.add_argument('--durable', action='store_true', help='Persist timers to a temporary store')
+    parsed_args = parser.parse_args(args)
+
+    print("in-memory scheduler")
+    bench_timers(parsed_args.timers, parsed_args.cancel_fraction, parsed_args.batch)
+
+    if parsed_args.durable:
+        storage = tempfile.mkdtemp(prefix="lf-bench-")
+        try:
+            persistence = StatePersistence(storage, durable=False)
+            print("persisted scheduler (no fsync)")
+            bench_timers(parsed_args.timers, parsed_args.cancel_fraction, parsed_args.batch, persistence)
+            persistence.close()
+        finally:
+            shutil.rmtree(storage)
+
+
+if __name__ == '__main__':
+    main()
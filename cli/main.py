@@ -1,16 +1,147 @@
 import argparse
+import os
 import sys
-from typing import List
-from ..core.workflow import WorkflowEngine, WorkflowStatus
-from ..dsl.parser import WorkflowParser
-from ..engine.executor import WorkflowExecutor
-from ..activities.runner import ActivityRunner
-from ..state.persistence import StatePersistence
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+# Each command imports the parts of the engine it uses when it runs, so
+# read-only commands such as `lf inspect` start without asyncio, the
+# executor or the activity runner. `lf --profile-startup <command>` shows
+# what a command imports and what that costs.
+if TYPE_CHECKING:
+    from ..core.clock import Clock
+    from ..engine.client import LocalFlowClient
+    from ..engine.executor import WorkflowExecutor
+    from ..engine.worker import WorkerReport
+    from ..state.catalog import WorkflowCatalog
+    from ..state.query import EventQuery
+
+
+STORAGE_PATH = "./storage"
+METRICS_FILE = "metrics.prom"
+
+SAMPLE_DEFINITIONS = """
+workflow PurchaseFlow {
+    step charge_card;
+    step send_email;
+    step update_crm;
+}
+"""
+
+
+# Sample activities
+def charge_card():
+    return "Card charged successfully"
+
+
+def send_email():
+    return "Email sent successfully"
+
+
+def update_crm():
+    return "CRM updated successfully"
+
+
+def build_executor(shard: Optional[Tuple[int, int]] = None, storage_path: str = STORAGE_PATH,
+                   workers: int = 4, definitions_dir: Optional[str] = None,
+                   clock: Optional["Clock"] = None) -> "WorkflowExecutor":
+    from ..activities.runner import ActivityRunner, ExecutionPolicy
+    from ..core.workflow import WorkflowEngine
+    from ..dsl.parser import PlanCache, WorkflowParser
+    from ..engine.executor import WorkflowExecutor
+    from ..state.persistence import StatePersistence
+    from ..timers.scheduler import TIMER_LOG, TimerScheduler
+
+    # A shard's store handle owns that shard's journal
+    persistence = StatePersistence(storage_path, shard=shard[0] if shard else None)
+    workflow_engine = WorkflowEngine(persistence, clock=clock)
+    activity_runner = ActivityRunner(ExecutionPolicy(max_workers=workers))
+    # The payment backend gets its own threads so a slow charge cannot
+    # starve the other activities
+    activity_runner.register_activity("charge_card", charge_card,
+                                      ExecutionPolicy(pool="payments", max_workers=workers))
+    activity_runner.register_activity("send_email", send_email)
+    activity_runner.register_activity("update_crm", update_crm)
+
+    # Each worker process logs the timers of its own shard of workflows. A
+    # workflow suspended under another process count gets its timer back
+    # from its history when the worker claims it.
+    timer_log = f"{TIMER_LOG}-{shard[0]}" if shard else TIMER_LOG
+    timer_scheduler = TimerScheduler(workflow_engine, log_name=timer_log)
+    executor = WorkflowExecutor(workflow_engine, activity_runner, timer_scheduler, workers)
+
+    parser = WorkflowParser(PlanCache(os.path.join(storage_path, "plans")))
+    sources = [SAMPLE_DEFINITIONS]
+    if definitions_dir:
+        for file_name in sorted(os.listdir(definitions_dir)):
+            if file_name.endswith(".lf"):
+                with open(os.path.join(definitions_dir, file_name)) as f:
+                    sources.append(f.read())
+    for source in sources:
+        name, steps = parser.parse(source)
+        executor.register_definition(name, steps)
+    return executor
+
+
+def workflow_status(value: str) -> str:
+    # An argparse type rather than choices, so building the parser does not
+    # import the engine
+    from ..core.workflow import WorkflowStatus
+    statuses = [s.value for s in WorkflowStatus]
+    if value not in statuses:
+        raise argparse.ArgumentTypeError(f"invalid status {value!r} (choose from {', '.join(statuses)})")
+    return value
+
+
+def query_time(value: str) -> float:
+    from ..state.query import parse_time
+    try:
+        return parse_time(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def duration(value: str) -> float:
+    from ..state.query import parse_duration
+    try:
+        return parse_duration(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def cli_command(args: List[str], python_flags: Tuple[str, ...] = ()) -> List[str]:
+    # `lf <args>` in a fresh interpreter; run it with cli_env()
+    code = f"import sys; from {__name__} import LocalFlowCLI; LocalFlowCLI().run(sys.argv[1:])"
+    return [sys.executable, *python_flags, "-c", code, *args]
+
+
+def cli_env() -> Dict[str, str]:
+    # The child imports from the same path as this process
+    return dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+
+
+def parse_importtime(output: str) -> Tuple[List[Tuple[int, int, int, str]], List[str]]:
+    # (self us, cumulative us, depth, module) per `-X importtime` line, in
+    # the order the imports finished, and the lines that were not timings
+    imports = []
+    other = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            other.append(line)
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|", 2)
+        if not own.strip().isdigit():
+            continue  # the header
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((int(own), int(cumulative), depth, name.strip()))
+    return imports, other
 
 
 class LocalFlowCLI:
     def __init__(self):
         self.parser = argparse.ArgumentParser(description="LocalFlow - Deterministic Workflow Engine")
+        self.parser.add_argument('--profile-startup', action='store_true',
+                                 help='Run the command in a fresh interpreter and report its import times')
         self.subparsers = self.parser.add_subparsers(dest='command')
         self._setup_commands()
 
@@ -18,9 +149,73 @@ class LocalFlowCLI:
         # start command
         start_parser = self.subparsers.add_parser('start', help='Start a new workflow')
         start_parser.add_argument('workflow_name', help='Name of the workflow to start')
+        start_parser.add_argument('--count', type=int, default=1, help='Start this many workflows')
+        start_parser.add_argument('--id', dest='workflow_id', help='Workflow ID to use (single start only)')
+        self._add_server_arguments(start_parser)
+
+        # signal command
+        signal_parser = self.subparsers.add_parser('signal', help='Send a signal to a workflow')
+        signal_parser.add_argument('workflow_id', help='ID of the workflow to signal')
+        signal_parser.add_argument('signal_name', help='Name of the signal')
+        signal_parser.add_argument('--payload', help='JSON payload to attach to the signal')
+        self._add_server_arguments(signal_parser)
+
+        # serve command
+        serve_parser = self.subparsers.add_parser(
+            'serve', help='Accept start, signal and query requests on a local socket'
+        )
+        self._add_server_arguments(serve_parser)
+        serve_parser.add_argument('--run', action='store_true',
+                                  help='Also run workflows in this process, as `lf run --follow` does')
+        serve_parser.add_argument('--workers', type=int, default=4, help='Activity threads (with --run)')
+        serve_parser.add_argument('--max-inflight', type=int, default=64,
+                                  help='Maximum workflows executing at once (with --run)')
+        serve_parser.add_argument('--poll-interval', type=float, default=1.0,
+                                  help='Seconds between polls for work started elsewhere (with --run)')
+        serve_parser.add_argument('--definitions', help='Directory of .lf workflow definitions')
+        self._add_retention_arguments(serve_parser)
 
         # run command
-        self.subparsers.add_parser('run', help='Run all pending workflows')
+        run_parser = self.subparsers.add_parser('run', help='Run all pending workflows')
+        run_parser.add_argument('--workers', type=int, default=4, help='Activity threads per process')
+        run_parser.add_argument('--max-inflight', type=int, default=64,
+                                help='Maximum workflows executing at once per process')
+        run_parser.add_argument('--processes', type=int, default=1,
+                                help='Split workflows across this many worker processes')
+        run_parser.add_argument('--follow', action='store_true',
+                                help='Keep polling for new work instead of exiting when idle')
+        run_parser.add_argument('--poll-interval', type=float, default=1.0,
+                                help='Seconds between polls in --follow mode')
+        run_parser.add_argument('--definitions', help='Directory of .lf workflow definitions')
+        run_parser.add_argument('--virtual-time', action='store_true',
+                                help='Skip ahead to each pending timer instead of waiting for it')
+        run_parser.add_argument('--metrics', action='store_true',
+                                help=f'Collect metrics and write them to {METRICS_FILE} in the storage directory')
+        run_parser.add_argument('--metrics-port', type=int,
+                                help='Collect metrics and serve them over HTTP on this port (plus shard index)')
+        self._add_retention_arguments(run_parser)
+
+        # compact command
+        compact_parser = self.subparsers.add_parser(
+            'compact', help='Move finished workflows past their retention period into the archive'
+        )
+        compact_parser.add_argument('--older-than', type=duration, default='7d',
+                                    help='Archive workflows that finished this long ago, e.g. 12h or 30d (default 7d)')
+        compact_parser.add_argument('--compression', choices=['gzip', 'lzma'], default='gzip',
+                                    help='gzip is faster, lzma smaller on large histories')
+        compact_parser.add_argument('--batch', type=int, default=500, help='Workflows archived per batch')
+
+        # stats command
+        stats_parser = self.subparsers.add_parser('stats', help='Summarize metrics from running workers')
+        stats_parser.add_argument('--url', help='Read metrics from this HTTP endpoint instead of the storage directory')
+        stats_parser.add_argument('--watch', type=float, metavar='SECONDS',
+                                  help='Refresh the summary every SECONDS until interrupted')
+
+        # bench command; its arguments belong to the benchmark module, which
+        # is only imported when the command runs
+        self.subparsers.add_parser(
+            'bench', help='Benchmark the engine end to end on synthetic workflows', add_help=False
+        )
 
         # inspect command
         inspect_parser = self.subparsers.add_parser('inspect', help='Inspect a workflow')
@@ -29,79 +224,490 @@ class LocalFlowCLI:
         # history command
         history_parser = self.subparsers.add_parser('history', help='Show workflow history')
         history_parser.add_argument('workflow_id', help='ID of the workflow to show history for')
+        history_parser.add_argument('--since-seq', type=int, help='Only show events from this sequence number on')
+        history_parser.add_argument('--type', action='append', dest='types', metavar='TYPE',
+                                    help='Only show events of this type (repeatable)')
+        history_parser.add_argument('--tail', type=int, help='Only show the last N matching events')
+        history_parser.add_argument('--follow', action='store_true',
+                                    help='Keep printing new events until the workflow completes or fails')
+        history_parser.add_argument('--poll-interval', type=float, default=0.5,
+                                    help='Seconds between checks for new events in --follow mode')
 
         # list command
-        self.subparsers.add_parser('list', help='List all workflows')
+        list_parser = self.subparsers.add_parser('list', help='List all workflows')
+        list_parser.add_argument('--status', type=workflow_status,
+                                 help='Only show workflows with this status (pending, running, completed or failed)')
+        list_parser.add_argument('--name', help='Only show workflows with this name')
+        list_parser.add_argument('--limit', type=int, default=100, help='Maximum number of workflows to show')
+        list_parser.add_argument('--offset', type=int, default=0, help='Number of workflows to skip')
+        list_parser.add_argument('--rebuild-index', action='store_true',
+                                 help='Rebuild the workflow catalog from storage first')
+
+        # query and export commands
+        query_parser = self.subparsers.add_parser('query', help='Aggregate events across stored workflows')
+        self._add_filter_arguments(query_parser)
+        query_parser.add_argument('--aggregate', default='activities',
+                                  choices=['activities', 'types', 'workflows', 'durations'],
+                                  help='Failure rate and timings per activity (default), event counts per '
+                                       'type, workflows per name and status, or per-activity timing buckets')
+        query_parser.add_argument('--format', choices=['table', 'jsonl', 'csv'], default='table')
+        export_parser = self.subparsers.add_parser('export', help='Stream matching events as JSON Lines or CSV')
+        self._add_filter_arguments(export_parser)
+        export_parser.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl')
+        export_parser.add_argument('--output', help='Write to this file instead of standard output')
+        export_parser.add_argument('--limit', type=int, help='Stop after this many events')
+
+    @staticmethod
+    def _add_retention_arguments(parser: argparse.ArgumentParser):
+        parser.add_argument('--retention', type=duration, metavar='AGE',
+                            help='With --follow or --run, archive workflows that finished longer ago than AGE, '
+                                 'e.g. 30d, in the background')
+        parser.add_argument('--retention-interval', type=float, default=60.0,
+                            help='Seconds between background archiving passes')
+
+    @staticmethod
+    def _add_filter_arguments(parser: argparse.ArgumentParser):
+        parser.add_argument('--name', action='append', dest='names', metavar='NAME',
+                            help='Only workflows with this name (repeatable)')
+        parser.add_argument('--status', action='append', dest='statuses', metavar='STATUS', type=workflow_status,
+                            help='Only workflows with this status (repeatable)')
+        parser.add_argument('--workflow', action='append', dest='workflow_ids', metavar='ID',
+                            help='Only this workflow (repeatable)')
+        parser.add_argument('--type', action='append', dest='types', metavar='TYPE',
+                            help='Only events of this type (repeatable)')
+        parser.add_argument('--activity', action='append', dest='activities', metavar='ACTIVITY',
+                            help='Only events of this activity (repeatable)')
+        parser.add_argument('--since', type=query_time,
+                            help='Only events at or after this time: epoch seconds, an ISO date or datetime, '
+                                 'today, yesterday, or an age such as 30m, 24h or 7d')
+        parser.add_argument('--until', type=query_time, help='Only events before this time (same forms as --since)')
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                            help='Read histories in this many processes (default: one per CPU)')
+
+    @staticmethod
+    def _event_query(parsed_args: argparse.Namespace) -> "EventQuery":
+        from ..state.query import EventQuery
+        return EventQuery(names=parsed_args.names, statuses=parsed_args.statuses,
+                          workflow_ids=parsed_args.workflow_ids, types=parsed_args.types,
+                          activities=parsed_args.activities, since=parsed_args.since, until=parsed_args.until)
+
+    @staticmethod
+    def _add_server_arguments(parser: argparse.ArgumentParser):
+        parser.add_argument('--socket', help='Unix socket of `lf serve` (default: lf.sock in the storage directory)')
+        parser.add_argument('--port', type=int, help='Use a localhost TCP port instead of the Unix socket')
+
+    @staticmethod
+    def _socket_path(parsed_args: argparse.Namespace) -> str:
+        from ..engine.client import SOCKET_FILE
+        return parsed_args.socket or os.path.join(STORAGE_PATH, SOCKET_FILE)
+
+    def _client(self, parsed_args: argparse.Namespace) -> Optional["LocalFlowClient"]:
+        # None when no server is listening; the command then works on the
+        # store directly
+        from ..engine.client import LocalFlowClient
+        client = LocalFlowClient(self._socket_path(parsed_args), parsed_args.port)
+        try:
+            return client.connect()
+        except OSError:
+            return None
+
+    @staticmethod
+    def _catalog() -> Optional["WorkflowCatalog"]:
+        # Read-only commands query the catalog as of the last sync instead
+        # of opening the store, which claims and replays a journal
+        from ..state.catalog import CATALOG_FILE, WorkflowCatalog
+        path = os.path.join(STORAGE_PATH, CATALOG_FILE)
+        if not os.path.exists(path):
+            return None
+        return WorkflowCatalog(path)
+
+    def _serve(self, parsed_args: argparse.Namespace):
+        import asyncio
+        import signal
+        from ..engine.server import WorkflowServer
+        from ..engine.worker import WorkflowWorker
+
+        executor = build_executor(storage_path=STORAGE_PATH, workers=parsed_args.workers,
+                                  definitions_dir=parsed_args.definitions)
+
+        async def serve():
+            worker = None
+            if parsed_args.run:
+                worker = WorkflowWorker(executor, max_inflight=parsed_args.max_inflight, follow=True,
+                                        poll_interval=parsed_args.poll_interval, retention=parsed_args.retention,
+                                        retention_interval=parsed_args.retention_interval)
+            server = WorkflowServer(
+                executor.workflow_engine,
+                evict_started=worker is None,
+                on_start=(lambda ids: worker.wake()) if worker else None
+            )
+            socket_path = self._socket_path(parsed_args)
+            await server.listen(socket_path, parsed_args.port)
+            where = f"127.0.0.1:{server.port}" if parsed_args.port is not None else socket_path
+            print(f"Listening on {where}", flush=True)
+            main = asyncio.current_task()
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main.cancel)
+            try:
+                if worker is not None:
+                    await worker.run()
+                else:
+                    await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                pass
+            finally:
+                await server.close()
+                print(f"Served {server.requests} requests")
+                if worker is not None:
+                    self._print_report(worker.report)
+
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            executor.workflow_engine.persistence.close()
+
+    def _start(self, parsed_args: argparse.Namespace):
+        names = [parsed_args.workflow_name] * parsed_args.count
+        if parsed_args.workflow_id:
+            names = [{"name": parsed_args.workflow_name, "id": parsed_args.workflow_id}]
+        client = self._client(parsed_args)
+        if client is not None:
+            with client:
+                ids = client.start_many(names)
+        else:
+            from ..core.workflow import WorkflowEngine
+            from ..state.persistence import StatePersistence
+            # Safe next to a running worker: a new workflow's files are
+            # written before the catalog lists it, and the worker only
+            # finds work through the catalog
+            persistence = StatePersistence(STORAGE_PATH)
+            workflow_engine = WorkflowEngine(persistence)
+            if parsed_args.workflow_id and persistence.catalog.get(parsed_args.workflow_id):
+                ids = [parsed_args.workflow_id]
+            else:
+                ids = [workflow_engine.create_workflow(parsed_args.workflow_name, parsed_args.workflow_id).id
+                       for _ in names]
+            persistence.close()
+        if len(ids) == 1:
+            print(f"Started workflow: {ids[0]}")
+        else:
+            print(f"Started {len(ids)} {parsed_args.workflow_name} workflows")
+
+    def _signal(self, parsed_args: argparse.Namespace):
+        import json
+        from ..engine.client import ClientError
+
+        payload = json.loads(parsed_args.payload) if parsed_args.payload else None
+        client = self._client(parsed_args)
+        if client is not None:
+            with client:
+                try:
+                    event_id = client.signal(parsed_args.workflow_id, parsed_args.signal_name, payload)
+                except ClientError as e:
+                    print(e)
+                    return
+        else:
+            from ..core.workflow import WorkflowEngine
+            from ..engine.server import SIGNAL_EVENT, signal_rejection
+            from ..state.persistence import StatePersistence
+            persistence = StatePersistence(STORAGE_PATH)
+            workflow_engine = WorkflowEngine(persistence)
+            try:
+                if persistence.live_journals():
+                    # A running worker may be appending to this workflow's
+                    # history too
+                    print(f"{STORAGE_PATH} is open in another process; signal through its server "
+                          f"(lf serve --run) or stop it first")
+                    return
+                rejection = signal_rejection(workflow_engine.resume_workflow(parsed_args.workflow_id))
+                if rejection is not None:
+                    print(rejection)
+                    return
+                event_id = workflow_engine.record_event(
+                    parsed_args.workflow_id, SIGNAL_EVENT,
+                    {"signal": parsed_args.signal_name, "payload": payload}
+                ).id
+            except (ValueError, FileNotFoundError):
+                print(f"Workflow {parsed_args.workflow_id} not found")
+                return
+            finally:
+                persistence.close()
+        print(f"Signalled workflow {parsed_args.workflow_id}: event #{event_id}")
+
+    def _run(self, parsed_args: argparse.Namespace):
+        import asyncio
+        import functools
+        from ..core.clock import VirtualClock
+        from ..engine.worker import WorkflowWorker, run_worker_processes
+
+        print("Running workflows...")
+        options = dict(
+            max_inflight=parsed_args.max_inflight,
+            follow=parsed_args.follow,
+            poll_interval=parsed_args.poll_interval,
+            metrics_path=os.path.join(STORAGE_PATH, METRICS_FILE) if parsed_args.metrics else None,
+            metrics_port=parsed_args.metrics_port,
+            retention=parsed_args.retention,
+            retention_interval=parsed_args.retention_interval
+        )
+        setup = functools.partial(
+            build_executor,
+            storage_path=STORAGE_PATH,
+            workers=parsed_args.workers,
+            definitions_dir=parsed_args.definitions,
+            # Virtual time starts now, so timers already on disk keep
+            # their place in line
+            clock=VirtualClock(time.time()) if parsed_args.virtual_time else None
+        )
+        # Workers open their own handles on the store
+        if parsed_args.processes > 1:
+            report = run_worker_processes(setup, parsed_args.processes, **options)
+        else:
+            worker_executor = setup()
+            try:
+                report = asyncio.run(WorkflowWorker(worker_executor, **options).run())
+            finally:
+                worker_executor.workflow_engine.persistence.close()
+        self._print_report(report)
+
+    @staticmethod
+    def _print_report(report: "WorkerReport"):
+        print(report.summary())
+        for error in report.errors:
+            print(f"Error: {error}")
+
+    def _inspect(self, parsed_args: argparse.Namespace):
+        workflow_id = parsed_args.workflow_id
+        catalog = self._catalog()
+        entry = catalog.get(workflow_id) if catalog else None
+        if catalog:
+            catalog.close()
+        if entry:
+            print(f"Workflow ID: {entry.id}")
+            print(f"Name: {entry.name}")
+            print(f"Status: {entry.status}")
+            print(f"Events: {entry.event_count}")
+            if entry.archive_position is not None:
+                print("Archived: yes")
+            return
+        # Not in the catalog: a store written before it existed
+        from ..state.persistence import StatePersistence
+        persistence = StatePersistence(STORAGE_PATH)
+        try:
+            workflow = persistence.load_workflow(workflow_id)
+            print(f"Workflow ID: {workflow.id}")
+            print(f"Name: {workflow.name}")
+            print(f"Status: {workflow.status.value}")
+            print(f"Events: {len(workflow.events)}")
+        except FileNotFoundError:
+            print(f"Workflow {workflow_id} not found")
+        finally:
+            persistence.close()
+
+    def _history(self, parsed_args: argparse.Namespace):
+        import itertools
+        from ..state.persistence import read_history
+
+        workflow_id = parsed_args.workflow_id
+        # Only consulted for archived workflows
+        catalog = self._catalog()
+        events = read_history(
+            STORAGE_PATH,
+            workflow_id,
+            catalog,
+            since_seq=parsed_args.since_seq,
+            types=parsed_args.types,
+            tail=parsed_args.tail,
+            follow=parsed_args.follow,
+            poll_interval=parsed_args.poll_interval
+        )
+        try:
+            # An unknown workflow raises on the first read; after that
+            # events print as they stream in
+            first = next(events, None)
+            print(f"History for workflow {workflow_id}:")
+            for event in itertools.chain([first] if first is not None else [], events):
+                print(f"  #{event.id} [{event.timestamp}] {event.type}: {event.data}", flush=True)
+        except FileNotFoundError:
+            print(f"Workflow {workflow_id} not found")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if catalog is not None:
+                catalog.close()
+
+    def _list(self, parsed_args: argparse.Namespace):
+        persistence = None
+        if parsed_args.rebuild_index:
+            from ..state.persistence import StatePersistence
+            persistence = StatePersistence(STORAGE_PATH)
+            persistence.rebuild_catalog()
+            catalog = persistence.catalog
+        else:
+            catalog = self._catalog()
+        print("Workflows:")
+        if catalog is None:
+            return
+        entries = catalog.list(
+            status=parsed_args.status,
+            name=parsed_args.name,
+            limit=parsed_args.limit,
+            offset=parsed_args.offset
+        )
+        total = catalog.count(status=parsed_args.status, name=parsed_args.name)
+        for entry in entries:
+            print(f"  {entry.id} - {entry.name} ({entry.status})")
+        if parsed_args.offset + len(entries) < total:
+            print(f"  ... showing {len(entries)} of {total}, use --offset to see more")
+        if persistence is not None:
+            persistence.close()
+        else:
+            catalog.close()
+
+    def _compact(self, parsed_args: argparse.Namespace):
+        from ..state.archive import archive_path
+        from ..state.persistence import StatePersistence
+        persistence = StatePersistence(STORAGE_PATH)
+        total = 0
+        try:
+            while True:
+                archived = persistence.archive_finished(parsed_args.older_than, limit=parsed_args.batch,
+                                                        compression=parsed_args.compression)
+                total += archived
+                if archived < parsed_args.batch:
+                    break
+        finally:
+            persistence.close()
+        directory = archive_path(STORAGE_PATH)
+        size = 0
+        if os.path.isdir(directory):
+            size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        print(f"Archived {total} workflows; the archive holds {size / 1024:,.1f} KB")
+
+    def _query(self, parsed_args: argparse.Namespace):
+        from ..state.query import aggregate_events, format_rows
+        aggregate = aggregate_events(STORAGE_PATH, self._event_query(parsed_args), parsed_args.aggregate,
+                                     parsed_args.processes)
+        rows = aggregate.rows()
+        if not rows and parsed_args.format == 'table':
+            print("No matching events")
+            return
+        for line in format_rows(rows, parsed_args.format):
+            print(line)
+
+    def _export(self, parsed_args: argparse.Namespace):
+        from ..state.query import export_events
+        lines = export_events(STORAGE_PATH, self._event_query(parsed_args), parsed_args.format,
+                              parsed_args.processes, parsed_args.limit)
+        output = open(parsed_args.output, 'w', newline='') if parsed_args.output else sys.stdout
+        try:
+            for line in lines:
+                output.write(line + "\n")
+        except BrokenPipeError:
+            # `lf export | head`; stdout goes nowhere from here on, so the
+            # flush at exit does not fail again
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        finally:
+            lines.close()
+            if output is not sys.stdout:
+                output.close()
+
+    def _stats(self, parsed_args: argparse.Namespace):
+        from ..core import metrics
+
+        url, watch = parsed_args.url, parsed_args.watch
+        while True:
+            if url:
+                import urllib.request
+                with urllib.request.urlopen(url) as response:
+                    texts = [response.read().decode("utf-8")]
+            else:
+                # One file per worker process; their samples are added up
+                texts = []
+                for path in metrics.textfiles(os.path.join(STORAGE_PATH, METRICS_FILE)):
+                    with open(path) as f:
+                        texts.append(f.read())
+            if not texts:
+                print("No metrics found; start a worker with `lf run --metrics`")
+                return
+            samples = {}
+            for text in texts:
+                for key, value in metrics.parse_text(text).items():
+                    samples[key] = samples.get(key, 0.0) + value
+            if watch:
+                print("\033[2J\033[H", end="")
+            print(f"Metrics at {time.strftime('%H:%M:%S')}:")
+            for line in metrics.summarize(samples):
+                print(line)
+            if not watch:
+                return
+            try:
+                time.sleep(watch)
+            except KeyboardInterrupt:
+                return
+
+    def _bench(self, bench_args: List[str]):
+        # Runs against its own temporary store
+        from ..benchmarks import bench_engine
+        parser = argparse.ArgumentParser(prog=f"{self.parser.prog} bench",
+                                         description="End-to-end engine throughput and latency")
+        bench_engine.add_arguments(parser)
+        bench_engine.run_from_args(parser.parse_args(bench_args))
+
+    def _profile_startup(self, args: List[str], top: int = 15):
+        # A fresh interpreter, so every import the command needs is counted
+        import subprocess
+        started = time.perf_counter()
+        result = subprocess.run(cli_command(args, ("-X", "importtime")),
+                                stderr=subprocess.PIPE, text=True, env=cli_env())
+        elapsed = time.perf_counter() - started
+        imports, other = parse_importtime(result.stderr)
+        for line in other:
+            print(line, file=sys.stderr)
+        total = sum(cumulative for _, cumulative, depth, _ in imports if depth == 0)
+        print(f"\nStartup profile of `lf {' '.join(args)}`: {elapsed * 1000:.1f}ms wall, "
+              f"{total / 1000:.1f}ms importing {len(imports)} modules")
+        print("Slowest imports (cumulative / self, ms):")
+        for own, cumulative, _, name in sorted(imports, key=lambda i: i[1], reverse=True)[:top]:
+            print(f"  {cumulative / 1000:8.1f} {own / 1000:8.1f}  {name}")
+        package = __name__.split(".")[0]
+        ours = [i for i in imports if i[3].split(".")[0] == package]
+        print(f"{package} modules loaded: {len(ours)}")
+        for own, cumulative, _, name in ours:
+            print(f"  {cumulative / 1000:8.1f} {own / 1000:8.1f}  {name}")
+        return result.returncode
 
     def run(self, args: List[str] = None):
-        parsed_args = self.parser.parse_args(args)
-        
+        if args is None:
+            args = sys.argv[1:]
+        # Unknown arguments are only accepted for `bench`, which parses its own
+        parsed_args, extra_args = self.parser.parse_known_args(args)
+
+        if parsed_args.profile_startup:
+            return self._profile_startup([arg for arg in args if arg != '--profile-startup'])
+
         if not parsed_args.command:
             self.parser.print_help()
             return
 
-        # Initialize components
-        workflow_engine = WorkflowEngine()
-        parser = WorkflowParser()
-        activity_runner = ActivityRunner()
-        persistence = StatePersistence("./storage")
-
-        # Setup some sample activities
-        def charge_card():
-            return "Card charged successfully"
-        
-        def send_email():
-            return "Email sent successfully"
-            
-        def update_crm():
-            return "CRM updated successfully"
-
-        activity_runner.register_activity("charge_card", charge_card)
-        activity_runner.register_activity("send_email", send_email)
-        activity_runner.register_activity("update_crm", update_crm)
-
-        executor = WorkflowExecutor(workflow_engine, activity_runner.run_activity)
-
-        if parsed_args.command == 'start':
-            workflow_name = parsed_args.workflow_name
-            workflow = workflow_engine.create_workflow(workflow_name)
-            persistence.save_workflow(workflow)
-            print(f"Started workflow: {workflow.id}")
-            
-        elif parsed_args.command == 'run':
-            # In a real implementation, this would process all pending workflows
-            print("Running workflows...")
-            
-        elif parsed_args.command == 'inspect':
-            workflow_id = parsed_args.workflow_id
-            try:
-                workflow = persistence.load_workflow(workflow_id)
-                print(f"Workflow ID: {workflow.id}")
-                print(f"Name: {workflow.name}")
-                print(f"Status: {workflow.status.value}")
-                print(f"Events: {len(workflow.events)}")
-            except FileNotFoundError:
-                print(f"Workflow {workflow_id} not found")
-                
-        elif parsed_args.command == 'history':
-            workflow_id = parsed_args.workflow_id
-            try:
-                workflow = persistence.load_workflow(workflow_id)
-                print(f"History for workflow {workflow_id}:")
-                for event in workflow.events:
-                    print(f"  [{event.timestamp}] {event.type}: {event.data}")
-            except FileNotFoundError:
-                print(f"Workflow {workflow_id} not found")
-                
-        elif parsed_args.command == 'list':
-            # List all workflows from storage
-            import os
-            files = [f for f in os.listdir("./storage") if f.endswith(".json") and f != "event_log.json"]
-            print("Workflows:")
-            for file in files:
-                workflow_id = file.replace(".json", "")
-                try:
-                    workflow = persistence.load_workflow(workflow_id)
-                    print(f"  {workflow.id} - {workflow.name} ({workflow.status.value})")
-                except Exception:
-                    print(f"  {workflow_id} - [corrupted]")
\ No newline at end of file
+        if parsed_args.command == 'bench':
+            self._bench(extra_args)
+            return
+        if extra_args:
+            self.parser.error(f"unrecognized arguments: {' '.join(extra_args)}")
+
+        handlers = {
+            'start': self._start,
+            'signal': self._signal,
+            'serve': self._serve,
+            'run': self._run,
+            'inspect': self._inspect,
+            'history': self._history,
+            'list': self._list,
+            'compact': self._compact,
+            'query': self._query,
+            'export': self._export,
+            'stats': self._stats,
+        }
+        handlers[parsed_args.command](parsed_args)
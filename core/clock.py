@@ -0,0 +1,85 @@
+import heapq
+import time
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import asyncio
+
+
+class Clock:
+    # Workflow time: event timestamps, timer fire times and in-process
+    # waits all read it. The base class is the wall clock.
+    virtual = False
+
+    def time(self) -> float:
+        return time.time()
+
+    async def sleep(self, seconds: float):
+        # asyncio is imported on first use, so tools that only read the
+        # store start without it
+        import asyncio
+        await asyncio.sleep(seconds)
+
+
+SYSTEM_CLOCK = Clock()
+
+
+class VirtualClock(Clock):
+    # Time only moves when it is advanced. With auto_advance, a sleep does
+    # not wait: once the tasks that are already runnable have had their
+    # turn, the clock jumps to the earliest pending wake-up. A two hour
+    # wait takes a few loop iterations.
+    virtual = True
+
+    def __init__(self, start: float = 0.0, auto_advance: bool = True):
+        self.now = start
+        self.auto_advance = auto_advance
+        # (wake time, sequence, future)
+        self._sleepers: List[Tuple[float, int, "asyncio.Future"]] = []
+        self._sequence = 0
+        self._advance_scheduled = False
+
+    def time(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        import asyncio
+        if seconds <= 0:
+            await asyncio.sleep(0)
+            return
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._sequence += 1
+        heapq.heappush(self._sleepers, (self.now + seconds, self._sequence, future))
+        self._schedule_advance(loop)
+        await future
+
+    def _schedule_advance(self, loop: "asyncio.AbstractEventLoop"):
+        if self.auto_advance and not self._advance_scheduled:
+            self._advance_scheduled = True
+            loop.call_soon(self._advance_to_next, loop)
+
+    def _advance_to_next(self, loop: "asyncio.AbstractEventLoop"):
+        # One wake-up time per turn: the sleepers woken here run before the
+        # clock moves again
+        self._advance_scheduled = False
+        while self._sleepers and self._sleepers[0][2].done():
+            heapq.heappop(self._sleepers)  # cancelled
+        if self._sleepers:
+            self.advance_to(self._sleepers[0][0])
+        if self._sleepers:
+            self._schedule_advance(loop)
+
+    def next_wakeup(self) -> Optional[float]:
+        return self._sleepers[0][0] if self._sleepers else None
+
+    def advance(self, seconds: float):
+        self.advance_to(self.now + seconds)
+
+    def advance_to(self, when: float):
+        # Never moves backwards; wakes every sleeper that is due, in order
+        self.now = max(self.now, when)
+        while self._sleepers and self._sleepers[0][0] <= self.now:
+            _, _, future = heapq.heappop(self._sleepers)
+            if not future.done():
+                future.set_result(None)
@@ -0,0 +1,296 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+# Seconds, from 50us to 60s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Counter:
+    def __init__(self, labels: Tuple[Tuple[str, str], ...] = ()):
+        self.labels = labels
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float], labels: Tuple[Tuple[str, str], ...] = ()):
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # Per bucket, not cumulative; the last slot is +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Family:
+    # A named metric and its children, one per combination of label values
+    def __init__(self, kind: str, name: str, help: str, label_names: Tuple[str, ...],
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self.children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not label_names:
+            self._default = self.labels()
+
+    def labels(self, *values: str):
+        child = self.children.get(values)
+        if child is None:
+            with self._lock:
+                child = self.children.get(values)
+                if child is None:
+                    pairs = tuple(zip(self.label_names, values))
+                    child = Counter(pairs) if self.kind == "counter" else Histogram(self.buckets, pairs)
+                    self.children[values] = child
+        return child
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+
+class Registry:
+    def __init__(self):
+        # Instrumented code checks this before doing any work, so a
+        # disabled registry costs one attribute read per call site
+        self.enabled = False
+        self.families: Dict[str, Family] = {}
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Family:
+        return self._family("counter", name, help, labels)
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Family:
+        return self._family("histogram", name, help, labels, buckets)
+
+    def _family(self, kind: str, name: str, help: str, labels: Tuple[str, ...],
+                buckets: Sequence[float] = LATENCY_BUCKETS) -> Family:
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = Family(kind, name, help, labels, buckets)
+        return family
+
+    @contextmanager
+    def span(self, histogram: Family, *labels: str) -> Iterator[None]:
+        # Times the block into the histogram; for code off the hottest paths
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            target = histogram.labels(*labels) if labels else histogram
+            target.observe(time.perf_counter() - started)
+
+    def render(self) -> str:
+        # Prometheus text exposition format
+        lines: List[str] = []
+        for family in self.families.values():
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for child in list(family.children.values()):
+                if family.kind == "counter":
+                    lines.append(f"{family.name}{_labels(child.labels)} {child.value:g}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(child.buckets + (float("inf"),), child.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f"{family.name}_bucket{_labels(child.labels + (('le', le),))} {cumulative}")
+                lines.append(f"{family.name}_sum{_labels(child.labels)} {child.sum:g}")
+                lines.append(f"{family.name}_count{_labels(child.labels)} {child.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        # Atomic, for the node_exporter textfile collector and `lf stats`
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+def _labels(pairs: Tuple[Tuple[str, str], ...]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+REGISTRY = Registry()
+
+
+def enable(registry: Registry = REGISTRY):
+    registry.enabled = True
+
+
+def start_textfile_writer(path: str, interval: float = 5.0,
+                          registry: Registry = REGISTRY) -> Callable[[], None]:
+    # Rewrites the file every interval until the returned function is
+    # called, which writes it a last time with the final values
+    stopped = threading.Event()
+
+    def write():
+        while not stopped.wait(interval):
+            registry.write_textfile(path)
+
+    thread = threading.Thread(target=write, name="metrics-textfile", daemon=True)
+    thread.start()
+
+    def stop():
+        stopped.set()
+        thread.join()
+        registry.write_textfile(path)
+    return stop
+
+
+def shard_textfile(path: str, index: int) -> str:
+    root, extension = os.path.splitext(path)
+    return f"{root}-{index}{extension}"
+
+
+def _shard_textfiles(path: str) -> Dict[int, str]:
+    root, extension = os.path.splitext(path)
+    directory = os.path.dirname(path) or "."
+    prefix = os.path.basename(root) + "-"
+    found: Dict[int, str] = {}
+    if not os.path.isdir(directory):
+        return found
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(extension):
+            index = name[len(prefix):len(name) - len(extension)]
+            if index.isdigit():
+                found[int(index)] = os.path.join(directory, name)
+    return found
+
+
+def textfiles(path: str) -> List[str]:
+    # The files written for ``path``: one per shard when workers run in
+    # several processes, else ``path`` itself. Only one layout is read, so
+    # files left by a run with another process count are never added in.
+    shards = _shard_textfiles(path)
+    if shards:
+        return [shards[index] for index in sorted(shards)]
+    return [path] if os.path.exists(path) else []
+
+
+def remove_stale_textfiles(path: str, shard_count: Optional[int] = None):
+    # Removes the files for ``path`` that a run with ``shard_count`` shards
+    # (None: one unsharded process) does not write itself
+    stale = [p for index, p in _shard_textfiles(path).items() if shard_count is None or index >= shard_count]
+    if shard_count is not None:
+        stale.append(path)
+    for stale_path in stale:
+        try:
+            os.remove(stale_path)
+        except FileNotFoundError:
+            pass
+
+
+def serve_http(port: int, host: str = "127.0.0.1", registry: Registry = REGISTRY) -> "ThreadingHTTPServer":
+    # Imported here: every process loads this module, few serve metrics
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def parse_text(text: str) -> Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]:
+    # (sample name, labels) -> value, for the subset of the format render()
+    # writes; samples that appear in several files are added up
+    samples: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        series, value = line.rsplit(" ", 1)
+        labels: Tuple[Tuple[str, str], ...] = ()
+        if "{" in series:
+            series, raw = series[:-1].split("{", 1)
+            labels = tuple(
+                (name, quoted.strip('"'))
+                for name, quoted in (pair.split("=", 1) for pair in raw.split(",") if pair)
+            )
+        key = (series, labels)
+        samples[key] = samples.get(key, 0.0) + float(value)
+    return samples
+
+
+def histogram_quantile(buckets: List[Tuple[float, float]], quantile: float) -> Optional[float]:
+    # Upper bound of the bucket holding the quantile, from (le, cumulative)
+    # pairs sorted by le
+    if not buckets or not buckets[-1][1]:
+        return None
+    rank = quantile * buckets[-1][1]
+    for bound, cumulative in buckets:
+        if cumulative >= rank:
+            return bound
+    return buckets[-1][0]
+
+
+def summarize(samples: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]) -> List[str]:
+    lines = []
+    histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[Tuple[float, float]]] = {}
+    for (series, labels), value in samples.items():
+        if series.endswith("_bucket"):
+            le = dict(labels)["le"]
+            rest = tuple(pair for pair in labels if pair[0] != "le")
+            histograms.setdefault((series[:-len("_bucket")], rest), []).append(
+                (float("inf") if le == "+Inf" else float(le), value)
+            )
+    for (series, labels), value in sorted(samples.items()):
+        if series.endswith(("_bucket", "_sum", "_count")):
+            continue
+        lines.append(f"  {series}{_labels(labels)}: {value:g}")
+    for (name, labels), buckets in sorted(histograms.items()):
+        buckets.sort()
+        count = samples.get((f"{name}_count", labels), 0.0)
+        if not count:
+            continue
+        mean = samples.get((f"{name}_sum", labels), 0.0) / count
+        p50 = histogram_quantile(buckets, 0.5)
+        p99 = histogram_quantile(buckets, 0.99)
+        lines.append(
+            f"  {name}{_labels(labels)}: count {count:g}, mean {mean * 1000:.3f}ms, "
+            f"p50 <= {p50 * 1000:g}ms, p99 <= {p99 * 1000:g}ms"
+        )
+    return lines
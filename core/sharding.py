@@ -0,0 +1,129 @@
+import asyncio
+import uuid
+from collections import ChainMap
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from .clock import Clock
+from .workflow import (
+    EventTransaction, WorkflowEngine, WorkflowEvent, WorkflowInstance, WorkflowStatus, shard_of
+)
+from ..state.catalog import WorkflowCatalog
+from ..state.persistence import StatePersistence
+
+
+class ShardedPersistence:
+    # The store as the timer scheduler and the worker see it through a
+    # sharded engine. Calls about one workflow go to its shard's handle;
+    # store-wide ones (the catalog, named logs such as "timers", archiving)
+    # go to the first shard's, as the first worker process handles them
+    # when workers run one shard each.
+    def __init__(self, shards: List[StatePersistence]):
+        self.shards = shards
+
+    def _for(self, workflow_id: str) -> StatePersistence:
+        return self.shards[shard_of(workflow_id, len(self.shards))]
+
+    @property
+    def storage_path(self) -> str:
+        return self.shards[0].storage_path
+
+    @property
+    def catalog(self) -> WorkflowCatalog:
+        return self.shards[0].catalog
+
+    def iter_history(self, workflow_id: str, *args, **kwargs) -> Iterator[WorkflowEvent]:
+        return self._for(workflow_id).iter_history(workflow_id, *args, **kwargs)
+
+    def append_record(self, log_name: str, payload: bytes):
+        self.shards[0].append_record(log_name, payload)
+
+    def iter_log(self, log_name: str) -> Iterator[bytes]:
+        return self.shards[0].iter_log(log_name)
+
+    def rewrite_log(self, log_name: str, payloads: Iterable[bytes]):
+        self.shards[0].rewrite_log(log_name, payloads)
+
+    def archive_finished(self, *args, **kwargs) -> int:
+        return self.shards[0].archive_finished(*args, **kwargs)
+
+    def sync(self):
+        for shard in self.shards:
+            shard.sync()
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
+class ShardedWorkflowEngine:
+    # Partitions workflows across independent engines by a hash of their id.
+    # Each shard has its own lock, event stream and store handle (with its
+    # own journal and group commit), so work on different shards never
+    # contends. Worker processes use the same shard_of split.
+    def __init__(self, shards: List[WorkflowEngine]):
+        if not shards:
+            raise ValueError("A sharded engine needs at least one shard")
+        self.shards = shards
+        # Every shard has a store or none does
+        self.persistence = (
+            ShardedPersistence([shard.persistence for shard in shards]) if shards[0].persistence else None
+        )
+
+    @classmethod
+    def open(cls, storage_path: str, shard_count: int, max_finished: Optional[int] = 1024,
+             clock: Optional[Clock] = None, **persistence_options) -> "ShardedWorkflowEngine":
+        shards = [
+            WorkflowEngine(StatePersistence(storage_path, shard=index, **persistence_options), max_finished, clock)
+            for index in range(shard_count)
+        ]
+        # Every live shard holds its journal now, so any other journal
+        # belongs to a dead owner or a shard count that changed
+        shards[0].persistence.recover_journals()
+        return cls(shards)
+
+    def shard_for(self, workflow_id: str) -> WorkflowEngine:
+        return self.shards[shard_of(workflow_id, len(self.shards))]
+
+    @property
+    def clock(self) -> Clock:
+        return self.shards[0].clock
+
+    @property
+    def instances(self) -> ChainMap:
+        return ChainMap(*(shard.instances for shard in self.shards))
+
+    def create_workflow(self, name: str, workflow_id: Optional[str] = None) -> WorkflowInstance:
+        workflow_id = workflow_id or str(uuid.uuid4())
+        return self.shard_for(workflow_id).create_workflow(name, workflow_id)
+
+    def record_event(self, workflow_id: str, event_type: str, data: Dict[str, Any]) -> WorkflowEvent:
+        return self.shard_for(workflow_id).record_event(workflow_id, event_type, data)
+
+    def record_events(self, workflow_id: str,
+                      events: Iterable[Tuple[str, Dict[str, Any]]]) -> List[WorkflowEvent]:
+        return self.shard_for(workflow_id).record_events(workflow_id, events)
+
+    def transaction(self, workflow_id: str) -> EventTransaction:
+        return self.shard_for(workflow_id).transaction(workflow_id)
+
+    async def commit(self, workflow_id: Optional[str] = None):
+        # Only the workflow's own shard needs to sync
+        if workflow_id is not None:
+            await self.shard_for(workflow_id).commit(workflow_id)
+        else:
+            await asyncio.gather(*(shard.commit() for shard in self.shards))
+
+    def get_workflow(self, workflow_id: str) -> Optional[WorkflowInstance]:
+        return self.shard_for(workflow_id).get_workflow(workflow_id)
+
+    def resume_workflow(self, workflow_id: str) -> WorkflowInstance:
+        return self.shard_for(workflow_id).resume_workflow(workflow_id)
+
+    def evict(self, workflow_id: str, snapshot: bool = True):
+        self.shard_for(workflow_id).evict(workflow_id, snapshot)
+
+    def update_status(self, workflow_id: str, status: WorkflowStatus):
+        self.shard_for(workflow_id).update_status(workflow_id, status)
+
+    def close(self):
+        if self.persistence:
+            self.persistence.close()
@@ -1,8 +1,22 @@
-from dataclasses import dataclass
-from typing import List, Optional, Dict, Any
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional, Dict, Any, Iterable, Iterator, Tuple, Union
 from enum import Enum
-import uuid
+import sys
+import threading
 import time
+import uuid
+import zlib
+from .clock import Clock, SYSTEM_CLOCK
+from .metrics import REGISTRY
+
+EVENTS_RECORDED = REGISTRY.counter("localflow_events_recorded_total", "Events recorded by the engine")
+RECORD_SECONDS = REGISTRY.histogram(
+    "localflow_record_events_seconds", "Time to record a batch of events, including the store append"
+)
+REPLAY_SECONDS = REGISTRY.histogram(
+    "localflow_replay_seconds", "Time to load a workflow back from its snapshot and log"
+)
 
 
 class WorkflowStatus(Enum):
@@ -14,7 +28,10 @@ class WorkflowStatus(Enum):
 
 @dataclass
 class WorkflowEvent:
-    id: str
+    # Slotted to keep long histories small; ``type`` strings are interned so
+    # every event of one type shares a single string object
+    __slots__ = ("id", "timestamp", "type", "data")
+    id: int  # sequence number within the workflow, starting at 1
     timestamp: float
     type: str
     data: Dict[str, Any]
@@ -26,21 +43,124 @@ class WorkflowInstance:
     name: str
     status: WorkflowStatus
     events: List[WorkflowEvent]
+    # Number of history events already folded into ``state``
     last_replay_index: int
+    state: Dict[str, Any] = field(default_factory=dict)
+    # Number of history events that precede ``events[0]``; non-zero when the
+    # instance was resumed from a snapshot instead of the full history
+    event_offset: int = 0
 
     def __post_init__(self):
         if not self.events:
             self.events = []
-        self.last_replay_index = 0
+
+    @property
+    def event_count(self) -> int:
+        return self.event_offset + len(self.events)
+
+    def apply(self, event: WorkflowEvent):
+        apply_event(self.state, event)
+        self.last_replay_index += 1
+
+    def replay(self):
+        for event in self.events[self.last_replay_index - self.event_offset:]:
+            self.apply(event)
+
+    def trim(self):
+        # Forget events already folded into ``state``; the store keeps the
+        # full history
+        del self.events[:self.last_replay_index - self.event_offset]
+        self.event_offset = self.last_replay_index
+
+
+def attempt_key(data: Dict[str, Any]) -> str:
+    # Failed attempts are counted per step, and per branch of a parallel step
+    if "branch" in data:
+        return f"{data['step']}.{data['branch']}"
+    return str(data["step"])
+
+
+def apply_event(state: Dict[str, Any], event: WorkflowEvent):
+    if event.type == "ActivityCompleted":
+        # Keyed like attempts, so an activity used by several steps or
+        # branches keeps each result; events recorded outside a step are
+        # keyed by activity name
+        key = attempt_key(event.data) if "step" in event.data else event.data["activity"]
+        state.setdefault("results", {})[key] = event.data.get("result")
+        if "step" in event.data:
+            attempts = state.get("attempts")
+            if attempts:
+                attempts.pop(attempt_key(event.data), None)
+        if "branch" in event.data:
+            # One branch of a parallel step; the step itself completes with
+            # ParallelCompleted
+            branches = state.setdefault("branches", {}).setdefault(str(event.data["step"]), [])
+            branches.append(event.data["branch"])
+        else:
+            state["completed_steps"] = state.get("completed_steps", 0) + 1
+    elif event.type == "ParallelCompleted":
+        state.get("branches", {}).pop(str(event.data["step"]), None)
+        state["completed_steps"] = state.get("completed_steps", 0) + 1
+    elif event.type == "ActivityFailed":
+        state["error"] = event.data.get("error")
+        if "step" in event.data:
+            attempts = state.setdefault("attempts", {})
+            key = attempt_key(event.data)
+            attempts[key] = attempts.get(key, 0) + 1
+    elif event.type == "TimerStarted":
+        state["timer"] = event.data["timer_id"]
+        if event.data.get("retry"):
+            state["timer_retry"] = True
+    elif event.type == "TimerFired":
+        state.pop("timer", None)
+        # A retry timer re-runs its step rather than completing one
+        if not state.pop("timer_retry", False):
+            state["completed_steps"] = state.get("completed_steps", 0) + 1
+
+
+FINISHED_STATUSES = (WorkflowStatus.COMPLETED, WorkflowStatus.FAILED)
+
+
+def shard_of(workflow_id: str, shard_count: int) -> int:
+    return zlib.crc32(workflow_id.encode("utf-8")) % shard_count
+
+
+class EventLogView:
+    # The global event log of an engine with a store: events are read back
+    # from the workflow logs rather than kept in memory a second time.
+    # Iteration is grouped by workflow, in creation order.
+    def __init__(self, persistence):
+        self.persistence = persistence
+
+    def __iter__(self) -> Iterator[WorkflowEvent]:
+        return self.persistence.iter_events()
+
+    def __len__(self) -> int:
+        return self.persistence.event_total()
 
 
 class WorkflowEngine:
-    def __init__(self):
-        self.instances: Dict[str, WorkflowInstance] = {}
-        self.event_log: List[WorkflowEvent] = []
+    def __init__(self, persistence=None, max_finished: Optional[int] = 1024,
+                 clock: Optional[Clock] = None):
+        self.instances: "OrderedDict[str, WorkflowInstance]" = OrderedDict()
+        self.persistence = persistence
+        self.event_log: Union[List[WorkflowEvent], EventLogView] = (
+            EventLogView(persistence) if persistence else []
+        )
+        # Completed and failed workflows stay in memory, least recently used
+        # first, until there are more than ``max_finished`` of them. Only an
+        # engine with a store evicts, since it can load them back.
+        self.max_finished = max_finished
+        self._finished: "OrderedDict[str, None]" = OrderedDict()
+        # Activity threads may call back into the engine while the event
+        # loop is using it
+        self.lock = threading.RLock()
+        # Event timestamps come from here; the timer scheduler and executor
+        # share the engine's clock
+        self.clock = clock or SYSTEM_CLOCK
 
-    def create_workflow(self, name: str) -> WorkflowInstance:
-        workflow_id = str(uuid.uuid4())
+    def create_workflow(self, name: str, workflow_id: Optional[str] = None) -> WorkflowInstance:
+        workflow_id = workflow_id or str(uuid.uuid4())
         instance = WorkflowInstance(
             id=workflow_id,
             name=name,
@@ -48,30 +168,146 @@ class WorkflowEngine:
             events=[],
             last_replay_index=0
         )
-        self.instances[workflow_id] = instance
+        with self.lock:
+            self.instances[workflow_id] = instance
+            if self.persistence:
+                self.persistence.save_workflow(instance)
         return instance
 
     def record_event(self, workflow_id: str, event_type: str, data: Dict[str, Any]) -> WorkflowEvent:
-        instance = self.instances.get(workflow_id)
-        if not instance:
-            raise ValueError(f"Workflow {workflow_id} not found")
-
-        event = WorkflowEvent(
-            id=str(uuid.uuid4()),
-            timestamp=time.time(),
-            type=event_type,
-            data=data
-        )
-        
-        instance.events.append(event)
-        self.event_log.append(event)
-        return event
+        return self.record_events(workflow_id, [(event_type, data)])[0]
+
+    def record_events(self, workflow_id: str,
+                      events: Iterable[Tuple[str, Dict[str, Any]]]) -> List[WorkflowEvent]:
+        events = list(events)
+        started = time.perf_counter() if REGISTRY.enabled else None
+        timestamp = self.clock.time()
+        with self.lock:
+            instance = self.instances.get(workflow_id)
+            if not instance:
+                raise ValueError(f"Workflow {workflow_id} not found")
+
+            first = instance.event_count + 1
+            recorded = [
+                WorkflowEvent(id=first + offset, timestamp=timestamp, type=sys.intern(event_type), data=data)
+                for offset, (event_type, data) in enumerate(events)
+            ]
+            if not recorded:
+                return recorded
+
+            instance.events.extend(recorded)
+            for event in recorded:
+                instance.apply(event)
+            if self.persistence:
+                self.persistence.append_events(workflow_id, recorded)
+                if self.persistence.maybe_snapshot(instance):
+                    instance.trim()
+            else:
+                self.event_log.extend(recorded)
+        if started is not None:
+            RECORD_SECONDS.observe(time.perf_counter() - started)
+            EVENTS_RECORDED.inc(len(recorded))
+        return recorded
+
+    def transaction(self, workflow_id: str) -> "EventTransaction":
+        return EventTransaction(self, workflow_id)
+
+    async def commit(self, workflow_id: Optional[str] = None):
+        # Waits until every recorded event is durable
+        if self.persistence:
+            await self.persistence.commit()
 
     def get_workflow(self, workflow_id: str) -> Optional[WorkflowInstance]:
-        return self.instances.get(workflow_id)
+        with self.lock:
+            if workflow_id in self._finished:
+                self._finished.move_to_end(workflow_id)
+            return self.instances.get(workflow_id)
+
+    def resume_workflow(self, workflow_id: str) -> WorkflowInstance:
+        with self.lock:
+            instance = self.instances.get(workflow_id)
+            if instance:
+                return instance
+            if not self.persistence:
+                raise ValueError(f"Workflow {workflow_id} not found")
+            with REGISTRY.span(REPLAY_SECONDS):
+                instance = self.persistence.resume_workflow(workflow_id)
+            self.instances[workflow_id] = instance
+            if instance.status in FINISHED_STATUSES:
+                self._finished[workflow_id] = None
+                self._evict_finished()
+            return instance
+
+    def evict(self, workflow_id: str, snapshot: bool = True):
+        # Drop a workflow from memory; resume_workflow brings it back from the
+        # latest snapshot. Only possible when the engine has a store.
+        with self.lock:
+            instance = self.instances.get(workflow_id)
+            if not instance or not self.persistence:
+                return
+            if snapshot:
+                self.persistence.snapshot(instance)
+            del self.instances[workflow_id]
+            self._finished.pop(workflow_id, None)
+            self.persistence.release(workflow_id)
+
+    def _evict_finished(self):
+        if not self.persistence or self.max_finished is None:
+            return
+        while len(self._finished) > self.max_finished:
+            workflow_id, _ = self._finished.popitem(last=False)
+            self.instances.pop(workflow_id, None)
+            self.persistence.release(workflow_id)
 
     def update_status(self, workflow_id: str, status: WorkflowStatus):
-        instance = self.instances.get(workflow_id)
-        if not instance:
-            raise ValueError(f"Workflow {workflow_id} not found")
-        instance.status = status
\ No newline at end of file
+        with self.lock:
+            instance = self.instances.get(workflow_id)
+            if not instance:
+                raise ValueError(f"Workflow {workflow_id} not found")
+            instance.status = status
+            if self.persistence:
+                self.persistence.save_metadata(instance)
+            if status in FINISHED_STATUSES:
+                self._finished[workflow_id] = None
+                self._finished.move_to_end(workflow_id)
+                self._evict_finished()
+            else:
+                self._finished.pop(workflow_id, None)
+
+
+class EventTransaction:
+    # Buffers the events of one workflow task and records them as a single
+    # batch when the block exits cleanly; nothing is recorded if it raises.
+    # Buffered events are not applied to the workflow state until then.
+    # ``async with`` also waits for the batch to become durable.
+    def __init__(self, engine: WorkflowEngine, workflow_id: str):
+        self.engine = engine
+        self.workflow_id = workflow_id
+        self.pending: List[Tuple[str, Dict[str, Any]]] = []
+        self.events: List[WorkflowEvent] = []
+
+    def record(self, event_type: str, data: Dict[str, Any]):
+        self.pending.append((event_type, data))
+
+    def commit(self) -> List[WorkflowEvent]:
+        if self.pending:
+            self.events.extend(self.engine.record_events(self.workflow_id, self.pending))
+            self.pending = []
+        return self.events
+
+    def __enter__(self) -> "EventTransaction":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.pending = []
+
+    async def __aenter__(self) -> "EventTransaction":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.__exit__(exc_type, exc, tb)
+        if exc_type is None:
+            await self.engine.commit(self.workflow_id)
@@ -1,44 +1,224 @@
+import hashlib
+import json
+import os
 import re
-from typing import List, Tuple
-from dataclasses import dataclass
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from dataclasses import dataclass, field, asdict
 
 
 @dataclass
 class WorkflowStep:
-    type: str  # "step", "wait"
+    type: str  # "step", "wait", "parallel"
     name: str
     duration: Optional[int] = None  # for wait steps
+    branches: Optional[List["WorkflowStep"]] = None  # for parallel steps
+    join: Optional[str] = None  # "all" or "any", for parallel steps
+    # Source position of the statement, 1-based
+    line: int = field(default=0, compare=False)
+    column: int = field(default=0, compare=False)
 
 
-class WorkflowParser:
-    def __init__(self):
-        self.workflow_pattern = re.compile(
-            r"workflow\s+(\w+)\s*{([^}]*)}",
-            re.DOTALL
-        )
-        self.step_pattern = re.compile(r"step\s+(\w+);")
-        self.wait_pattern = re.compile(r"wait\s+(\d+h|\d+m|\d+s)")
+@dataclass
+class Token:
+    kind: str  # "ident", "duration", "lbrace", "rbrace", "semi", "eof"
+    value: str
+    line: int
+    column: int
 
-    def parse(self, source: str) -> Tuple[str, List[WorkflowStep]]:
-        match = self.workflow_pattern.search(source)
-        if not match:
-            raise ValueError("Invalid workflow syntax")
 
-        name = match.group(1)
-        body = match.group(2)
+class ParseError(ValueError):
+    def __init__(self, message: str, line: int = 0, column: int = 0):
+        super().__init__(f"{message} at line {line}, column {column}" if line else message)
+        self.line = line
+        self.column = column
+
+
+_TOKEN_PATTERN = re.compile(
+    r"(?P<duration>\d+[hms])\b"
+    r"|(?P<ident>[A-Za-z_]\w*)"
+    r"|(?P<lbrace>{)"
+    r"|(?P<rbrace>})"
+    r"|(?P<semi>;)"
+    r"|(?P<newline>\n)"
+    r"|(?P<space>[ \t\r]+)"
+    r"|(?P<invalid>.)"
+)
+
+
+def tokenize(source: str) -> List[Token]:
+    tokens = []
+    line = 1
+    line_start = 0
+    for match in _TOKEN_PATTERN.finditer(source):
+        kind = match.lastgroup
+        column = match.start() - line_start + 1
+        if kind == "newline":
+            line += 1
+            line_start = match.end()
+        elif kind == "space":
+            continue
+        elif kind == "invalid":
+            raise ParseError(f"Unexpected character {match.group()!r}", line, column)
+        else:
+            tokens.append(Token(kind, match.group(), line, column))
+    tokens.append(Token("eof", "", line, len(source) - line_start + 1))
+    return tokens
 
-        steps = []
-        step_matches = self.step_pattern.findall(body)
-        for step_name in step_matches:
-            steps.append(WorkflowStep(type="step", name=step_name))
 
-        wait_matches = self.wait_pattern.findall(body)
-        for wait_str in wait_matches:
-            duration = self._parse_duration(wait_str)
-            steps.append(WorkflowStep(type="wait", name="", duration=duration))
+class _RecursiveDescent:
+    def __init__(self, tokens: List[Token], parse_duration):
+        self.tokens = tokens
+        self.position = 0
+        self.parse_duration = parse_duration
 
+    def _peek(self) -> Token:
+        return self.tokens[self.position]
+
+    def _next(self) -> Token:
+        token = self.tokens[self.position]
+        if token.kind != "eof":
+            self.position += 1
+        return token
+
+    def _expect(self, kind: str, value: Optional[str] = None) -> Token:
+        token = self._next()
+        if token.kind != kind or (value is not None and token.value != value):
+            expected = repr(value) if value else kind
+            found = repr(token.value) if token.value else "end of input"
+            raise ParseError(f"Expected {expected} but found {found}", token.line, token.column)
+        return token
+
+    def workflow(self) -> Tuple[str, List[WorkflowStep]]:
+        # Text before the workflow keyword is ignored, as it always was
+        while self._peek().kind != "eof" and not (self._peek().kind == "ident" and self._peek().value == "workflow"):
+            self._next()
+        if self._peek().kind == "eof":
+            raise ParseError("Invalid workflow syntax")
+        self._expect("ident", "workflow")
+        name = self._expect("ident").value
+        self._expect("lbrace")
+        steps = []
+        while self._peek().kind != "rbrace":
+            steps.append(self.statement(inside_parallel=False))
+        self._expect("rbrace")
         return name, steps
 
+    def statement(self, inside_parallel: bool) -> WorkflowStep:
+        token = self._peek()
+        if token.kind != "ident":
+            found = repr(token.value) if token.value else "end of input"
+            raise ParseError(f"Expected a statement but found {found}", token.line, token.column)
+
+        if token.value == "step":
+            self._next()
+            name = self._expect("ident").value
+            self._expect("semi")
+            return WorkflowStep(type="step", name=name, line=token.line, column=token.column)
+
+        if token.value == "wait":
+            if inside_parallel:
+                raise ParseError("wait is not allowed inside a parallel block", token.line, token.column)
+            self._next()
+            duration = self.parse_duration(self._expect("duration").value)
+            if self._peek().kind == "semi":
+                self._next()
+            return WorkflowStep(type="wait", name="", duration=duration, line=token.line, column=token.column)
+
+        if token.value == "parallel":
+            if inside_parallel:
+                raise ParseError("parallel blocks cannot be nested", token.line, token.column)
+            self._next()
+            join = "all"
+            if self._peek().kind == "ident" and self._peek().value in ("all", "any"):
+                join = self._next().value
+            self._expect("lbrace")
+            branches = []
+            while self._peek().kind != "rbrace":
+                branches.append(self.statement(inside_parallel=True))
+            closing = self._expect("rbrace")
+            if not branches:
+                raise ParseError("parallel block must contain at least one step", closing.line, closing.column)
+            return WorkflowStep(type="parallel", name="", branches=branches, join=join,
+                                line=token.line, column=token.column)
+
+        raise ParseError(f"Unknown statement {token.value!r}", token.line, token.column)
+
+
+def _step_from_dict(data: dict) -> WorkflowStep:
+    branches = data.get("branches")
+    return WorkflowStep(**dict(data, branches=[_step_from_dict(b) for b in branches] if branches is not None else None))
+
+
+class PlanCache:
+    # Compiled plans keyed by a hash of the definition source; the optional
+    # directory keeps them across processes
+    VERSION = 1
+
+    def __init__(self, directory: Optional[str] = None, max_entries: int = 1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.plans: "OrderedDict[str, Tuple[str, List[WorkflowStep]]]" = OrderedDict()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(source: str) -> str:
+        return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[str, List[WorkflowStep]]]:
+        plan = self.plans.get(key)
+        if plan is not None:
+            self.plans.move_to_end(key)
+            return plan
+        if self.directory:
+            path = os.path.join(self.directory, f"{key}.json")
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    data = json.load(f)
+                if data.get("version") == self.VERSION:
+                    plan = (data["name"], [_step_from_dict(s) for s in data["steps"]])
+                    self._remember(key, plan)
+                    return plan
+        return None
+
+    def put(self, key: str, plan: Tuple[str, List[WorkflowStep]]):
+        self._remember(key, plan)
+        if self.directory:
+            path = os.path.join(self.directory, f"{key}.json")
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({
+                    "version": self.VERSION,
+                    "name": plan[0],
+                    "steps": [asdict(s) for s in plan[1]]
+                }, f)
+            os.replace(tmp_path, path)
+
+    def _remember(self, key: str, plan: Tuple[str, List[WorkflowStep]]):
+        self.plans[key] = plan
+        self.plans.move_to_end(key)
+        while len(self.plans) > self.max_entries:
+            self.plans.popitem(last=False)
+
+
+_default_cache = PlanCache()
+
+
+class WorkflowParser:
+    def __init__(self, cache: Optional[PlanCache] = None):
+        # Parsers share one in-memory cache unless given their own; cached
+        # plans are shared and must not be mutated
+        self.cache = cache if cache is not None else _default_cache
+
+    def parse(self, source: str) -> Tuple[str, List[WorkflowStep]]:
+        key = PlanCache.key(source)
+        plan = self.cache.get(key)
+        if plan is None:
+            plan = _RecursiveDescent(tokenize(source), self._parse_duration).workflow()
+            self.cache.put(key, plan)
+        return plan
+
     def _parse_duration(self, duration_str: str) -> int:
         if duration_str.endswith('h'):
             return int(duration_str[:-1]) * 3600
@@ -47,4 +227,4 @@ class WorkflowParser:
         elif duration_str.endswith('s'):
             return int(duration_str[:-1])
         else:
-            raise ValueError(f"Unknown duration format: {duration_str}")
\ No newline at end of file
+            raise ValueError(f"Unknown duration format: {duration_str}")
@@ -0,0 +1,129 @@
+import itertools
+import json
+import socket
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+# Speaks the line protocol of engine/server.py. Kept to the standard
+# library, so a program that only starts workflows does not import the
+# engine.
+SOCKET_FILE = "lf.sock"
+
+
+class ClientError(Exception):
+    pass
+
+
+class LocalFlowClient:
+    # One persistent connection to `lf serve`. call_many() pipelines: up to
+    # `window` requests are on the wire before it waits for a response.
+    def __init__(self, socket_path: Optional[str] = None, port: Optional[int] = None,
+                 host: str = "127.0.0.1", timeout: Optional[float] = 30.0, window: int = 64,
+                 batch_size: int = 500):
+        if socket_path is None and port is None:
+            raise ValueError("A client needs a socket path or a port")
+        self.socket_path = socket_path
+        self.port = port
+        self.host = host
+        self.timeout = timeout
+        self.window = window
+        self.batch_size = batch_size
+        self._socket: Optional[socket.socket] = None
+        self._reader = None
+        self._ids = itertools.count(1)
+
+    def connect(self) -> "LocalFlowClient":
+        # Raises OSError when no server is listening
+        if self._socket is None:
+            if self.port is not None:
+                sock = socket.create_connection((self.host, self.port), self.timeout)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            else:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(self.timeout)
+                try:
+                    sock.connect(self.socket_path)
+                except OSError:
+                    sock.close()
+                    raise
+            self._socket = sock
+            self._reader = sock.makefile("rb")
+        return self
+
+    def close(self):
+        if self._socket is not None:
+            self._reader.close()
+            self._socket.close()
+            self._socket = None
+            self._reader = None
+
+    def __enter__(self) -> "LocalFlowClient":
+        return self.connect()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _receive(self, expected_id: int) -> Dict[str, Any]:
+        line = self._reader.readline()
+        if not line:
+            self.close()
+            raise ConnectionError("Server closed the connection")
+        response = json.loads(line)
+        if response.get("id") != expected_id:
+            self.close()
+            raise ClientError(f"Response {response.get('id')} does not match request {expected_id}")
+        return response
+
+    def call_many(self, requests: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Raw responses, in request order; errors are left in the responses
+        self.connect()
+        in_flight: Deque[int] = deque()
+        responses = []
+        try:
+            for request in requests:
+                if len(in_flight) >= self.window:
+                    responses.append(self._receive(in_flight.popleft()))
+                request_id = next(self._ids)
+                line = json.dumps(dict(request, id=request_id)).encode("utf-8") + b"\n"
+                self._socket.sendall(line)
+                in_flight.append(request_id)
+            while in_flight:
+                responses.append(self._receive(in_flight.popleft()))
+        except (OSError, ValueError):
+            # Unread responses would be taken for answers to later requests
+            self.close()
+            raise
+        return responses
+
+    def call(self, op: str, **params) -> Any:
+        response = self.call_many([dict(params, op=op)])[0]
+        if "error" in response:
+            raise ClientError(response["error"])
+        return response["result"]
+
+    def start(self, name: str, workflow_id: Optional[str] = None) -> str:
+        spec = {"name": name}
+        if workflow_id:
+            spec["id"] = workflow_id
+        return self.call("start", workflows=[spec])["ids"][0]
+
+    def start_many(self, workflows: Iterable[Any]) -> List[str]:
+        # Each item is a workflow name or a {"name", "id"} dict; they are
+        # sent in batches of batch_size, pipelined
+        specs = [{"name": w} if isinstance(w, str) else dict(w) for w in workflows]
+        batches = [specs[i:i + self.batch_size] for i in range(0, len(specs), self.batch_size)]
+        ids = []
+        for response in self.call_many({"op": "start", "workflows": batch} for batch in batches):
+            if "error" in response:
+                raise ClientError(response["error"])
+            ids.extend(response["result"]["ids"])
+        return ids
+
+    def signal(self, workflow_id: str, signal: str, payload: Any = None) -> int:
+        return self.call("signal", workflow_id=workflow_id, signal=signal, payload=payload)["event_id"]
+
+    def query(self, workflow_id: str) -> Dict[str, Any]:
+        return self.call("query", workflow_id=workflow_id)
+
+    def ping(self) -> Dict[str, Any]:
+        return self.call("ping")
@@ -1,34 +1,94 @@
-from typing import List, Dict, Any, Callable
+from typing import List, Dict, Any, Callable, Optional, Tuple, Union
 import time
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
-from ..core.workflow import WorkflowEngine, WorkflowInstance, WorkflowStatus
+from ..core.metrics import REGISTRY
+from ..core.workflow import WorkflowEngine, WorkflowInstance, WorkflowStatus, attempt_key
 from ..dsl.parser import WorkflowParser, WorkflowStep
+from ..activities.runner import ActivityResult, ActivityRunner, get_pool
+from ..timers.scheduler import TimerFireError, TimerScheduler, Timer
+
+
+ACTIVITY_RUN_SECONDS = REGISTRY.histogram(
+    "localflow_activity_run_seconds", "Time activities spent running", labels=("activity",)
+)
+ACTIVITY_FAILURES = REGISTRY.counter(
+    "localflow_activity_failures_total", "Failed activity attempts", labels=("activity", "error_type")
+)
+TIMER_LAG_SECONDS = REGISTRY.histogram(
+    "localflow_timer_lag_seconds", "How late timers fired, relative to their scheduled fire time"
+)
 
 
 class ActivityExecutionError(Exception):
-    pass
+    def __init__(self, message: str, error_type: str = ""):
+        super().__init__(message)
+        self.error_type = error_type
 
 
 class WorkflowExecutor:
-    def __init__(self, workflow_engine: WorkflowEngine, activity_runner: Callable):
+    # Seconds before a timer that failed to fire is delivered again
+    timer_retry_delay = 5.0
+
+    def __init__(self, workflow_engine: WorkflowEngine, activity_runner: Union[ActivityRunner, Callable],
+                 timer_scheduler: Optional[TimerScheduler] = None, max_workers: int = 4):
         self.workflow_engine = workflow_engine
+        # An ActivityRunner dispatches each activity per its execution
+        # policy; a bare callable runs on the shared default thread pool
         self.activity_runner = activity_runner
-        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.executor = get_pool("thread", "default", max_workers)
+        # With a scheduler, waits are durable: the workflow is evicted from
+        # memory and resumed by replay when its timer fires
+        self.timer_scheduler = timer_scheduler
+        self.definitions: Dict[str, List[WorkflowStep]] = {}
+        # Called with (step, seconds) after every completed step
+        self.step_observer: Optional[Callable[[WorkflowStep, float], None]] = None
+        # Called with (workflow id, outcome) when a run that a timer resumed
+        # ends: "completed", "failed", or "suspended" on another timer
+        self.run_observer: Optional[Callable[[str, str], None]] = None
+
+    def register_definition(self, name: str, steps: List[WorkflowStep]):
+        self.definitions[name] = steps
 
     async def execute_workflow(self, workflow_id: str, steps: List[WorkflowStep]):
         instance = self.workflow_engine.get_workflow(workflow_id)
         if not instance:
             raise ValueError(f"Workflow {workflow_id} not found")
 
+        self.definitions.setdefault(instance.name, steps)
+
         # Mark as running
         self.workflow_engine.update_status(workflow_id, WorkflowStatus.RUNNING)
 
-        for step in steps:
+        await self._run_steps(instance, steps)
+
+    async def _run_steps(self, instance: WorkflowInstance, steps: List[WorkflowStep]):
+        workflow_id = instance.id
+        # Steps that already completed are part of the replayed state
+        for index in range(instance.state.get("completed_steps", 0), len(steps)):
+            step = steps[index]
             try:
                 if step.type == "step":
-                    await self._execute_activity(workflow_id, step.name)
+                    started = time.perf_counter()
+                    # With a scheduler a retry backoff is a durable timer, and
+                    # the workflow is suspended until it fires
+                    if not await self._execute_with_retries(instance, step.name, {"step": index},
+                                                            durable=self.timer_scheduler is not None):
+                        return
+                    # The step is durable before the next one starts; commits
+                    # from concurrent workflows share one sync
+                    await self.workflow_engine.commit(workflow_id)
+                    if self.step_observer:
+                        self.step_observer(step, time.perf_counter() - started)
+                elif step.type == "parallel":
+                    started = time.perf_counter()
+                    await self._execute_parallel(instance, index, step)
+                    await self.workflow_engine.commit(workflow_id)
+                    if self.step_observer:
+                        self.step_observer(step, time.perf_counter() - started)
                 elif step.type == "wait":
+                    if self.timer_scheduler is not None:
+                        self._start_timer(workflow_id, step.duration)
+                        return
                     await self._schedule_timer(workflow_id, step.duration)
             except Exception as e:
                 self.workflow_engine.update_status(workflow_id, WorkflowStatus.FAILED)
@@ -36,31 +96,218 @@ class WorkflowExecutor:
 
         self.workflow_engine.update_status(workflow_id, WorkflowStatus.COMPLETED)
 
-    async def _execute_activity(self, workflow_id: str, activity_name: str):
+    async def _execute_parallel(self, instance: WorkflowInstance, index: int, step: WorkflowStep):
+        # Branches that completed before a restart are not run again, and
+        # the join outcome is recorded so replay never depends on timing
+        done = instance.state.get("branches", {}).get(str(index), [])
+        winner = min(done) if step.join == "any" and done else None
+
+        if winner is None:
+            tasks = {
+                asyncio.ensure_future(
+                    self._execute_with_retries(instance, branch.name, {"step": index, "branch": position})
+                ): position
+                for position, branch in enumerate(step.branches)
+                if position not in done
+            }
+            try:
+                winner = await self._join(tasks, step.join)
+            finally:
+                for task in tasks:
+                    if task.done() and not task.cancelled():
+                        task.exception()  # already reported through the join
+                    task.cancel()
+
+        data = {"step": index, "join": step.join}
+        if step.join == "any":
+            data["winner"] = winner
+        self.workflow_engine.record_event(instance.id, "ParallelCompleted", data)
+
+    async def _join(self, tasks: Dict[asyncio.Future, int], join: str) -> Optional[int]:
+        pending = set(tasks)
+        errors = []
+        while pending:
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # Lowest branch index first, so simultaneous finishes resolve the
+            # same way every time
+            for task in sorted(finished, key=tasks.get):
+                if task.exception() is None:
+                    if join == "any":
+                        return tasks[task]
+                elif join == "all":
+                    raise task.exception()
+                else:
+                    errors.append(task.exception())
+        if errors:
+            raise errors[0]
+        return None
+
+    async def _execute_with_retries(self, instance: WorkflowInstance, activity_name: str,
+                                    step_data: Dict[str, Any], durable: bool = False) -> bool:
+        # Returns False when the workflow was suspended on a retry timer
+        if self._completed(instance, step_data):
+            # History already holds this step's result (in
+            # state["results"], under attempt_key(step_data)); running the
+            # activity again could repeat its side effects
+            return True
+        while True:
+            try:
+                await self._execute_activity(instance.id, activity_name, step_data)
+                return True
+            except Exception as e:
+                delay = self._retry_delay(instance, activity_name, step_data,
+                                          getattr(e, "error_type", "") or type(e).__name__)
+                if delay is None:
+                    raise
+            if durable:
+                self._start_timer(instance.id, delay, retry=True)
+                return False
+            await self.workflow_engine.clock.sleep(delay)
+
+    @staticmethod
+    def _completed(instance: WorkflowInstance, step_data: Dict[str, Any]) -> bool:
+        if step_data["step"] < instance.state.get("completed_steps", 0):
+            return True
+        return ("branch" in step_data
+                and step_data["branch"] in instance.state.get("branches", {}).get(str(step_data["step"]), ()))
+
+    def _retry_delay(self, instance: WorkflowInstance, activity_name: str,
+                     step_data: Dict[str, Any], error_type: str) -> Optional[float]:
+        if not isinstance(self.activity_runner, ActivityRunner):
+            return None
+        retry = self.activity_runner.policy_for(activity_name).retry
+        if retry is None:
+            return None
+        # Failures are counted from recorded events, so the attempt budget
+        # survives restarts
+        failures = instance.state.get("attempts", {}).get(attempt_key(step_data), 0)
+        if not retry.should_retry(failures, error_type):
+            return None
+        return retry.delay(failures)
+
+    async def _execute_activity(self, workflow_id: str, activity_name: str,
+                                step_data: Optional[Dict[str, Any]] = None):
+        # How long the activity ran, when the runner measured it; recorded
+        # with the outcome so queries can report activity run times
+        timing = {}
         try:
-            result = await asyncio.get_event_loop().run_in_executor(
-                self.executor,
-                self.activity_runner,
-                activity_name
-            )
+            if isinstance(self.activity_runner, ActivityRunner):
+                result = await self.activity_runner.run_activity_async(activity_name)
+            else:
+                result = await asyncio.get_event_loop().run_in_executor(
+                    self.executor,
+                    self.activity_runner,
+                    activity_name
+                )
+            if isinstance(result, ActivityResult):
+                timing["duration"] = round(result.duration, 6)
+                if REGISTRY.enabled:
+                    ACTIVITY_RUN_SECONDS.labels(activity_name).observe(result.duration)
+                if not result.success:
+                    raise ActivityExecutionError(result.error, result.error_type)
+                result = result.output
             self.workflow_engine.record_event(
                 workflow_id,
                 "ActivityCompleted",
-                {"activity": activity_name, "result": result}
+                dict(step_data or {}, activity=activity_name, result=result, **timing)
             )
         except Exception as e:
+            if REGISTRY.enabled:
+                ACTIVITY_FAILURES.labels(activity_name, getattr(e, "error_type", "") or type(e).__name__).inc()
             self.workflow_engine.record_event(
                 workflow_id,
                 "ActivityFailed",
-                {"activity": activity_name, "error": str(e)}
+                dict(step_data or {}, activity=activity_name, error=str(e),
+                     error_type=getattr(e, "error_type", "") or type(e).__name__, **timing)
             )
             raise
 
+    def _start_timer(self, workflow_id: str, duration_seconds: float, retry: bool = False):
+        timer = self.timer_scheduler.schedule_timer(workflow_id, duration_seconds)
+        data = {"timer_id": timer.id, "duration": duration_seconds, "fire_time": timer.fire_time}
+        if retry:
+            data["retry"] = True
+        self.workflow_engine.record_event(workflow_id, "TimerStarted", data)
+        self.workflow_engine.evict(workflow_id)
+
     async def _schedule_timer(self, workflow_id: str, duration_seconds: int):
-        # Simulate timer scheduling
-        await asyncio.sleep(duration_seconds)
+        # Without a scheduler the wait keeps this coroutine alive
+        await self.workflow_engine.clock.sleep(duration_seconds)
         self.workflow_engine.record_event(
             workflow_id,
             "TimerFired",
             {"duration": duration_seconds}
-        )
\ No newline at end of file
+        )
+
+    def restore_timer(self, instance: WorkflowInstance):
+        # A workflow suspended under another shard layout has its timer in
+        # another process's log; its TimerStarted event re-creates it here
+        timer_id = instance.state.get("timer")
+        if self.timer_scheduler is None or timer_id is None or timer_id in self.timer_scheduler.timers:
+            return
+        persistence = self.workflow_engine.persistence
+        if persistence is None:
+            return
+        for event in persistence.iter_history(instance.id, types=("TimerStarted",)):
+            if event.data["timer_id"] == timer_id:
+                self.timer_scheduler.restore_timer(Timer(
+                    id=timer_id,
+                    workflow_id=instance.id,
+                    fire_time=event.data["fire_time"],
+                    duration=event.data["duration"]
+                ))
+
+    async def fire_timer(self, timer: Timer):
+        if REGISTRY.enabled:
+            TIMER_LAG_SECONDS.observe(max(0.0, self.workflow_engine.clock.time() - timer.fire_time))
+        try:
+            instance = self.workflow_engine.resume_workflow(timer.workflow_id)
+            # Timers are delivered at least once; a repeat delivery only
+            # needs to be acknowledged
+            if instance.state.get("timer") != timer.id:
+                self.timer_scheduler.remove_timer(timer.id)
+                return
+
+            steps = self.definitions.get(instance.name)
+            if steps is None:
+                raise ValueError(f"No definition registered for workflow {instance.name}")
+
+            data = {"timer_id": timer.id, "duration": timer.duration}
+            if instance.state.get("timer_retry"):
+                data["retry"] = True
+            self.workflow_engine.record_event(timer.workflow_id, "TimerFired", data)
+            self.timer_scheduler.remove_timer(timer.id)
+        except Exception as e:
+            self.timer_scheduler.retry_timer(timer, self.timer_retry_delay)
+            raise TimerFireError(
+                f"Timer {timer.id} for workflow {timer.workflow_id} failed to fire: {e}", timer
+            ) from e
+        try:
+            await self._run_steps(instance, steps)
+        except Exception:
+            if self.run_observer:
+                self.run_observer(timer.workflow_id, "failed")
+            raise
+        if self.run_observer:
+            self.run_observer(timer.workflow_id, "suspended" if "timer" in instance.state else "completed")
+
+    async def skip_to_next_timer(self) -> Tuple[int, List[TimerFireError]]:
+        # Virtual time only: jump the clock to the earliest pending timer
+        # and fire everything due by then
+        clock = self.workflow_engine.clock
+        if not clock.virtual:
+            raise ValueError("Skipping ahead needs a virtual clock")
+        fire_time = self.timer_scheduler.next_fire_time()
+        if fire_time is None:
+            return 0, []
+        clock.advance_to(fire_time)
+        return await self.fire_ready_timers()
+
+    async def fire_ready_timers(self, limit: Optional[int] = None) -> Tuple[int, List[TimerFireError]]:
+        # Returns how many timers fired and the ones that failed to; those
+        # are due again later. A workflow that fails after its timer fired
+        # counts as fired; the failure is its own.
+        timers = self.timer_scheduler.get_ready_timers(limit)
+        results = await asyncio.gather(*(self.fire_timer(timer) for timer in timers), return_exceptions=True)
+        failures = [result for result in results if isinstance(result, TimerFireError)]
+        return len(timers) - len(failures), failures
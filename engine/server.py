@@ -0,0 +1,230 @@
+import asyncio
+import json
+import os
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+from ..core.workflow import FINISHED_STATUSES, WorkflowEngine, WorkflowInstance
+
+# One JSON object per line in each direction. A request is
+# {"id": ..., "op": ..., ...}; its response carries the same id and either
+# "result" or "error". A connection may send any number of requests without
+# waiting (pipelining); responses come back in request order.
+# Signals are only recorded for now: they show up in the workflow's history
+# and queries, but no step waits for or reads them
+SIGNAL_EVENT = "SignalReceived"
+# Longest request line accepted, so a batch of starts fits comfortably
+MAX_LINE = 64 * 1024 * 1024
+
+
+class RequestError(Exception):
+    pass
+
+
+def signal_rejection(instance: WorkflowInstance) -> Optional[str]:
+    # Why a workflow cannot take a signal, or None. `lf signal` applies the
+    # same rule when no server is listening.
+    if instance.status in FINISHED_STATUSES:
+        return f"Workflow {instance.id} is {instance.status.value}"
+    return None
+
+
+class WorkflowServer:
+    # The ingestion front door: a long-running process that owns an engine
+    # and starts, signals and queries workflows for clients over a local
+    # socket, so starting a workflow costs a round trip instead of an
+    # interpreter startup. on_start is called after each start batch; a
+    # worker in the same process uses it to pick up new workflows at once.
+    def __init__(self, workflow_engine: WorkflowEngine, evict_started: bool = True,
+                 on_start: Optional[Callable[[List[str]], None]] = None):
+        self.workflow_engine = workflow_engine
+        # Without a worker in this process nothing here runs the workflows
+        # it starts, so they are not kept in memory
+        self.evict_started = evict_started
+        self.on_start = on_start
+        self.requests = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._socket_path: Optional[str] = None
+        self._connections: Set[asyncio.Task] = set()
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], Awaitable[Any]]] = {
+            "start": self._start,
+            "signal": self._signal,
+            "query": self._query,
+            "ping": self._ping,
+        }
+
+    async def _start(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        # {"workflows": [{"name": ..., "id": optional}, ...]}
+        workflows = request.get("workflows")
+        if not isinstance(workflows, list):
+            raise RequestError("start needs a list of workflows")
+        # The whole batch is checked before anything is created, so an
+        # invalid spec never leaves earlier workflows started but unreported
+        for spec in workflows:
+            if not isinstance(spec, dict) or not spec.get("name"):
+                raise RequestError("Each workflow to start needs a name")
+            if spec.get("id") is not None and not isinstance(spec["id"], str):
+                raise RequestError("A workflow id must be a string")
+        ids = []
+        for spec in workflows:
+            workflow_id = spec.get("id")
+            if workflow_id and self._exists(workflow_id):
+                # Starting with a known id is idempotent, so a client can
+                # safely resend a batch after a lost connection
+                ids.append(workflow_id)
+                continue
+            ids.append(self.workflow_engine.create_workflow(spec["name"], workflow_id).id)
+        if self.evict_started:
+            for workflow_id in ids:
+                self.workflow_engine.evict(workflow_id, snapshot=False)
+        if self.on_start is not None:
+            self.on_start(ids)
+        return {"ids": ids}
+
+    def _exists(self, workflow_id: str) -> bool:
+        if self.workflow_engine.get_workflow(workflow_id) is not None:
+            return True
+        persistence = self.workflow_engine.persistence
+        return persistence is not None and persistence.catalog.get(workflow_id) is not None
+
+    def _load(self, workflow_id: str):
+        try:
+            return self.workflow_engine.resume_workflow(workflow_id)
+        except (ValueError, FileNotFoundError):
+            raise RequestError(f"Workflow {workflow_id} not found")
+
+    async def _signal(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        # {"workflow_id": ..., "signal": ..., "payload": optional}
+        workflow_id = request.get("workflow_id")
+        signal = request.get("signal")
+        if not workflow_id or not signal:
+            raise RequestError("signal needs a workflow_id and a signal name")
+        rejection = signal_rejection(self._load(workflow_id))
+        if rejection is not None:
+            raise RequestError(rejection)
+        event = self.workflow_engine.record_event(
+            workflow_id, SIGNAL_EVENT, {"signal": signal, "payload": request.get("payload")}
+        )
+        # Acknowledged only once the event is durable
+        await self.workflow_engine.commit(workflow_id)
+        return {"event_id": event.id}
+
+    async def _query(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        # {"workflow_id": ...}
+        workflow_id = request.get("workflow_id")
+        if not workflow_id:
+            raise RequestError("query needs a workflow_id")
+        persistence = self.workflow_engine.persistence
+        instance = self.workflow_engine.get_workflow(workflow_id)
+        if instance is None and persistence is not None:
+            # The catalog answers without replaying the workflow
+            entry = persistence.catalog.get(workflow_id)
+            if entry is not None:
+                return {"id": entry.id, "name": entry.name, "status": entry.status,
+                        "events": entry.event_count}
+        if instance is None:
+            raise RequestError(f"Workflow {workflow_id} not found")
+        return {"id": instance.id, "name": instance.name, "status": instance.status.value,
+                "events": instance.event_count}
+
+    async def _ping(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        return {"pid": os.getpid()}
+
+    async def handle(self, request: Any) -> Dict[str, Any]:
+        request_id = request.get("id") if isinstance(request, dict) else None
+        try:
+            if not isinstance(request, dict):
+                raise RequestError("A request must be a JSON object")
+            handler = self._handlers.get(request.get("op"))
+            if handler is None:
+                raise RequestError(f"Unknown op {request.get('op')!r}")
+            result = await handler(request)
+        except RequestError as e:
+            return {"id": request_id, "error": str(e)}
+        except Exception as e:
+            return {"id": request_id, "error": f"{type(e).__name__}: {e}"}
+        self.requests += 1
+        return {"id": request_id, "result": result}
+
+    async def _connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Requests on one connection are handled concurrently, so pipelined
+        # signals share a group commit, while the writer answers in order
+        task = asyncio.current_task()
+        self._connections.add(task)
+        pending: Deque[asyncio.Future] = deque()
+        ready = asyncio.Event()
+        done = False
+
+        async def respond():
+            while True:
+                while not pending:
+                    if done:
+                        return
+                    ready.clear()
+                    await ready.wait()
+                response = await pending.popleft()
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                # Returns at once until the client falls behind on reading
+                await writer.drain()
+
+        responder = asyncio.ensure_future(respond())
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    future = asyncio.get_running_loop().create_future()
+                    future.set_result({"id": None, "error": "Malformed JSON"})
+                else:
+                    future = asyncio.ensure_future(self.handle(request))
+                pending.append(future)
+                ready.set()
+        finally:
+            done = True
+            ready.set()
+            try:
+                await responder
+            except ConnectionError:
+                pass
+            finally:
+                writer.close()
+                self._connections.discard(task)
+
+    async def listen(self, socket_path: Optional[str] = None, port: Optional[int] = None,
+                     host: str = "127.0.0.1"):
+        if port is not None:
+            self._server = await asyncio.start_server(self._connection, host, port, limit=MAX_LINE)
+            return
+        if os.path.exists(socket_path):
+            # Left behind by a server that did not shut down cleanly
+            os.unlink(socket_path)
+        self._server = await asyncio.start_unix_server(self._connection, socket_path, limit=MAX_LINE)
+        self._socket_path = socket_path
+
+    @property
+    def port(self) -> Optional[int]:
+        sockets = self._server.sockets if self._server else []
+        if sockets and isinstance(sockets[0].getsockname(), tuple):
+            return sockets[0].getsockname()[1]
+        return None
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        # Stopping the listener leaves open connections running
+        connections = list(self._connections)
+        for connection in connections:
+            connection.cancel()
+        await asyncio.gather(*connections, return_exceptions=True)
+        if self._socket_path is not None and os.path.exists(self._socket_path):
+            os.unlink(self._socket_path)
+            self._socket_path = None
@@ -0,0 +1,354 @@
+import asyncio
+import multiprocessing
+import time
+import traceback
+from dataclasses import dataclass, field
+from typing import List, Optional, Callable, Set, Tuple
+from ..activities.runner import shutdown_pools
+from ..core import metrics
+from ..core.workflow import WorkflowStatus, shard_of
+from ..dsl.parser import WorkflowStep
+from ..timers.driver import TimerDriver
+from .executor import ActivityExecutionError, WorkflowExecutor
+
+
+# A long-running worker keeps only the first errors it sees
+MAX_ERRORS = 100
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+@dataclass
+class WorkerReport:
+    completed: int = 0
+    failed: int = 0
+    suspended: int = 0
+    timers_fired: int = 0
+    timers_failed: int = 0
+    archived: int = 0
+    archive_failures: int = 0
+    elapsed: float = 0.0
+    step_latencies: List[float] = field(default_factory=list)
+    # Problems the worker carried on past; the caller decides how to show them
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def workflows_per_second(self) -> float:
+        return (self.completed + self.failed) / self.elapsed if self.elapsed else 0.0
+
+    def merge(self, other: "WorkerReport"):
+        self.completed += other.completed
+        self.failed += other.failed
+        self.suspended += other.suspended
+        self.timers_fired += other.timers_fired
+        self.timers_failed += other.timers_failed
+        self.archived += other.archived
+        self.archive_failures += other.archive_failures
+        self.elapsed = max(self.elapsed, other.elapsed)
+        self.step_latencies.extend(other.step_latencies)
+        for error in other.errors:
+            self.record_error(error)
+
+    def record_error(self, message: str):
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(message)
+
+    def summary(self) -> str:
+        summary = (
+            f"Processed {self.completed + self.failed} workflows in {self.elapsed:.2f}s "
+            f"({self.workflows_per_second:.1f} workflows/sec): "
+            f"{self.completed} completed, {self.failed} failed, {self.suspended} waiting on timers, "
+            f"{self.timers_fired} timers fired"
+            + (f" ({self.timers_failed} failed to fire)" if self.timers_failed else "") + "\n"
+            f"Step latency: p50 {percentile(self.step_latencies, 50) * 1000:.2f}ms, "
+            f"p99 {percentile(self.step_latencies, 99) * 1000:.2f}ms "
+            f"over {len(self.step_latencies)} steps"
+        )
+        if self.archived or self.archive_failures:
+            summary += f"\nArchived {self.archived} workflows"
+            if self.archive_failures:
+                summary += f" ({self.archive_failures} archiving passes failed)"
+        return summary
+
+
+class WorkflowWorker:
+    def __init__(self, executor: WorkflowExecutor, max_inflight: int = 64, follow: bool = False,
+                 poll_interval: float = 1.0, shard: Optional[Tuple[int, int]] = None,
+                 batch_size: int = 500, metrics_path: Optional[str] = None,
+                 metrics_port: Optional[int] = None, metrics_interval: float = 5.0,
+                 retention: Optional[float] = None, retention_interval: float = 60.0,
+                 retention_batch: int = 500):
+        self.executor = executor
+        self.workflow_engine = executor.workflow_engine
+        self.catalog = self.workflow_engine.persistence.catalog
+        self.max_inflight = max_inflight
+        self.follow = follow
+        self.poll_interval = poll_interval
+        # (index, count): only claim workflows whose id hashes to this shard
+        self.shard = shard
+        self.batch_size = batch_size
+        # Either enables metrics. Shards write metrics-<index>.prom and
+        # serve on port + index, so processes never collide.
+        self.metrics_path = metrics_path
+        self.metrics_port = metrics_port
+        self.metrics_interval = metrics_interval
+        # With follow, workflows finished more than ``retention`` seconds ago
+        # are archived every retention_interval seconds. Only the first
+        # shard archives; the archive has a single writer.
+        self.retention = retention
+        self.retention_interval = retention_interval
+        self.retention_batch = retention_batch
+        self.report = WorkerReport()
+        self._claimed: Set[str] = set()
+        # Claimed workflows sleeping on a durable timer
+        self._waiting: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._driver: Optional[TimerDriver] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stop_archiving: Optional[asyncio.Event] = None
+
+    def _owns(self, workflow_id: str) -> bool:
+        return self.shard is None or shard_of(workflow_id, self.shard[1]) == self.shard[0]
+
+    def _claimable(self) -> List[str]:
+        # One keyset-paginated pass over runnable workflows in the catalog
+        claimable = []
+        for status in (WorkflowStatus.PENDING, WorkflowStatus.RUNNING):
+            cursor = None
+            while True:
+                entries = self.catalog.list(status=status.value, limit=self.batch_size, after=cursor)
+                if not entries:
+                    break
+                cursor = (entries[-1].created_at, entries[-1].id)
+                claimable.extend(
+                    e.id for e in entries if e.id not in self._claimed and self._owns(e.id)
+                )
+        return claimable
+
+    async def _run_one(self, workflow_id: str):
+        try:
+            instance = self.workflow_engine.resume_workflow(workflow_id)
+            if "timer" in instance.state:
+                # Sleeping on a durable timer; the timer resumes it
+                self.executor.restore_timer(instance)
+                self.workflow_engine.evict(workflow_id)
+                self._finished(workflow_id, "suspended")
+                return
+            steps = self.executor.definitions.get(instance.name)
+            if steps is None:
+                # Stays claimed, like any workflow that cannot run
+                self.workflow_engine.evict(workflow_id, snapshot=False)
+                self.report.failed += 1
+                self.report.record_error(f"No definition for workflow {instance.name}, skipped {workflow_id}")
+                return
+            await self.executor.execute_workflow(workflow_id, steps)
+            self._finished(workflow_id, "suspended" if "timer" in instance.state else "completed")
+        except ActivityExecutionError:
+            self._finished(workflow_id, "failed")
+        except Exception:
+            # Stays claimed so a broken workflow is not retried every pass
+            self.report.failed += 1
+        finally:
+            self._slots.release()
+
+    def _finished(self, workflow_id: str, outcome: str):
+        # Every run ends here, whether this worker claimed it or a timer
+        # resumed it. A suspended workflow stays claimed until it finishes.
+        if outcome == "suspended":
+            self._waiting.add(workflow_id)
+            return
+        self._waiting.discard(workflow_id)
+        self._claimed.discard(workflow_id)
+        if outcome == "completed":
+            self.report.completed += 1
+        else:
+            self.report.failed += 1
+        self.workflow_engine.evict(workflow_id, snapshot=False)
+
+    def wake(self):
+        # New work is in the catalog; a following worker polls now rather
+        # than at its next interval. Call from the worker's event loop.
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _count_timers(self, fired: int, failures: List[Exception]):
+        self.report.timers_fired += fired
+        self.report.timers_failed += len(failures)
+        for failure in failures:
+            self.report.record_error(str(failure))
+
+    def _observe_step(self, step: WorkflowStep, seconds: float):
+        self.report.step_latencies.append(seconds)
+
+    async def _archive(self):
+        # Each batch is archived on a thread, so workflows keep running
+        persistence = self.workflow_engine.persistence
+        loop = asyncio.get_running_loop()
+        while not self._stop_archiving.is_set():
+            archived = 0
+            try:
+                archived = await loop.run_in_executor(
+                    None, persistence.archive_finished, self.retention, None, self.retention_batch
+                )
+            except Exception as e:
+                # Retried at the next interval
+                self.report.archive_failures += 1
+                self.report.record_error(f"Archiving failed: {e}")
+            self.report.archived += archived
+            if archived < self.retention_batch:
+                try:
+                    await asyncio.wait_for(self._stop_archiving.wait(), self.retention_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _start_metrics(self) -> Callable[[], None]:
+        metrics.enable()
+        index = self.shard[0] if self.shard else 0
+        stops = []
+        if self.metrics_path:
+            path = self.metrics_path
+            if index == 0:
+                # Files from a run with another process count would be
+                # read as if they were this run's
+                metrics.remove_stale_textfiles(path, self.shard[1] if self.shard else None)
+            if self.shard:
+                path = metrics.shard_textfile(path, index)
+            stops.append(metrics.start_textfile_writer(path, self.metrics_interval))
+        if self.metrics_port is not None:
+            server = metrics.serve_http(self.metrics_port + index)
+            stops.append(server.shutdown)
+
+        def stop():
+            for stop_one in stops:
+                stop_one()
+        return stop
+
+    async def run(self) -> WorkerReport:
+        stop_metrics = None
+        if self.metrics_path is not None or self.metrics_port is not None:
+            stop_metrics = self._start_metrics()
+        driver_task = None
+        if self.follow and self.executor.timer_scheduler is not None:
+            # A long-running worker fires timers at their deadline from a
+            # driver task, instead of on its next poll
+            self._driver = TimerDriver(self.executor, self.max_inflight, self.batch_size,
+                                       on_error=lambda e: self.report.record_error(str(e)))
+            driver_task = asyncio.ensure_future(self._driver.run())
+        archive_task = None
+        if self.follow and self.retention is not None and (self.shard is None or self.shard[0] == 0):
+            self._stop_archiving = asyncio.Event()
+            archive_task = asyncio.ensure_future(self._archive())
+        try:
+            return await self._run()
+        finally:
+            if archive_task is not None:
+                # A batch in progress is finished rather than abandoned
+                self._stop_archiving.set()
+                await archive_task
+            if driver_task is not None:
+                self._driver.stop()
+                await driver_task
+                self.report.timers_fired += self._driver.fired
+                self.report.timers_failed += self._driver.failed
+            self.report.suspended = len(self._waiting)
+            if stop_metrics is not None:
+                stop_metrics()
+
+    async def _run(self) -> WorkerReport:
+        self._slots = asyncio.Semaphore(self.max_inflight)
+        self._wakeup = asyncio.Event()
+        self.executor.step_observer = self._observe_step
+        self.executor.run_observer = self._finished
+        started = time.perf_counter()
+        while True:
+            claimed = self._claimable()
+            for workflow_id in claimed:
+                await self._slots.acquire()
+                self._claimed.add(workflow_id)
+                task = asyncio.ensure_future(self._run_one(workflow_id))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+            fired = 0
+            if self.executor.timer_scheduler is not None and self._driver is None:
+                fired, failures = await self.executor.fire_ready_timers(self.batch_size)
+                self._count_timers(fired, failures)
+
+            if claimed or fired:
+                continue
+            if self._tasks:
+                await asyncio.wait(self._tasks, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            if self.workflow_engine.clock.virtual and self.executor.timer_scheduler is not None:
+                # Nothing is runnable until the next timer, so skip to it
+                fired, failures = await self.executor.skip_to_next_timer()
+                self._count_timers(fired, failures)
+                if fired:
+                    continue
+            if not self.follow:
+                break
+            self.workflow_engine.persistence.sync()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+        self.workflow_engine.persistence.sync()
+        self.report.elapsed = time.perf_counter() - started
+        return self.report
+
+
+def _run_shard(setup: Callable, shard: Tuple[int, int], options: dict) -> WorkerReport:
+    # ``setup(shard)`` builds a fresh executor inside the child process
+    executor = setup(shard)
+    try:
+        return asyncio.run(WorkflowWorker(executor, shard=shard, **options).run())
+    finally:
+        executor.workflow_engine.persistence.close()
+        # Child processes skip atexit, and live pool workers would block their exit
+        shutdown_pools()
+
+
+def _shard_main(setup: Callable, shard: Tuple[int, int], options: dict, connection):
+    try:
+        connection.send((True, _run_shard(setup, shard, options)))
+    except BaseException:
+        connection.send((False, traceback.format_exc()))
+    finally:
+        connection.close()
+
+
+def run_worker_processes(setup: Callable, processes: int, **options) -> WorkerReport:
+    # Plain processes rather than a multiprocessing.Pool: pool workers are
+    # daemonic and cannot start the process and subprocess activity pools
+    children = []
+    for index in range(processes):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        child = multiprocessing.Process(target=_shard_main, args=(setup, (index, processes), options, sender))
+        child.start()
+        sender.close()
+        children.append((child, receiver))
+    report = WorkerReport()
+    errors = []
+    for index, (child, receiver) in enumerate(children):
+        try:
+            ok, result = receiver.recv()
+        except EOFError:
+            ok, result = False, None
+        receiver.close()
+        child.join()
+        if ok:
+            report.merge(result)
+        else:
+            errors.append(f"Worker process {index} failed (exit code {child.exitcode})"
+                          + (f":\n{result}" if result else ""))
+    if errors:
+        raise RuntimeError("\n".join(errors))
+    return report
@@ -0,0 +1,70 @@
+import importlib
+import json
+import os
+import zlib
+from typing import Any, Dict, Iterator, List, Tuple
+from .eventlog import RECORD_HEADER, CorruptRecordError, Position, read_record, read_records
+
+# Workflows that finished longer ago than the retention period are moved
+# into the archive: a segmented log under storage/archive holding one record
+# per workflow. A record is a JSON header line (id, name, status, times,
+# event count and compression) followed by the workflow's event records,
+# framed as in its own log and compressed as one block, so a workflow is
+# read back with a single seek and decompress. The catalog indexes each
+# workflow's record by position; the headers let rebuild_catalog recover
+# that index.
+
+ARCHIVE_DIR = "archive"
+# Held by the one process appending to the archive
+ARCHIVE_LOCK = "archive.lock"
+COMPRESSIONS = ("gzip", "lzma")
+
+
+def _compression(name: str):
+    # Both modules have compress() and decompress(); they are imported on
+    # first use, since most commands never touch the archive
+    if name not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {name!r} (choose from {', '.join(COMPRESSIONS)})")
+    return importlib.import_module(name)
+
+
+def archive_path(storage_path: str) -> str:
+    return os.path.join(storage_path, ARCHIVE_DIR)
+
+
+def pack_workflow(header: Dict[str, Any], payloads: List[bytes], compression: str = "gzip") -> bytes:
+    body = b"".join(RECORD_HEADER.pack(len(p), zlib.crc32(p)) + p for p in payloads)
+    line = json.dumps(dict(header, compression=compression)).encode("utf-8")
+    return line + b"\n" + _compression(compression).compress(body)
+
+
+def unpack_header(record: bytes) -> Dict[str, Any]:
+    return json.loads(record[:record.index(b"\n")])
+
+
+def unpack_events(record: bytes) -> Iterator[Tuple[Position, bytes]]:
+    # Positions count from the start of the decompressed block, as if it
+    # were the workflow's only log segment
+    split = record.index(b"\n")
+    header = json.loads(record[:split])
+    body = _compression(header["compression"]).decompress(record[split + 1:])
+    offset = 0
+    while offset < len(body):
+        length, checksum = RECORD_HEADER.unpack_from(body, offset)
+        start = offset + RECORD_HEADER.size
+        payload = body[start:start + length]
+        if len(payload) != length or zlib.crc32(payload) != checksum:
+            raise CorruptRecordError(f"Corrupt event in archived workflow {header['id']} at {offset}")
+        yield (0, offset), payload
+        offset = start + length
+
+
+def read_archived(storage_path: str, position: Position) -> bytes:
+    return read_record(archive_path(storage_path), position)
+
+
+def scan_archive(storage_path: str) -> Iterator[Tuple[Position, Dict[str, Any]]]:
+    # Every record's position and header, oldest first; event blocks are
+    # not decompressed
+    for position, record in read_records(archive_path(storage_path)):
+        yield position, unpack_header(record)
@@ -0,0 +1,169 @@
+import sqlite3
+from dataclasses import dataclass
+from typing import List, Optional, Iterable, Tuple
+
+CATALOG_FILE = "catalog.db"
+
+
+@dataclass
+class CatalogEntry:
+    id: str
+    name: str
+    status: str
+    event_count: int
+    created_at: float
+    updated_at: float
+    log_segment: int
+    log_offset: int
+    # Position of the workflow's record in the archive, once it is archived
+    archive_segment: Optional[int] = None
+    archive_offset: Optional[int] = None
+
+    @property
+    def archive_position(self) -> Optional[Tuple[int, int]]:
+        if self.archive_segment is None:
+            return None
+        return self.archive_segment, self.archive_offset
+
+
+_COLUMNS = ("id, name, status, event_count, created_at, updated_at, log_segment, log_offset, "
+            "archive_segment, archive_offset")
+
+
+class WorkflowCatalog:
+    def __init__(self, path: str):
+        self.path = path
+        # Worker processes share the catalog, so wait for locks instead of
+        # failing immediately
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS workflows (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                status TEXT NOT NULL,
+                event_count INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                log_segment INTEGER NOT NULL DEFAULT 0,
+                log_offset INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS workflows_status ON workflows (status, created_at);
+            CREATE INDEX IF NOT EXISTS workflows_name ON workflows (name, created_at);
+        """)
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(workflows)")}
+        if "archive_segment" not in columns:
+            # Catalogs written before the archive existed
+            self.connection.execute("ALTER TABLE workflows ADD COLUMN archive_segment INTEGER")
+            self.connection.execute("ALTER TABLE workflows ADD COLUMN archive_offset INTEGER")
+        # Only live workflows are candidates for archiving
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS workflows_live ON workflows (updated_at) WHERE archive_segment IS NULL"
+        )
+        self.connection.commit()
+
+    def upsert(self, workflow_id: str, name: str, status: str, timestamp: float):
+        # Event counts and log offsets only move through record_progress
+        self.connection.execute(
+            "INSERT INTO workflows (id, name, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET name = excluded.name, status = excluded.status, "
+            "updated_at = excluded.updated_at",
+            (workflow_id, name, status, timestamp, timestamp)
+        )
+        self.connection.commit()
+
+    def record_progress(self, updates: Iterable[Tuple[str, int, int, int, float]]):
+        # updates: (workflow id, events appended, log segment, log offset, timestamp)
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE workflows SET event_count = event_count + ?, log_segment = ?, "
+                "log_offset = ?, updated_at = ? WHERE id = ?",
+                [(count, segment, offset, timestamp, workflow_id)
+                 for workflow_id, count, segment, offset, timestamp in updates]
+            )
+
+    def get(self, workflow_id: str) -> Optional[CatalogEntry]:
+        row = self.connection.execute(
+            f"SELECT {_COLUMNS} FROM workflows WHERE id = ?", (workflow_id,)
+        ).fetchone()
+        return CatalogEntry(*row) if row else None
+
+    def _where(self, status: Optional[str], name: Optional[str]) -> Tuple[str, list]:
+        clauses = []
+        params = []
+        if status:
+            clauses.append("status = ?")
+            params.append(status)
+        if name:
+            clauses.append("name = ?")
+            params.append(name)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def list(self, status: Optional[str] = None, name: Optional[str] = None,
+             limit: Optional[int] = None, offset: int = 0,
+             after: Optional[Tuple[float, str]] = None) -> List[CatalogEntry]:
+        # ``after`` is a (created_at, id) keyset cursor; unlike ``offset`` it
+        # stays stable while rows change status underneath the caller
+        where, params = self._where(status, name)
+        if after is not None:
+            where += (" AND " if where else " WHERE ") + "(created_at, id) > (?, ?)"
+            params += list(after)
+        query = f"SELECT {_COLUMNS} FROM workflows{where} ORDER BY created_at, id"
+        if limit is not None:
+            query += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        return [CatalogEntry(*row) for row in self.connection.execute(query, params)]
+
+    def count(self, status: Optional[str] = None, name: Optional[str] = None) -> int:
+        where, params = self._where(status, name)
+        return self.connection.execute(f"SELECT COUNT(*) FROM workflows{where}", params).fetchone()[0]
+
+    def finished_before(self, cutoff: float, statuses: Iterable[str], limit: int) -> List[CatalogEntry]:
+        # Live workflows in one of ``statuses`` last updated before cutoff,
+        # least recently updated first
+        statuses = list(statuses)
+        placeholders = ", ".join("?" for _ in statuses)
+        return [CatalogEntry(*row) for row in self.connection.execute(
+            f"SELECT {_COLUMNS} FROM workflows WHERE archive_segment IS NULL AND updated_at < ? "
+            f"AND status IN ({placeholders}) ORDER BY updated_at LIMIT ?",
+            [cutoff, *statuses, limit]
+        )]
+
+    def mark_archived(self, updates: Iterable[Tuple[str, float, int, int]]) -> List[str]:
+        # updates: (workflow id, updated_at it was archived at, archive
+        # segment, archive offset). A workflow updated since is left live;
+        # returns the ids that were marked.
+        marked = []
+        with self.connection:
+            for workflow_id, updated_at, segment, offset in updates:
+                cursor = self.connection.execute(
+                    "UPDATE workflows SET archive_segment = ?, archive_offset = ? "
+                    "WHERE id = ? AND updated_at = ? AND archive_segment IS NULL",
+                    (segment, offset, workflow_id, updated_at)
+                )
+                if cursor.rowcount:
+                    marked.append(workflow_id)
+        return marked
+
+    def unarchive(self, workflow_id: str):
+        with self.connection:
+            self.connection.execute(
+                "UPDATE workflows SET archive_segment = NULL, archive_offset = NULL WHERE id = ?", (workflow_id,)
+            )
+
+    def event_total(self) -> int:
+        return self.connection.execute("SELECT COALESCE(SUM(event_count), 0) FROM workflows").fetchone()[0]
+
+    def replace_all(self, entries: Iterable[CatalogEntry]):
+        with self.connection:
+            self.connection.execute("DELETE FROM workflows")
+            self.connection.executemany(
+                f"INSERT INTO workflows ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(e.id, e.name, e.status, e.event_count, e.created_at, e.updated_at,
+                  e.log_segment, e.log_offset, e.archive_segment, e.archive_offset) for e in entries]
+            )
+
+    def close(self):
+        self.connection.close()
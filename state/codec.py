@@ -0,0 +1,180 @@
+import json
+import marshal
+import struct
+import sys
+from typing import Any, Dict, Tuple
+from ..core.workflow import WorkflowEvent
+
+
+def event_to_dict(event: WorkflowEvent) -> Dict[str, Any]:
+    return {
+        "id": event.id,
+        "timestamp": event.timestamp,
+        "type": event.type,
+        "data": event.data
+    }
+
+
+def event_from_dict(e: Dict[str, Any]) -> WorkflowEvent:
+    return WorkflowEvent(
+        id=e["id"],
+        timestamp=e["timestamp"],
+        type=sys.intern(e["type"]),
+        data=e["data"]
+    )
+
+
+class EventCodec:
+    # Every encoded event starts with its codec's tag byte, so logs written
+    # with different codecs (or codec versions) stay readable side by side
+    tag: int = 0
+    name: str = ""
+
+    def encode(self, event: WorkflowEvent) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, payload: bytes) -> WorkflowEvent:
+        raise NotImplementedError
+
+    def decode_header(self, payload: bytes) -> Tuple[int, float, str]:
+        # (id, timestamp, type) without decoding the event data
+        event = self.decode(payload)
+        return event.id, event.timestamp, event.type
+
+
+class JsonCodec(EventCodec):
+    # The original format, kept for export and for reading older logs; a
+    # JSON object always starts with "{"
+    tag = ord("{")
+    name = "json"
+
+    def encode(self, event: WorkflowEvent) -> bytes:
+        return json.dumps(event_to_dict(event), separators=(",", ":")).encode("utf-8")
+
+    def decode(self, payload: bytes) -> WorkflowEvent:
+        return event_from_dict(json.loads(payload))
+
+
+_DATA_SLOT = WorkflowEvent.data
+
+
+class LazyWorkflowEvent(WorkflowEvent):
+    # Header fields are decoded up front; ``data`` is decoded on first access
+    __slots__ = ("_payload", "_offset", "_codec")
+
+    def __init__(self, id: int, timestamp: float, type: str, payload: bytes, offset: int,
+                 codec: "BinaryCodec"):
+        self.id = id
+        self.timestamp = timestamp
+        self.type = type
+        self._payload = payload
+        self._offset = offset
+        self._codec = codec
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        if self._payload is not None:
+            _DATA_SLOT.__set__(self, self._codec.decode_data(self._payload, self._offset))
+            self._payload = None
+        return _DATA_SLOT.__get__(self)
+
+    @data.setter
+    def data(self, value: Dict[str, Any]):
+        _DATA_SLOT.__set__(self, value)
+        self._payload = None
+
+    def __eq__(self, other):
+        if not isinstance(other, WorkflowEvent):
+            return NotImplemented
+        return (self.id, self.timestamp, self.type, self.data) == (other.id, other.timestamp, other.type, other.data)
+
+    def __repr__(self):
+        return (f"WorkflowEvent(id={self.id!r}, timestamp={self.timestamp!r}, "
+                f"type={self.type!r}, data={self.data!r})")
+
+
+class BinaryCodec(EventCodec):
+    # tag, id, timestamp, type code; code 0 is followed by the type name.
+    # The event data follows as compact JSON, which every Python version
+    # reads the same way.
+    tag = 0x02
+    name = "binary"
+    HEADER = struct.Struct(">BQdB")
+    TYPE_NAME = struct.Struct(">H")
+    # Append only: the position of a type is its code on disk
+    EVENT_TYPES = ("ActivityCompleted", "ActivityFailed", "ParallelCompleted", "TimerStarted", "TimerFired")
+    _TYPE_CODES = {name: code for code, name in enumerate(EVENT_TYPES, start=1)}
+
+    def encode(self, event: WorkflowEvent) -> bytes:
+        code = self._TYPE_CODES.get(event.type, 0)
+        header = self.HEADER.pack(self.tag, event.id, event.timestamp, code)
+        data = self.encode_data(event.data)
+        if code:
+            return header + data
+        name = event.type.encode("utf-8")
+        return b"".join((header, self.TYPE_NAME.pack(len(name)), name, data))
+
+    def encode_data(self, data: Dict[str, Any]) -> bytes:
+        return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+    def decode_data(self, payload: bytes, offset: int) -> Dict[str, Any]:
+        return json.loads(payload[offset:])
+
+    def _header(self, payload: bytes) -> Tuple[int, float, str, int]:
+        _, event_id, timestamp, code = self.HEADER.unpack_from(payload)
+        offset = self.HEADER.size
+        if code:
+            event_type = self.EVENT_TYPES[code - 1]
+        else:
+            (length,) = self.TYPE_NAME.unpack_from(payload, offset)
+            offset += self.TYPE_NAME.size
+            event_type = sys.intern(payload[offset:offset + length].decode("utf-8"))
+            offset += length
+        return event_id, timestamp, event_type, offset
+
+    def decode(self, payload: bytes) -> WorkflowEvent:
+        event_id, timestamp, event_type, offset = self._header(payload)
+        return LazyWorkflowEvent(event_id, timestamp, event_type, payload, offset, self)
+
+    def decode_header(self, payload: bytes) -> Tuple[int, float, str]:
+        return self._header(payload)[:3]
+
+
+class MarshalCodec(BinaryCodec):
+    # The binary format of earlier releases, kept for reading their logs.
+    # Its event data is in marshal format, which Python only promises to
+    # read back on the version that wrote it.
+    tag = 0x01
+    name = "marshal"
+    MARSHAL_VERSION = 4
+
+    def encode_data(self, data: Dict[str, Any]) -> bytes:
+        return marshal.dumps(data, self.MARSHAL_VERSION)
+
+    def decode_data(self, payload: bytes, offset: int) -> Dict[str, Any]:
+        try:
+            return marshal.loads(memoryview(payload)[offset:])
+        except (EOFError, TypeError, ValueError) as e:
+            raise ValueError(
+                f"Cannot read marshal-encoded event data on Python {sys.version_info[0]}.{sys.version_info[1]} "
+                f"({e}); read this log with the Python version that wrote it"
+            ) from e
+
+
+CODECS = {codec.tag: codec for codec in (JsonCodec(), MarshalCodec(), BinaryCodec())}
+DEFAULT_CODEC = CODECS[BinaryCodec.tag]
+
+
+def codec_for(payload: bytes) -> EventCodec:
+    codec = CODECS.get(payload[0])
+    if codec is None:
+        raise ValueError(f"Unknown event encoding {payload[0]:#04x}")
+    return codec
+
+
+def decode_event(payload: bytes) -> WorkflowEvent:
+    return codec_for(payload).decode(payload)
+
+
+def decode_header(payload: bytes) -> Tuple[int, float, str]:
+    return codec_for(payload).decode_header(payload)
@@ -0,0 +1,227 @@
+import mmap
+import os
+import struct
+import zlib
+from typing import Iterator, List, Optional, Tuple
+
+
+# Every record is framed as: payload length, crc32 of payload, payload bytes.
+RECORD_HEADER = struct.Struct(">II")
+SEGMENT_SUFFIX = ".seg"
+
+# (segment number, byte offset within that segment)
+Position = Tuple[int, int]
+
+
+class CorruptRecordError(Exception):
+    pass
+
+
+class SegmentedLog:
+    def __init__(self, directory: str, max_segment_bytes: int = 64 * 1024 * 1024):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.segments: List[int] = list_segments(directory)
+        self.last_payload: Optional[bytes] = None
+        self.dirty = False
+        self._file = None
+        self._size = 0
+        self._recover()
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{number:08d}{SEGMENT_SUFFIX}")
+
+    def _recover(self):
+        # Sealed segments were fsynced when they rolled over, so only the
+        # active (last) segment can hold a torn or partially written record.
+        if not self.segments:
+            self.segments.append(0)
+            self._size = 0
+            return
+
+        path = self._segment_path(self.segments[-1])
+        good_offset = 0
+        with open(path, 'rb') as f:
+            for offset, payload, _ in _scan(f):
+                if payload is None:
+                    break
+                self.last_payload = payload
+                good_offset = offset
+        if good_offset != os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(good_offset)
+                os.fsync(f.fileno())
+        self._size = good_offset
+
+    def _open_active(self):
+        if self._file is None:
+            self._file = open(self._segment_path(self.segments[-1]), 'ab')
+        return self._file
+
+    def _roll(self):
+        self.sync()
+        self._file.close()
+        self._file = None
+        self.segments.append(self.segments[-1] + 1)
+        self._size = 0
+
+    def append(self, payload: bytes) -> Position:
+        record_size = RECORD_HEADER.size + len(payload)
+        if self._size and self._size + record_size > self.max_segment_bytes:
+            self._roll()
+        f = self._open_active()
+        position = (self.segments[-1], self._size)
+        f.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+        f.write(payload)
+        self._size += record_size
+        self.last_payload = payload
+        self.dirty = True
+        return position
+
+    def append_batch(self, payloads: List[bytes]) -> Position:
+        # One buffered write for the whole batch; a batch never straddles
+        # two segments
+        frames = []
+        for payload in payloads:
+            frames.append(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+            frames.append(payload)
+        data = b"".join(frames)
+        if self._size and self._size + len(data) > self.max_segment_bytes:
+            self._roll()
+        f = self._open_active()
+        position = (self.segments[-1], self._size)
+        f.write(data)
+        self._size += len(data)
+        self.last_payload = payloads[-1]
+        self.dirty = True
+        return position
+
+    def end_position(self) -> Position:
+        return (self.segments[-1], self._size)
+
+    def flush(self):
+        # Hands buffered records to the OS; they are not durable until sync
+        if self._file is not None:
+            self._file.flush()
+
+    def sync(self, durable: bool = True):
+        if self._file is not None and self.dirty:
+            self._file.flush()
+            if durable:
+                os.fsync(self._file.fileno())
+        self.dirty = False
+
+    def close(self, durable: bool = True):
+        if self._file is not None:
+            self.sync(durable)
+            self._file.close()
+            self._file = None
+
+    def iter_records(self, start: Optional[Position] = None) -> Iterator[Tuple[Position, bytes]]:
+        self.flush()
+        return read_records(self.directory, start, list(self.segments))
+
+
+def list_segments(directory: str) -> List[int]:
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        int(name[:-len(SEGMENT_SUFFIX)])
+        for name in os.listdir(directory)
+        if name.endswith(SEGMENT_SUFFIX)
+    )
+
+
+def log_end(directory: str) -> Optional[Position]:
+    # The last segment and its size on disk, partial records included, so
+    # it moves with every append that reaches the file
+    segments = list_segments(directory)
+    if not segments:
+        return None
+    path = os.path.join(directory, f"{segments[-1]:08d}{SEGMENT_SUFFIX}")
+    return segments[-1], os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def next_position(position: Position, payload: bytes) -> Position:
+    return position[0], position[1] + RECORD_HEADER.size + len(payload)
+
+
+def read_records(directory: str, start: Optional[Position] = None,
+                 segments: Optional[List[int]] = None) -> Iterator[Tuple[Position, bytes]]:
+    # Read-only scan over memory-mapped segments. Unlike opening a
+    # SegmentedLog it never repairs anything, so it is safe while another
+    # process appends: a partial record at the end of the last segment is
+    # treated as not written yet.
+    if segments is None:
+        segments = list_segments(directory)
+    if not segments:
+        return
+    start_segment, start_offset = start if start is not None else (segments[0], 0)
+    for number in segments:
+        if number < start_segment:
+            continue
+        offset = start_offset if number == start_segment else 0
+        is_last = number == segments[-1]
+        path = os.path.join(directory, f"{number:08d}{SEGMENT_SUFFIX}")
+        if is_last and not os.path.exists(path):
+            # Fresh log that has not been appended to yet
+            break
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= offset:
+                continue
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as view:
+                while offset < size:
+                    end = offset + RECORD_HEADER.size
+                    corrupt = False
+                    if end <= size:
+                        length, checksum = RECORD_HEADER.unpack_from(view, offset)
+                        end += length
+                    if end <= size:
+                        payload = view[offset + RECORD_HEADER.size:end]
+                        if zlib.crc32(payload) == checksum:
+                            yield (number, offset), payload
+                            offset = end
+                            continue
+                        corrupt = True
+                    if corrupt or not is_last:
+                        raise CorruptRecordError(f"Corrupt record in {path} at offset {offset}")
+                    return
+
+
+def read_record(directory: str, position: Position) -> bytes:
+    # The one record at ``position``, without scanning the segment
+    number, offset = position
+    path = os.path.join(directory, f"{number:08d}{SEGMENT_SUFFIX}")
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        header = f.read(RECORD_HEADER.size)
+        if len(header) == RECORD_HEADER.size:
+            length, checksum = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) == length and zlib.crc32(payload) == checksum:
+                return payload
+    raise CorruptRecordError(f"No valid record in {path} at offset {offset}")
+
+
+def _scan(f, offset: int = 0) -> Iterator[Tuple[int, Optional[bytes], bool]]:
+    # Yields (offset after record, payload, corrupt). A ``None`` payload marks
+    # the end of valid data: either EOF, a torn tail, or a checksum mismatch.
+    while True:
+        header = f.read(RECORD_HEADER.size)
+        if not header:
+            return
+        if len(header) < RECORD_HEADER.size:
+            yield offset, None, False
+            return
+        length, checksum = RECORD_HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length:
+            yield offset, None, False
+            return
+        if zlib.crc32(payload) != checksum:
+            yield offset, None, True
+            return
+        offset += RECORD_HEADER.size + length
+        yield offset, payload, False
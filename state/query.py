@@ -0,0 +1,396 @@
+import bisect
+import csv
+import io
+import itertools
+import json
+import os
+import re
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, Generator, Iterable, Iterator, List, Optional, Sequence, Tuple
+from ..core.metrics import LATENCY_BUCKETS, histogram_quantile
+from .archive import read_archived, unpack_events
+from .catalog import CATALOG_FILE, CatalogEntry, WorkflowCatalog
+from .codec import decode_event, decode_header
+from .eventlog import Position, read_records
+from .persistence import history_path
+
+# Scans every persisted workflow history without opening the store: the
+# catalog says which workflows to read and where, and each log is read with
+# read_records, which never writes and is safe while workers append, or
+# from its archive record. Logs
+# are read in chunks of workflows, by worker processes when there are
+# several, and only a bounded number of chunk results are held at once.
+
+EXPORT_COLUMNS = ("workflow_id", "workflow_name", "status", "seq", "timestamp", "type", "activity", "data")
+AGGREGATES = ("activities", "types", "workflows", "durations")
+ACTIVITY_EVENTS = ("ActivityCompleted", "ActivityFailed")
+# Latency buckets extended to days, since a workflow can wait on timers
+DURATION_BUCKETS = LATENCY_BUCKETS + (300.0, 900.0, 3600.0, 14400.0, 86400.0, 604800.0)
+
+_RELATIVE_TIME = re.compile(r"^(\d+(?:\.\d+)?)([smhd])$")
+_UNIT_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# (workflow id, name, status, archive position or None)
+ChunkEntry = Tuple[str, str, str, Optional[Position]]
+
+
+def parse_duration(value: str) -> float:
+    # Seconds from 90s, 30m, 24h, 7d or a plain number of seconds
+    value = value.strip()
+    match = _RELATIVE_TIME.match(value)
+    if match:
+        return float(match.group(1)) * _UNIT_SECONDS[match.group(2)]
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"Unrecognized duration {value!r}") from None
+
+
+def parse_time(value: str, now: Optional[float] = None) -> float:
+    # Epoch seconds, an ISO date or datetime (local time unless it has an
+    # offset), "today", "yesterday", or an age such as 30m, 24h or 7d
+    now = time.time() if now is None else now
+    value = value.strip()
+    if value in ("today", "yesterday"):
+        midnight = datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+        return midnight - (86400 if value == "yesterday" else 0)
+    if _RELATIVE_TIME.match(value):
+        return now - parse_duration(value)
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ValueError(f"Unrecognized time {value!r}") from None
+
+
+@dataclass
+class EventQuery:
+    # Empty lists and None mean "any"; since is inclusive, until exclusive
+    names: Optional[List[str]] = None
+    statuses: Optional[List[str]] = None
+    workflow_ids: Optional[List[str]] = None
+    types: Optional[List[str]] = None
+    activities: Optional[List[str]] = None
+    since: Optional[float] = None
+    until: Optional[float] = None
+
+    @property
+    def filters_events(self) -> bool:
+        return bool(self.types or self.activities) or self.since is not None or self.until is not None
+
+    def matches_workflow(self, entry: CatalogEntry) -> bool:
+        if self.names and entry.name not in self.names:
+            return False
+        if self.statuses and entry.status not in self.statuses:
+            return False
+        # Times are not checked against the catalog: it records wall-clock
+        # times, events carry the engine clock's, which may be virtual
+        return True
+
+    def matches_header(self, event_type: str, timestamp: float) -> bool:
+        if self.types and event_type not in self.types:
+            return False
+        if self.since is not None and timestamp < self.since:
+            return False
+        if self.until is not None and timestamp >= self.until:
+            return False
+        return True
+
+
+def _catalog_entries(catalog: WorkflowCatalog, query: EventQuery, page: int = 1000) -> Iterator[CatalogEntry]:
+    if query.workflow_ids:
+        for workflow_id in query.workflow_ids:
+            entry = catalog.get(workflow_id)
+            if entry is not None and query.matches_workflow(entry):
+                yield entry
+        return
+    # A single name or status is left to SQL; several are filtered here
+    name = query.names[0] if query.names and len(query.names) == 1 else None
+    status = query.statuses[0] if query.statuses and len(query.statuses) == 1 else None
+    after = None
+    while True:
+        entries = catalog.list(status=status, name=name, limit=page, after=after)
+        for entry in entries:
+            if query.matches_workflow(entry):
+                yield entry
+        if len(entries) < page:
+            return
+        after = (entries[-1].created_at, entries[-1].id)
+
+
+def plan_chunks(storage_path: str, query: EventQuery, chunk_events: int = 50000,
+                chunk_workflows: int = 1000) -> Iterator[List[ChunkEntry]]:
+    # Groups matching workflows, in creation order, into chunks of roughly
+    # chunk_events events according to the catalog
+    path = os.path.join(storage_path, CATALOG_FILE)
+    if not os.path.exists(path):
+        return
+    catalog = WorkflowCatalog(path)
+    try:
+        chunk: List[ChunkEntry] = []
+        events = 0
+        for entry in _catalog_entries(catalog, query):
+            chunk.append((entry.id, entry.name, entry.status, entry.archive_position))
+            events += entry.event_count
+            if events >= chunk_events or len(chunk) >= chunk_workflows:
+                yield chunk
+                chunk, events = [], 0
+        if chunk:
+            yield chunk
+    finally:
+        catalog.close()
+
+
+def scan_workflow(storage_path: str, workflow_id: str, query: EventQuery, need_data: bool,
+                  archive: Optional[Position] = None
+                  ) -> Iterator[Tuple[int, float, str, Optional[Dict[str, Any]]]]:
+    # (seq, timestamp, type, data) for each matching event. Data is only
+    # decoded when it is asked for or needed to filter by activity.
+    decode_data = need_data or bool(query.activities)
+    if archive is not None:
+        records = unpack_events(read_archived(storage_path, archive))
+    else:
+        records = read_records(history_path(storage_path, workflow_id))
+    for _, payload in records:
+        seq, timestamp, event_type = decode_header(payload)
+        if not query.matches_header(event_type, timestamp):
+            continue
+        data = None
+        if decode_data:
+            data = decode_event(payload).data
+            if query.activities and (not isinstance(data, dict) or data.get("activity") not in query.activities):
+                continue
+        yield seq, timestamp, event_type, data
+
+
+def _activity(data: Any) -> str:
+    return data.get("activity", "") if isinstance(data, dict) else ""
+
+
+class _CsvLine:
+    def __init__(self):
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, lineterminator="")
+
+    def __call__(self, values: Sequence[Any]) -> str:
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.writer.writerow(values)
+        return self.buffer.getvalue()
+
+
+def _export_chunk(task: Tuple[str, List[ChunkEntry], EventQuery, str]) -> List[str]:
+    storage_path, entries, query, fmt = task
+    csv_line = _CsvLine() if fmt == "csv" else None
+    lines = []
+    for workflow_id, name, status, archive in entries:
+        for seq, timestamp, event_type, data in scan_workflow(storage_path, workflow_id, query, True, archive):
+            if csv_line is not None:
+                lines.append(csv_line((workflow_id, name, status, seq, timestamp, event_type,
+                                       _activity(data), json.dumps(data, default=str))))
+            else:
+                lines.append(json.dumps({
+                    "workflow_id": workflow_id, "workflow_name": name, "status": status, "seq": seq,
+                    "timestamp": timestamp, "type": event_type, "data": data
+                }, default=str))
+    return lines
+
+
+class Aggregate:
+    # A partial result that can be merged with others; each worker process
+    # builds one per chunk. Groups hold plain lists, so they pickle cheaply.
+    def __init__(self, kind: str, query: Optional[EventQuery] = None):
+        if kind not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate {kind!r} (choose from {', '.join(AGGREGATES)})")
+        self.kind = kind
+        self.count_empty = not (query and query.filters_events)
+        self.groups: Dict[Any, list] = {}
+        # [events, first timestamp, last timestamp] of the workflow being added
+        self._workflow: Optional[list] = None
+
+    @staticmethod
+    def _bucket(seconds: float) -> int:
+        return bisect.bisect_left(DURATION_BUCKETS, seconds)
+
+    def _timed_group(self, key: Any, counters: int) -> list:
+        # [counters..., total seconds, bucket counts with +Inf last]
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = [0] * counters + [0.0, [0] * (len(DURATION_BUCKETS) + 1)]
+        return group
+
+    def add(self, timestamp: float, event_type: str, data: Any):
+        if self.kind == "types":
+            self.groups[event_type] = [self.groups.get(event_type, [0])[0] + 1]
+        elif self.kind == "workflows":
+            if self._workflow is None:
+                self._workflow = [0, timestamp, timestamp]
+            self._workflow[0] += 1
+            self._workflow[2] = timestamp
+        elif event_type in ACTIVITY_EVENTS:
+            # [completed, failed, timed, ...]: only attempts whose run time
+            # the runner measured and recorded are timed
+            group = self._timed_group(_activity(data), 3)
+            group[0 if event_type == "ActivityCompleted" else 1] += 1
+            duration = data.get("duration") if isinstance(data, dict) else None
+            if isinstance(duration, (int, float)):
+                group[2] += 1
+                group[3] += duration
+                group[4][self._bucket(duration)] += 1
+
+    def finish_workflow(self, name: str, status: str):
+        if self.kind == "workflows" and (self._workflow is not None or self.count_empty):
+            events, first, last = self._workflow or (0, 0.0, 0.0)
+            group = self._timed_group((name, status), 2)
+            group[0] += 1
+            group[1] += events
+            group[2] += last - first
+            group[3][self._bucket(last - first)] += 1
+        self._workflow = None
+
+    def merge(self, other: "Aggregate"):
+        for key, values in other.groups.items():
+            group = self.groups.get(key)
+            if group is None:
+                self.groups[key] = values
+                continue
+            for index, value in enumerate(values):
+                if isinstance(value, list):
+                    group[index] = [a + b for a, b in zip(group[index], value)]
+                else:
+                    group[index] += value
+
+    @staticmethod
+    def _quantiles(counts: List[int]) -> Tuple[Optional[float], Optional[float]]:
+        cumulative: List[Tuple[float, float]] = []
+        total = 0
+        for bound, count in zip(DURATION_BUCKETS + (float("inf"),), counts):
+            total += count
+            cumulative.append((bound, total))
+        return histogram_quantile(cumulative, 0.5), histogram_quantile(cumulative, 0.95)
+
+    def rows(self) -> List[Dict[str, Any]]:
+        rows = []
+        for key in sorted(self.groups):
+            group = self.groups[key]
+            if self.kind == "types":
+                rows.append({"type": key, "events": group[0]})
+            elif self.kind == "activities":
+                completed, failed, timed, total, counts = group
+                p50, p95 = self._quantiles(counts)
+                rows.append({
+                    "activity": key, "completed": completed, "failed": failed,
+                    "failure_rate": round(failed / (completed + failed), 4),
+                    "mean_s": round(total / timed, 6) if timed else None, "p50_s": p50, "p95_s": p95
+                })
+            elif self.kind == "workflows":
+                workflows, events, total, counts = group
+                p50, p95 = self._quantiles(counts)
+                rows.append({
+                    "name": key[0], "status": key[1], "workflows": workflows, "events": events,
+                    "mean_s": round(total / workflows, 6), "p50_s": p50, "p95_s": p95
+                })
+            else:
+                for bound, count in zip(DURATION_BUCKETS + (float("inf"),), group[-1]):
+                    if count:
+                        rows.append({"activity": key, "le_s": bound, "count": count})
+        return rows
+
+
+def _aggregate_chunk(task: Tuple[str, List[ChunkEntry], EventQuery, str]) -> Aggregate:
+    storage_path, entries, query, kind = task
+    aggregate = Aggregate(kind, query)
+    # Only activity aggregates look inside events, for the activity name
+    need_data = kind in ("activities", "durations")
+    for workflow_id, name, status, archive in entries:
+        for _, timestamp, event_type, data in scan_workflow(storage_path, workflow_id, query, need_data, archive):
+            aggregate.add(timestamp, event_type, data)
+        aggregate.finish_workflow(name, status)
+    return aggregate
+
+
+def _map(function: Callable[[Any], Any], tasks: Iterable[Any], processes: int) -> Generator[Any, None, None]:
+    # Results in task order. With several processes at most two tasks per
+    # process are outstanding, which bounds memory however large the store
+    # is; closing the iterator early stops the pool. A single task runs
+    # here, without paying for a pool.
+    tasks = iter(tasks)
+    head = list(itertools.islice(tasks, 2))
+    if processes <= 1 or len(head) < 2:
+        for task in itertools.chain(head, tasks):
+            yield function(task)
+        return
+    import multiprocessing
+    tasks = itertools.chain(head, tasks)
+    with multiprocessing.Pool(processes) as pool:
+        pending: Deque[Any] = deque()
+        for task in tasks:
+            pending.append(pool.apply_async(function, (task,)))
+            if len(pending) >= processes * 2:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def export_events(storage_path: str, query: EventQuery, fmt: str = "jsonl", processes: int = 1,
+                  limit: Optional[int] = None, chunk_events: int = 50000) -> Iterator[str]:
+    # Lines without newlines, workflows in creation order and each
+    # workflow's events in sequence order; CSV starts with a header
+    if fmt not in ("jsonl", "csv"):
+        raise ValueError(f"Unknown export format {fmt!r}")
+    if fmt == "csv":
+        yield _CsvLine()(EXPORT_COLUMNS)
+    if limit is not None and limit <= 0:
+        return
+    tasks = ((storage_path, chunk, query, fmt) for chunk in plan_chunks(storage_path, query, chunk_events))
+    written = 0
+    results = _map(_export_chunk, tasks, processes)
+    try:
+        for lines in results:
+            for line in lines:
+                yield line
+                written += 1
+                if written == limit:
+                    return
+    finally:
+        results.close()
+
+
+def aggregate_events(storage_path: str, query: EventQuery, kind: str = "activities", processes: int = 1,
+                     chunk_events: int = 50000) -> Aggregate:
+    total = Aggregate(kind, query)
+    tasks = ((storage_path, chunk, query, kind) for chunk in plan_chunks(storage_path, query, chunk_events))
+    for partial in _map(_aggregate_chunk, tasks, processes):
+        total.merge(partial)
+    return total
+
+
+def format_rows(rows: List[Dict[str, Any]], fmt: str = "table") -> Iterator[str]:
+    if fmt == "jsonl":
+        for row in rows:
+            yield json.dumps(row)
+        return
+    if not rows:
+        return
+    columns = list(rows[0])
+    if fmt == "csv":
+        csv_line = _CsvLine()
+        yield csv_line(columns)
+        for row in rows:
+            yield csv_line([row[c] for c in columns])
+        return
+    cells = [[("-" if row[c] is None else str(row[c])) for c in columns] for row in rows]
+    widths = [max(len(c), *(len(line[i]) for line in cells)) for i, c in enumerate(columns)]
+    yield "  ".join(c.ljust(w) for c, w in zip(columns, widths)).rstrip()
+    for line in cells:
+        # Text left-aligned, numbers right-aligned
+        yield "  ".join(
+            value.ljust(w) if isinstance(rows[0][c], str) else value.rjust(w)
+            for value, c, w in zip(line, columns, widths)
+        ).rstrip()
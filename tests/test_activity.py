@@ -1,6 +1,18 @@
 import unittest
+import asyncio
+import os
+import threading
 from unittest.mock import patch
-from localflow.activities.runner import ActivityRunner, ActivityResult
+import random
+import time
+from localflow.activities.cache import ResultCache
+from localflow.activities.runner import (
+    ActivityRunner, ActivityResult, ExecutionPolicy, RetryPolicy, get_pool, heartbeat
+)
+
+
+def current_pid():
+    return os.getpid()
 
 
 class TestActivityRunner(unittest.TestCase):
@@ -46,5 +58,241 @@ class TestActivityRunner(unittest.TestCase):
         self.assertEqual(result.error, "error")
 
 
+class TestExecutionPolicies(unittest.TestCase):
+    def setUp(self):
+        self.runner = ActivityRunner()
+
+    def test_inline_coroutine(self):
+        async def fetch():
+            await asyncio.sleep(0)
+            return "fetched"
+
+        self.runner.register_activity("fetch", fetch, ExecutionPolicy(mode="inline"))
+        result = asyncio.run(self.runner.run_activity_async("fetch"))
+        self.assertTrue(result.success)
+        self.assertEqual(result.output, "fetched")
+
+    def test_named_thread_pool(self):
+        self.runner.register_activity(
+            "whoami", lambda: threading.current_thread().name,
+            ExecutionPolicy(pool="test-pool", max_workers=2)
+        )
+        result = asyncio.run(self.runner.run_activity_async("whoami"))
+        self.assertTrue(result.output.startswith("activity-test-pool"))
+        self.assertIs(get_pool("thread", "test-pool"), get_pool("thread", "test-pool", 8))
+
+    def test_process_pool(self):
+        self.runner.register_activity("pid", current_pid, ExecutionPolicy(mode="process", pool="test-cpu"))
+        result = asyncio.run(self.runner.run_activity_async("pid"))
+        self.assertTrue(result.success)
+        self.assertNotEqual(result.output, str(os.getpid()))
+
+    def test_max_concurrency(self):
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def tracked():
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            threading.Event().wait(0.01)
+            with lock:
+                active.pop()
+
+        self.runner.register_activity(
+            "tracked", tracked, ExecutionPolicy(pool="test-limit", max_workers=8, max_concurrency=2)
+        )
+
+        async def run_many():
+            await asyncio.gather(*(self.runner.run_activity_async("tracked") for _ in range(8)))
+
+        asyncio.run(run_many())
+        self.assertLessEqual(max(peak), 2)
+
+    def test_failure_is_captured(self):
+        def broken():
+            raise RuntimeError("boom")
+
+        self.runner.register_activity("broken", broken, ExecutionPolicy(mode="inline"))
+        result = asyncio.run(self.runner.run_activity_async("broken"))
+        self.assertFalse(result.success)
+        self.assertEqual(result.error, "boom")
+        self.assertEqual(result.error_type, "RuntimeError")
+
+
+class TestDeadlines(unittest.TestCase):
+    def setUp(self):
+        self.runner = ActivityRunner()
+
+    def test_retry_backoff(self):
+        retry = RetryPolicy(max_attempts=5, initial_interval=1.0, backoff_coefficient=2.0,
+                            max_interval=5.0, jitter=0.0, non_retryable_errors=("ValueError",))
+        self.assertEqual([retry.delay(n) for n in (1, 2, 3, 4)], [1.0, 2.0, 4.0, 5.0])
+        self.assertTrue(retry.should_retry(4, "RuntimeError"))
+        self.assertFalse(retry.should_retry(5, "RuntimeError"))
+        self.assertFalse(retry.should_retry(1, "ValueError"))
+        self.assertFalse(retry.should_retry(1, "NonRetryableError"))
+
+        jittered = RetryPolicy(initial_interval=10.0, jitter=0.2)
+        rng = random.Random(7)
+        for _ in range(50):
+            self.assertTrue(8.0 <= jittered.delay(1, rng) <= 12.0)
+
+    def test_start_to_close_releases_the_slot(self):
+        stop = threading.Event()
+
+        def stuck():
+            while True:
+                heartbeat()
+                stop.wait(0.01)
+
+        self.runner.register_activity("stuck", stuck, ExecutionPolicy(
+            pool="test-deadline", max_workers=1, max_concurrency=1, start_to_close_timeout=0.1
+        ))
+        self.runner.register_activity("quick", lambda: "ok", ExecutionPolicy(pool="test-deadline", max_workers=1))
+
+        async def run():
+            timed_out = await self.runner.run_activity_async("stuck")
+            # The stuck attempt stops at its next heartbeat, so the single
+            # worker is free again
+            quick = await asyncio.wait_for(self.runner.run_activity_async("quick"), 1.0)
+            return timed_out, quick
+
+        timed_out, quick = asyncio.run(run())
+        self.assertFalse(timed_out.success)
+        self.assertEqual(timed_out.error_type, "ActivityTimeout")
+        self.assertTrue(quick.success)
+
+    def test_heartbeat_timeout(self):
+        def silent():
+            time.sleep(0.3)
+
+        def chatty():
+            for _ in range(6):
+                heartbeat()
+                time.sleep(0.05)
+            return "done"
+
+        policy = ExecutionPolicy(pool="test-heartbeat", heartbeat_timeout=0.15)
+        self.runner.register_activity("silent", silent, policy)
+        self.runner.register_activity("chatty", chatty, policy)
+        self.assertIn("heartbeat", asyncio.run(self.runner.run_activity_async("silent")).error)
+        self.assertTrue(asyncio.run(self.runner.run_activity_async("chatty")).success)
+
+    def test_inline_timeout_override(self):
+        async def slow():
+            await asyncio.sleep(5)
+
+        self.runner.register_activity("slow", slow, ExecutionPolicy(mode="inline"))
+        started = time.perf_counter()
+        result = asyncio.run(self.runner.run_activity_async("slow", timeout_seconds=0.05))
+        self.assertLess(time.perf_counter() - started, 1.0)
+        self.assertEqual(result.error_type, "ActivityTimeout")
+
+    def test_sync_timeout(self):
+        self.runner.register_activity("slow", lambda: time.sleep(0.5))
+        result = self.runner.run_activity("slow", timeout_seconds=0.05)
+        self.assertFalse(result.success)
+        self.assertEqual(result.error_type, "ActivityTimeout")
+
+    def test_sync_calls_reuse_pool_threads(self):
+        self.runner.register_activity("whoami", lambda: threading.current_thread().name)
+        names = {self.runner.run_activity("whoami", timeout_seconds=5).output for _ in range(20)}
+        self.assertLessEqual(len(names), ExecutionPolicy().max_workers)
+        self.assertTrue(all(name.startswith("activity-timed") for name in names), names)
+
+    def test_hung_sync_calls_do_not_use_up_the_pool(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        policy = ExecutionPolicy(pool="test-hung-sync")
+        # Neither activity heartbeats, so a hung attempt never notices it was
+        # abandoned; the pool has to replace its thread
+        self.runner.register_activity("hang", release.wait, policy)
+        self.runner.register_activity("fast", lambda: "ok", policy)
+        for _ in range(policy.max_workers):
+            self.assertEqual(self.runner.run_activity("hang", timeout_seconds=0.05).error_type, "ActivityTimeout")
+        for _ in range(policy.max_workers + 1):
+            self.assertTrue(self.runner.run_activity("fast", timeout_seconds=1).success)
+
+    def test_hung_async_calls_do_not_use_up_the_pool(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.runner.register_activity("hang", release.wait, ExecutionPolicy(
+            pool="test-hung-async", max_workers=2, start_to_close_timeout=0.05
+        ))
+        self.runner.register_activity("fast", lambda: "ok", ExecutionPolicy(pool="test-hung-async", max_workers=2))
+
+        async def run():
+            hung = await asyncio.gather(*(self.runner.run_activity_async("hang") for _ in range(2)))
+            fast = await asyncio.wait_for(
+                asyncio.gather(*(self.runner.run_activity_async("fast") for _ in range(3))), 1.0
+            )
+            return hung, fast
+
+        hung, fast = asyncio.run(run())
+        self.assertEqual([result.error_type for result in hung], ["ActivityTimeout"] * 2)
+        self.assertTrue(all(result.success for result in fast))
+
+    def test_deadline_starts_when_the_attempt_starts(self):
+        # The second call waits for the pool's only thread for longer than
+        # its own timeout, but runs well within it
+        self.runner.register_activity("slow", lambda: time.sleep(0.3), ExecutionPolicy(
+            pool="test-queued", max_workers=1
+        ))
+        self.runner.register_activity("quick", lambda: time.sleep(0.01), ExecutionPolicy(
+            pool="test-queued", max_workers=1, heartbeat_timeout=0.2, start_to_close_timeout=0.2
+        ))
+
+        async def run():
+            return await asyncio.gather(self.runner.run_activity_async("slow"),
+                                        self.runner.run_activity_async("quick"))
+
+        slow, quick = asyncio.run(run())
+        self.assertTrue(slow.success)
+        self.assertTrue(quick.success, quick.error)
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.runner = ActivityRunner(result_cache=ResultCache(max_entries=2, ttl=60))
+
+    def _register(self, name, pure=True, fail=False):
+        def activity():
+            self.calls.append(name)
+            if fail:
+                raise RuntimeError("boom")
+            return f"{name} rate"
+        self.runner.register_activity(name, activity, ExecutionPolicy(mode="inline", pure=pure))
+
+    def test_pure_results_are_reused(self):
+        self._register("fx_rate")
+        self._register("charge_card", pure=False)
+        for _ in range(3):
+            self.assertEqual(asyncio.run(self.runner.run_activity_async("fx_rate")).output, "fx_rate rate")
+            self.runner.run_activity("charge_card")
+        self.assertEqual(self.calls, ["fx_rate", "charge_card", "charge_card", "charge_card"])
+        self.assertEqual(self.runner.result_cache.hits, 2)
+
+    def test_failures_are_not_cached(self):
+        self._register("flaky", fail=True)
+        for _ in range(2):
+            self.assertFalse(self.runner.run_activity("flaky").success)
+        self.assertEqual(self.calls, ["flaky", "flaky"])
+
+    def test_lru_and_ttl(self):
+        cache = ResultCache(max_entries=2, ttl=60)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertEqual(list(cache.entries), ["a", "c"])
+
+        with patch("localflow.activities.cache.time.monotonic", return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 1)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,230 @@
+import unittest
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from unittest.mock import patch
+from localflow.core.workflow import WorkflowEngine, WorkflowStatus
+from localflow.dsl.parser import WorkflowStep
+from localflow.engine.executor import WorkflowExecutor
+from localflow.engine.worker import WorkflowWorker
+from localflow.activities.runner import ActivityRunner
+from localflow.state.archive import ARCHIVE_LOCK, pack_workflow, scan_archive, unpack_events, unpack_header
+from localflow.state.persistence import (FANOUT_MARKER, StatePersistence, _try_lock, history_path,
+                                         read_history, workflow_path)
+from localflow.state.query import EventQuery, aggregate_events
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.persistence = StatePersistence(self.temp_dir)
+        self.engine = WorkflowEngine(self.persistence)
+
+    def tearDown(self):
+        self.persistence.close()
+        shutil.rmtree(self.temp_dir)
+
+    def _finished(self, count: int, status: WorkflowStatus = WorkflowStatus.COMPLETED):
+        ids = []
+        for _ in range(count):
+            workflow = self.engine.create_workflow("PurchaseFlow")
+            self.engine.record_events(workflow.id, [
+                ("ActivityCompleted", {"activity": "charge_card", "result": "ok"}),
+                ("ActivityCompleted", {"activity": "send_email", "result": "sent"})
+            ])
+            self.engine.update_status(workflow.id, status)
+            self.engine.evict(workflow.id, snapshot=False)
+            ids.append(workflow.id)
+        return ids
+
+    def test_finished_workflows_move_to_the_archive(self):
+        completed = self._finished(3)
+        failed = self._finished(1, WorkflowStatus.FAILED)
+        running = self.engine.create_workflow("PurchaseFlow")
+        self.engine.update_status(running.id, WorkflowStatus.RUNNING)
+
+        self.assertEqual(self.persistence.archive_finished(older_than=0), 4)
+        for workflow_id in completed + failed:
+            self.assertFalse(os.path.exists(workflow_path(self.temp_dir, workflow_id)))
+            self.assertIsNotNone(self.persistence.catalog.get(workflow_id).archive_position)
+        self.assertTrue(os.path.exists(workflow_path(self.temp_dir, running.id)))
+        self.assertEqual(self.persistence.list_workflow_ids(), [running.id])
+        # Already archived workflows are not archived again
+        self.assertEqual(self.persistence.archive_finished(older_than=0), 0)
+
+        loaded = self.persistence.load_workflow(failed[0])
+        self.assertEqual(loaded.status, WorkflowStatus.FAILED)
+        self.assertEqual([e.id for e in loaded.events], [1, 2])
+        self.assertEqual(loaded.events[1].data, {"activity": "send_email", "result": "sent"})
+        history = list(self.persistence.iter_history(completed[0], since_seq=2))
+        self.assertEqual([e.type for e in history], ["ActivityCompleted"])
+        self.assertEqual(self.engine.resume_workflow(completed[1]).status, WorkflowStatus.COMPLETED)
+
+    def test_read_only_history(self):
+        archived, live = self._finished(2)
+        self.assertEqual(self.persistence.archive_finished(older_than=0, limit=1), 1)
+        self.persistence.sync()
+        for workflow_id in (archived, live):
+            self.assertEqual(
+                [(e.id, e.data) for e in read_history(self.temp_dir, workflow_id, self.persistence.catalog,
+                                                      since_seq=2, follow=True)],
+                [(e.id, e.data) for e in self.persistence.iter_history(workflow_id, since_seq=2)]
+            )
+        with self.assertRaises(FileNotFoundError):
+            list(read_history(self.temp_dir, "missing", self.persistence.catalog))
+
+    def test_retention_period(self):
+        ids = self._finished(2)
+        self.assertEqual(self.persistence.archive_finished(older_than=3600), 0)
+        self.assertEqual(self.persistence.archive_finished(older_than=3600, now=time.time() + 7200, limit=1), 1)
+        self.assertEqual(len(self.persistence.list_workflow_ids()), 1)
+        self.assertIsNotNone(self.persistence.catalog.get(ids[0]).archive_position)
+
+    def test_one_archiver_at_a_time(self):
+        self._finished(1)
+        lock = _try_lock(os.path.join(self.temp_dir, ARCHIVE_LOCK))
+        try:
+            self.assertEqual(self.persistence.archive_finished(older_than=0), 0)
+        finally:
+            lock.close()
+        self.assertEqual(self.persistence.archive_finished(older_than=0), 1)
+
+    def test_writing_to_an_archived_workflow_restores_it(self):
+        workflow_id = self._finished(1)[0]
+        self.persistence.archive_finished(older_than=0)
+        self.engine.resume_workflow(workflow_id)
+        event = self.engine.record_event(workflow_id, "SignalReceived", {"signal": "refund"})
+        self.assertEqual(event.id, 3)
+        self.assertTrue(os.path.isdir(history_path(self.temp_dir, workflow_id)))
+        entry = self.persistence.catalog.get(workflow_id)
+        self.assertIsNone(entry.archive_position)
+        self.persistence.sync()
+        self.assertEqual(self.persistence.catalog.get(workflow_id).event_count, 3)
+        self.assertEqual([e.id for e in self.persistence.load_workflow(workflow_id).events], [1, 2, 3])
+
+    def test_events_appended_while_archiving_are_kept(self):
+        workflow_id = self._finished(1)[0]
+
+        def pack_and_append(*args):
+            # Lands between the history read and the archive's catalog update
+            self.engine.resume_workflow(workflow_id)
+            self.engine.record_event(workflow_id, "SignalReceived", {"signal": "refund"})
+            return pack_workflow(*args)
+
+        with patch("localflow.state.persistence.pack_workflow", side_effect=pack_and_append):
+            self.assertEqual(self.persistence.archive_finished(older_than=0), 0)
+        self.assertIsNone(self.persistence.catalog.get(workflow_id).archive_position)
+        self.assertTrue(os.path.isdir(history_path(self.temp_dir, workflow_id)))
+        self.assertEqual([e.id for e in self.persistence.load_workflow(workflow_id).events], [1, 2, 3])
+
+    def test_rebuild_catalog_from_archive(self):
+        archived = self._finished(2)
+        self.persistence.archive_finished(older_than=0)
+        live = self._finished(1)[0]
+        self.persistence.close()
+        os.remove(os.path.join(self.temp_dir, "catalog.db"))
+
+        self.persistence = StatePersistence(self.temp_dir)
+        for workflow_id in archived:
+            entry = self.persistence.catalog.get(workflow_id)
+            self.assertEqual((entry.status, entry.event_count), ("completed", 2))
+            self.assertIsNotNone(entry.archive_position)
+        self.assertIsNone(self.persistence.catalog.get(live).archive_position)
+        self.assertEqual(len(self.persistence.load_workflow(archived[1]).events), 2)
+
+    def test_queries_read_archived_histories(self):
+        self._finished(3)
+        self._finished(1, WorkflowStatus.FAILED)
+        self.persistence.sync()
+        before = aggregate_events(self.temp_dir, EventQuery(), "workflows").rows()
+        self.persistence.archive_finished(older_than=0, limit=2)
+        self.assertEqual(aggregate_events(self.temp_dir, EventQuery(), "workflows").rows(), before)
+
+    def test_flat_layout_is_migrated(self):
+        ids = self._finished(2)
+        self.persistence.close()
+        # The layout before the fan-out: workflows/<id>
+        workflows = os.path.join(self.temp_dir, "workflows")
+        for workflow_id in ids:
+            os.rename(workflow_path(self.temp_dir, workflow_id), os.path.join(workflows, workflow_id))
+        os.remove(os.path.join(workflows, FANOUT_MARKER))
+
+        self.persistence = StatePersistence(self.temp_dir)
+        self.assertEqual(self.persistence.list_workflow_ids(), sorted(ids))
+        self.assertEqual(len(self.persistence.load_workflow(ids[0]).events), 2)
+        self.assertFalse(os.path.exists(os.path.join(workflows, ids[0])))
+
+
+class TestArchiveFormat(unittest.TestCase):
+    def test_round_trip(self):
+        payloads = [b"first", b"", b"third" * 100]
+        for compression in ("gzip", "lzma"):
+            record = pack_workflow({"id": "wf-1", "events": 3}, payloads, compression)
+            self.assertEqual(unpack_header(record), {"id": "wf-1", "events": 3, "compression": compression})
+            self.assertEqual([p for _, p in unpack_events(record)], payloads)
+        with self.assertRaises(ValueError):
+            pack_workflow({"id": "wf-1"}, payloads, "zip")
+
+    def test_scan_empty_store(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            self.assertEqual(list(scan_archive(temp_dir)), [])
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+class TestBackgroundRetention(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.persistence = StatePersistence(self.temp_dir)
+        runner = ActivityRunner()
+        runner.register_activity("send_email", lambda: "sent")
+        self.executor = WorkflowExecutor(WorkflowEngine(self.persistence), runner)
+        self.executor.register_definition("EmailFlow", [WorkflowStep(type="step", name="send_email")])
+
+    def tearDown(self):
+        self.persistence.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_following_worker_archives_finished_workflows(self):
+        ids = [self.executor.workflow_engine.create_workflow("EmailFlow").id for _ in range(3)]
+        worker = WorkflowWorker(self.executor, follow=True, poll_interval=0.01, retention=0,
+                                retention_interval=0.01)
+
+        async def run_until_archived():
+            task = asyncio.ensure_future(worker.run())
+            deadline = time.monotonic() + 5
+            while worker.report.archived < len(ids) and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        asyncio.run(run_until_archived())
+        self.assertEqual(worker.report.archived, 3)
+        for workflow_id in ids:
+            self.assertEqual(self.persistence.load_workflow(workflow_id).status, WorkflowStatus.COMPLETED)
+            self.assertIsNotNone(self.persistence.catalog.get(workflow_id).archive_position)
+
+    def test_archive_failures_are_reported(self):
+        worker = WorkflowWorker(self.executor, follow=True, poll_interval=0.01, retention=0,
+                                retention_interval=0.01)
+
+        async def run_until_failed():
+            task = asyncio.ensure_future(worker.run())
+            deadline = time.monotonic() + 5
+            while worker.report.archive_failures < 2 and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        with patch.object(self.persistence, "archive_finished", side_effect=OSError("disk full")):
+            asyncio.run(run_until_failed())
+        self.assertGreaterEqual(worker.report.archive_failures, 2)
+        self.assertEqual(worker.report.errors[0], "Archiving failed: disk full")
+        self.assertIn("archiving passes failed", worker.report.summary())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+import unittest
+from localflow.benchmarks.bench_engine import run_benchmark, workflow_source
+from localflow.dsl.parser import PlanCache, WorkflowParser
+
+
+class TestEngineBenchmark(unittest.TestCase):
+    def test_workflow_shape(self):
+        name, steps = WorkflowParser(PlanCache()).parse(workflow_source(steps=4, waits=1, fanout=3))
+        self.assertEqual(name, "BenchFlow")
+        self.assertEqual([s.type for s in steps], ["step", "step", "wait", "step", "step", "parallel"])
+        self.assertEqual(len(steps[-1].branches), 3)
+
+    def test_small_run(self):
+        run = run_benchmark(workflows=5, steps=2, waits=1, fanout=2, payload_bytes=16, durable=False)
+        results = run["results"]
+        self.assertEqual(results["completed"], 5)
+        self.assertEqual(results["timers_fired"], 5)
+        # Per workflow: two steps, timer start and fire, two branches, join
+        self.assertEqual(results["events"], 35)
+        self.assertGreater(results["bytes_per_event"], 0)
+        self.assertGreater(results["peak_rss_bytes"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import tempfile
+import os
+import shutil
+from localflow.core.workflow import WorkflowEngine, WorkflowStatus
+from localflow.state.persistence import StatePersistence
+
+
+class TestWorkflowCatalog(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.persistence = StatePersistence(self.temp_dir)
+        self.engine = WorkflowEngine(self.persistence)
+
+    def tearDown(self):
+        self.persistence.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_create_and_update_status(self):
+        workflow = self.engine.create_workflow("PurchaseFlow")
+        entry = self.persistence.catalog.get(workflow.id)
+        self.assertEqual(entry.name, "PurchaseFlow")
+        self.assertEqual(entry.status, "pending")
+
+        self.engine.update_status(workflow.id, WorkflowStatus.COMPLETED)
+        self.assertEqual(self.persistence.catalog.get(workflow.id).status, "completed")
+
+    def test_event_count_tracked_on_sync(self):
+        workflow = self.engine.create_workflow("PurchaseFlow")
+        for i in range(3):
+            self.engine.record_event(workflow.id, "TestEvent", {"n": i})
+        self.engine.update_status(workflow.id, WorkflowStatus.RUNNING)
+        self.persistence.sync()
+
+        entry = self.persistence.catalog.get(workflow.id)
+        self.assertEqual(entry.event_count, 3)
+        self.assertGreater(entry.log_offset, 0)
+
+    def test_filter_and_paginate(self):
+        for i in range(5):
+            self.engine.create_workflow("PurchaseFlow")
+        refund = self.engine.create_workflow("RefundFlow")
+        self.engine.update_status(refund.id, WorkflowStatus.FAILED)
+
+        catalog = self.persistence.catalog
+        self.assertEqual(catalog.count(), 6)
+        self.assertEqual(catalog.count(name="PurchaseFlow"), 5)
+        self.assertEqual([e.id for e in catalog.list(status="failed")], [refund.id])
+
+        first_page = catalog.list(limit=4)
+        second_page = catalog.list(limit=4, offset=4)
+        self.assertEqual(len(first_page), 4)
+        self.assertEqual(len(second_page), 2)
+        self.assertFalse({e.id for e in first_page} & {e.id for e in second_page})
+
+    def test_rebuild_when_catalog_missing(self):
+        workflow = self.engine.create_workflow("PurchaseFlow")
+        self.engine.record_event(workflow.id, "TestEvent", {})
+        self.persistence.close()
+        os.remove(os.path.join(self.temp_dir, "catalog.db"))
+
+        self.persistence = StatePersistence(self.temp_dir)
+        entry = self.persistence.catalog.get(workflow.id)
+        self.assertEqual(entry.name, "PurchaseFlow")
+        self.assertEqual(entry.event_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
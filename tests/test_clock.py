@@ -0,0 +1,101 @@
+import unittest
+import asyncio
+import tempfile
+import shutil
+import time
+from localflow.core.clock import VirtualClock
+from localflow.core.workflow import WorkflowEngine, WorkflowStatus
+from localflow.dsl.parser import WorkflowStep
+from localflow.engine.executor import WorkflowExecutor
+from localflow.engine.worker import WorkflowWorker
+from localflow.activities.runner import ActivityRunner
+from localflow.state.persistence import StatePersistence
+from localflow.timers.scheduler import TimerScheduler
+
+
+STEPS = [
+    WorkflowStep(type="step", name="charge_card"),
+    WorkflowStep(type="wait", name="", duration=7200),
+    WorkflowStep(type="step", name="send_email"),
+]
+
+
+class TestVirtualClock(unittest.TestCase):
+    def test_sleepers_wake_in_order(self):
+        clock = VirtualClock(start=100.0)
+        woke = []
+
+        async def sleeper(name, seconds):
+            await clock.sleep(seconds)
+            woke.append((name, clock.time()))
+
+        async def main():
+            await asyncio.gather(sleeper("late", 30), sleeper("early", 10), sleeper("middle", 20))
+
+        started = time.perf_counter()
+        asyncio.run(main())
+        self.assertLess(time.perf_counter() - started, 1.0)
+        self.assertEqual(woke, [("early", 110.0), ("middle", 120.0), ("late", 130.0)])
+
+    def test_manual_advance(self):
+        clock = VirtualClock(auto_advance=False)
+
+        async def main():
+            task = asyncio.ensure_future(clock.sleep(5))
+            await asyncio.sleep(0)
+            clock.advance(4)
+            await asyncio.sleep(0)
+            self.assertFalse(task.done())
+            clock.advance(1)
+            await task
+            return clock.time()
+
+        self.assertEqual(asyncio.run(main()), 5)
+
+
+class TestVirtualTimeExecution(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.clock = VirtualClock(start=1_000_000.0)
+        self.persistence = StatePersistence(self.temp_dir)
+        self.engine = WorkflowEngine(self.persistence, clock=self.clock)
+        self.runner = ActivityRunner()
+        for name in ("charge_card", "send_email"):
+            self.runner.register_activity(name, lambda name=name: f"{name} done")
+
+    def tearDown(self):
+        self.persistence.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_in_process_wait_is_skipped(self):
+        executor = WorkflowExecutor(self.engine, self.runner)
+        workflow = self.engine.create_workflow("PurchaseFlow")
+        started = time.perf_counter()
+        asyncio.run(executor.execute_workflow(workflow.id, STEPS))
+
+        self.assertLess(time.perf_counter() - started, 1.0)
+        self.assertEqual(workflow.status, WorkflowStatus.COMPLETED)
+        self.assertEqual(workflow.events[-1].timestamp - workflow.events[0].timestamp, 7200)
+
+    def test_worker_skips_to_durable_timers(self):
+        executor = WorkflowExecutor(self.engine, self.runner, TimerScheduler(self.engine))
+        executor.register_definition("PurchaseFlow", STEPS)
+        workflow = self.engine.create_workflow("PurchaseFlow")
+        report = asyncio.run(WorkflowWorker(executor).run())
+
+        self.assertEqual(report.timers_fired, 1)
+        self.assertEqual(self.persistence.catalog.get(workflow.id).status, "completed")
+        self.assertEqual(self.clock.time(), 1_007_200.0)
+        history = self.persistence.load_workflow(workflow.id).events
+        self.assertEqual([e.timestamp for e in history],
+                         [1_000_000.0, 1_000_000.0, 1_007_200.0, 1_007_200.0])
+
+    def test_skip_needs_virtual_clock(self):
+        engine = WorkflowEngine()
+        executor = WorkflowExecutor(engine, self.runner, TimerScheduler(engine))
+        with self.assertRaises(ValueError):
+            asyncio.run(executor.skip_to_next_timer())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+import json
+import tempfile
+import shutil
+from localflow.core.workflow import WorkflowEngine, WorkflowEvent
+from localflow.state.codec import (
+    BinaryCodec, JsonCodec, LazyWorkflowEvent, MarshalCodec, decode_event, decode_header, event_to_dict
+)
+from localflow.state.persistence import StatePersistence
+
+
+EVENT = WorkflowEvent(
+    id=7,
+    timestamp=1700000000.25,
+    type="ActivityCompleted",
+    data={"activity": "charge_card", "result": {"amount": 12.5, "items": [1, 2, None]}, "ok": True}
+)
+
+
+class TestCodecs(unittest.TestCase):
+    def test_round_trip(self):
+        for codec in (JsonCodec(), MarshalCodec(), BinaryCodec()):
+            payload = codec.encode(EVENT)
+            self.assertEqual(payload[0], codec.tag)
+            self.assertEqual(decode_event(payload), EVENT)
+            self.assertEqual(decode_header(payload), (7, 1700000000.25, "ActivityCompleted"))
+
+    def test_custom_event_type(self):
+        event = WorkflowEvent(id=1, timestamp=1.0, type="OrderShipped", data={})
+        payload = BinaryCodec().encode(event)
+        self.assertEqual(decode_event(payload), event)
+        self.assertEqual(decode_header(payload)[2], "OrderShipped")
+
+    def test_binary_is_smaller_than_json(self):
+        self.assertLess(len(BinaryCodec().encode(EVENT)), len(JsonCodec().encode(EVENT)))
+
+    def test_data_is_decoded_lazily(self):
+        event = decode_event(BinaryCodec().encode(EVENT))
+        self.assertIsInstance(event, LazyWorkflowEvent)
+        self.assertEqual(event.type, "ActivityCompleted")
+        self.assertIsNotNone(event._payload)
+        self.assertEqual(event.data["result"]["amount"], 12.5)
+        self.assertIsNone(event._payload)
+        self.assertEqual(event_to_dict(event), event_to_dict(EVENT))
+
+    def test_binary_data_is_json(self):
+        # Unlike marshal, the data reads the same on every Python version
+        codec = BinaryCodec()
+        payload = codec.encode(EVENT)
+        self.assertEqual(json.loads(payload[codec._header(payload)[3]:]), EVENT.data)
+
+    def test_unreadable_marshal_data(self):
+        payload = MarshalCodec().encode(EVENT)
+        event = decode_event(payload[:-3])
+        with self.assertRaisesRegex(ValueError, "marshal"):
+            event.data
+
+    def test_unknown_encoding(self):
+        with self.assertRaises(ValueError):
+            decode_event(b"\xff\x00")
+
+
+class TestMixedCodecLogs(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_json_log_continues_in_binary(self):
+        self._continue_in_binary(JsonCodec())
+
+    def test_marshal_log_continues_in_binary(self):
+        self._continue_in_binary(MarshalCodec())
+
+    def _continue_in_binary(self, codec):
+        persistence = StatePersistence(self.temp_dir, codec=codec)
+        engine = WorkflowEngine(persistence)
+        workflow = engine.create_workflow("PurchaseFlow")
+        engine.record_event(workflow.id, "ActivityCompleted", {"activity": "a", "result": 1})
+        persistence.close()
+
+        persistence = StatePersistence(self.temp_dir)
+        engine = WorkflowEngine(persistence)
+        engine.resume_workflow(workflow.id)
+        engine.record_event(workflow.id, "ActivityCompleted", {"activity": "b", "result": 2})
+        persistence.save_workflow(engine.get_workflow(workflow.id))
+        loaded = persistence.load_workflow(workflow.id)
+        persistence.close()
+
+        self.assertEqual([e.id for e in loaded.events], [1, 2])
+        loaded.replay()
+        self.assertEqual(loaded.state["results"], {"a": 1, "b": 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import tempfile
+import os
+import shutil
+from localflow.state.eventlog import SegmentedLog, CorruptRecordError, next_position, read_records
+
+
+class TestSegmentedLog(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.log_dir = os.path.join(self.temp_dir, "log")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_append_and_iterate(self):
+        log = SegmentedLog(self.log_dir)
+        log.append(b"first")
+        log.append(b"second")
+        payloads = [payload for _, payload in log.iter_records()]
+        self.assertEqual(payloads, [b"first", b"second"])
+
+    def test_rolls_segments(self):
+        log = SegmentedLog(self.log_dir, max_segment_bytes=32)
+        for i in range(10):
+            log.append(f"record-{i}".encode())
+        log.close()
+        self.assertGreater(len(log.segments), 1)
+
+        reopened = SegmentedLog(self.log_dir, max_segment_bytes=32)
+        payloads = [payload for _, payload in reopened.iter_records()]
+        self.assertEqual(len(payloads), 10)
+        self.assertEqual(payloads[-1], b"record-9")
+
+    def test_recovery_truncates_torn_tail(self):
+        log = SegmentedLog(self.log_dir)
+        log.append(b"complete")
+        log.close()
+        path = os.path.join(self.log_dir, "00000000.seg")
+        with open(path, 'ab') as f:
+            f.write(b"\x00\x00\x00\x10\x00")
+
+        recovered = SegmentedLog(self.log_dir)
+        self.assertEqual(recovered.last_payload, b"complete")
+        recovered.append(b"next")
+        payloads = [payload for _, payload in recovered.iter_records()]
+        self.assertEqual(payloads, [b"complete", b"next"])
+
+    def test_iterate_from_position(self):
+        log = SegmentedLog(self.log_dir, max_segment_bytes=32)
+        log.append(b"a" * 10)
+        position = log.end_position()
+        log.append(b"b" * 10)
+        log.append(b"c" * 10)
+        payloads = [payload for _, payload in log.iter_records(position)]
+        self.assertEqual(payloads, [b"b" * 10, b"c" * 10])
+
+    def test_read_records_leaves_partial_tail_alone(self):
+        log = SegmentedLog(self.log_dir)
+        log.append(b"complete")
+        log.flush()
+        path = os.path.join(self.log_dir, "00000000.seg")
+        with open(path, 'ab') as f:
+            f.write(b"\x00\x00\x00\x10\x00")
+
+        records = list(read_records(self.log_dir))
+        self.assertEqual([payload for _, payload in records], [b"complete"])
+        # A writer may still be finishing that record, so nothing is repaired
+        self.assertEqual(os.path.getsize(path), 8 + len(b"complete") + 5)
+        position, payload = records[-1]
+        self.assertEqual(list(read_records(self.log_dir, next_position(position, payload))), [])
+
+    def test_read_records_picks_up_new_segments(self):
+        log = SegmentedLog(self.log_dir, max_segment_bytes=32)
+        log.append(b"a" * 10)
+        log.flush()
+        position, payload = list(read_records(self.log_dir))[-1]
+        log.append(b"b" * 10)
+        log.append(b"c" * 10)
+        log.flush()
+        payloads = [p for _, p in read_records(self.log_dir, next_position(position, payload))]
+        self.assertEqual(payloads, [b"b" * 10, b"c" * 10])
+
+    def test_checksum_mismatch_in_sealed_segment(self):
+        log = SegmentedLog(self.log_dir, max_segment_bytes=32)
+        for i in range(4):
+            log.append(f"record-{i}".encode())
+        log.close()
+        path = os.path.join(self.log_dir, "00000000.seg")
+        with open(path, 'r+b') as f:
+            f.seek(9)
+            f.write(b"X")
+
+        reopened = SegmentedLog(self.log_dir, max_segment_bytes=32)
+        with self.assertRaises(CorruptRecordError):
+            list(reopened.iter_records())
+
+
+if __name__ == '__main__':
+    unittest.main()
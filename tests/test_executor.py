@@ -0,0 +1,291 @@
+import unittest
+import asyncio
+import tempfile
+import shutil
+import time
+from unittest.mock import patch
+from localflow.core.workflow import WorkflowEngine, WorkflowStatus
+from localflow.dsl.parser import WorkflowStep
+from localflow.engine.executor import WorkflowExecutor, ActivityExecutionError, TimerFireError
+from localflow.activities.runner import ActivityRunner, ExecutionPolicy, RetryPolicy
+from localflow.state.persistence import StatePersistence
+from localflow.timers.scheduler import TimerScheduler
+
+
+STEPS = [
+    WorkflowStep(type="step", name="charge_card"),
+    WorkflowStep(type="wait", name="", duration=3600),
+    WorkflowStep(type="step", name="send_email"),
+]
+
+
+class TestWorkflowExecutor(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.persistence = StatePersistence(self.temp_dir)
+        self.engine = WorkflowEngine(self.persistence)
+        self.calls = []
+        self.runner = ActivityRunner()
+        for name in ("charge_card", "send_email"):
+            self.runner.register_activity(name, lambda name=name: self.calls.append(name) or f"{name} done")
+
+    def tearDown(self):
+        self.persistence.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_execute_activities(self):
+        executor = WorkflowExecutor(self.engine, self.runner.run_activity)
+        workflow = self.engine.create_workflow("PurchaseFlow")
+        asyncio.run(executor.execute_workflow(workflow.id, [STEPS[0], STEPS[2]]))
+
+        self.assertEqual(workflow.status, WorkflowStatus.COMPLETED)
+        self.assertEqual(self.calls, ["charge_card", "send_email"])
+        self.assertEqual(workflow.events[0].data["result"], "charge_card done")
+        # The runner's measured run time goes into the event
+        self.assertGreaterEqual(workflow.events[0].data["duration"], 0.0)
+
+    def test_failed_activity_fails_workflow(self):
+        def broken():
+            raise RuntimeError("card declined")
+
+        self.runner.register_activity("charge_card", broken)
+        executor = WorkflowExecutor(self.engine, self.runner.run_activity)
+        workflow = self.engine.create_workflow("PurchaseFlow")
+        with self.assertRaises(ActivityExecutionError):
+            asyncio.run(executor.execute_workflow(workflow.id, [STEPS[0]]))
+
+        self.assertEqual(workflow.status, WorkflowStatus.FAILED)
+        self.assertEqual(workflow.events[-1].type, "ActivityFailed")
+
+    def test_wait_evicts_and_resumes_on_timer(self):
+        scheduler = TimerScheduler(self.engine)
+        executor = WorkflowExecutor(self.engine, self.runner.run_activity, scheduler)
+        workflow = self.engine.create_workflow("PurchaseFlow")
+        asyncio.run(executor.execute_workflow(workflow.id, STEPS))
+
+        # The sleeping workflow holds no memory in the engine
+        self.assertIsNone(self.engine.get_workflow(workflow.id))
+        self.assertEqual(len(scheduler), 1)
+        self.assertEqual(self.calls, ["charge_card"])
+
+        timers = scheduler.get_ready_timers(now=time.time() + 7200)
+        self.assertEqual(len(timers), 1)
+        asyncio.run(executor.fire_timer(timers[0]))
+
+        resumed = self.engine.get_workflow(workflow.id)
+        self.assertEqual(resumed.status, WorkflowStatus.COMPLETED)
+        self.assertEqual(self.calls, ["charge_card", "send_email"])
+        self.assertEqual(len(scheduler), 0)
+
+        # A duplicate delivery after a restart is only acknowledged
+        asyncio.run(executor.fire_timer(timers[0]))
+        self.assertEqual(self.calls, ["charge_card", "send_email"])
+
+    def test_wait_survives_restart(self):
+        scheduler = TimerScheduler(self.engine)
+        executor = WorkflowExecutor(self.engine, self.runner.run_activity, scheduler)
+        workflow = self.engine.create_workflow("PurchaseFlow")
+        asyncio.run(executor.execute_workflow(workflow.id, STEPS))
+        self.persistence.close()
+
+        self.persistence = StatePersistence(self.temp_dir)
+        engine = WorkflowEngine(self.persistence)
+        scheduler = TimerScheduler(engine)
+        executor = WorkflowExecutor(engine, self.runner.run_activity, scheduler)
+        executor.register_definition("PurchaseFlow", STEPS)
+        for timer in scheduler.get_ready_timers(now=time.time() + 7200):
+            asyncio.run(executor.fire_timer(timer))
+
+        self.assertEqual(engine.get_workflow(workflow.id).status, WorkflowStatus.COMPLETED)
+        self.assertEqual(self.calls, ["charge_card", "send_email"])
+
+    def test_failed_timer_stays_due(self):
+        scheduler = TimerScheduler(self.engine)
+        executor = WorkflowExecutor(self.engine, self.runner.run_activity, scheduler)
+        workflow = self.engine.create_workflow("PurchaseFlow")
+        asyncio.run(executor.execute_workflow(workflow.id, STEPS))
+        # A fresh executor that has not been given the definition
+        executor = WorkflowExecutor(self.engine, self.runner.run_activity, scheduler)
+
+        now = time.time() + 7200
+        with patch('time.time', return_value=now):
+            fired, failures = asyncio.run(executor.fire_ready_timers())
+            self.assertEqual(fired, 0)
+            self.assertEqual([type(f) for f in failures], [TimerFireError])
+            self.assertIn("No definition", str(failures[0]))
+            self.assertEqual(len(scheduler), 1)
+            self.assertEqual(scheduler.get_ready_timers(), [])
+
+        executor.register_definition("PurchaseFlow", STEPS)
+        with patch('time.time', return_value=now + executor.timer_retry_delay):
+            self.assertEqual(asyncio.run(executor.fire_ready_timers()), (1, []))
+        self.assertEqual(self.engine.get_workflow(workflow.id).status, WorkflowStatus.COMPLETED)
+        self.assertEqual(len(scheduler), 0)
+
+
+class TestRetries(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.persistence = StatePersistence(self.temp_dir)
+        self.engine = WorkflowEngine(self.persistence)
+        self.runner = ActivityRunner()
+        self.attempts = 0
+
+    def tearDown(self):
+        self.persistence.close()
+        shutil.rmtree(self.temp_dir)
+
+    def _register_flaky(self, failures, retry, error=RuntimeError):
+        def flaky():
+            self.attempts += 1
+            if self.attempts <= failures:
+                raise error(f"attempt {self.attempts} failed")
+            return "charged"
+        self.runner.register_activity("charge_card", flaky, ExecutionPolicy(mode="inline", retry=retry))
+
+    def test_retries_in_process(self):
+        self._register_flaky(2, RetryPolicy(max_attempts=3, initial_interval=0.01, jitter=0.0))
+        executor = WorkflowExecutor(self.engine, self.runner)
+        workflow = self.engine.create_workflow("PurchaseFlow")
+        asyncio.run(executor.execute_workflow(workflow.id, [STEPS[0]]))
+
+        self.assertEqual(workflow.status, WorkflowStatus.COMPLETED)
+        self.assertEqual([e.type for e in workflow.events],
+                         ["ActivityFailed", "ActivityFailed", "ActivityCompleted"])
+        self.assertEqual(workflow.events[0].data["error_type"], "RuntimeError")
+        self.assertEqual(workflow.state["attempts"], {})
+
+    def test_non_retryable_error(self):
+        retry = RetryPolicy(max_attempts=3, initial_interval=0.01, non_retryable_errors=("ValueError",))
+        self._register_flaky(2, retry, error=ValueError)
+        executor = WorkflowExecutor(self.engine, self.runner)
+        workflow = self.engine.create_workflow("PurchaseFlow")
+        with self.assertRaises(ActivityExecutionError):
+            asyncio.run(executor.execute_workflow(workflow.id, [STEPS[0]]))
+        self.assertEqual(self.attempts, 1)
+        self.assertEqual(workflow.status, WorkflowStatus.FAILED)
+
+    def test_durable_retry_timer_survives_restart(self):
+        self._register_flaky(1, RetryPolicy(max_attempts=2, initial_interval=60, jitter=0.0))
+        scheduler = TimerScheduler(self.engine)
+        executor = WorkflowExecutor(self.engine, self.runner, scheduler)
+        workflow = self.engine.create_workflow("PurchaseFlow")
+        asyncio.run(executor.execute_workflow(workflow.id, [STEPS[0]]))
+
+        # The backoff is a timer, not a sleeping coroutine
+        self.assertIsNone(self.engine.get_workflow(workflow.id))
+        self.assertEqual(len(scheduler), 1)
+        self.persistence.close()
+
+        self.persistence = StatePersistence(self.temp_dir)
+        engine = WorkflowEngine(self.persistence)
+        scheduler = TimerScheduler(engine)
+        executor = WorkflowExecutor(engine, self.runner, scheduler)
+        executor.register_definition("PurchaseFlow", [STEPS[0]])
+        for timer in scheduler.get_ready_timers(now=time.time() + 120):
+            asyncio.run(executor.fire_timer(timer))
+
+        resumed = engine.get_workflow(workflow.id)
+        self.assertEqual(resumed.status, WorkflowStatus.COMPLETED)
+        self.assertEqual(resumed.state["completed_steps"], 1)
+        history = self.persistence.load_workflow(workflow.id).events
+        self.assertEqual([e.type for e in history],
+                         ["ActivityFailed", "TimerStarted", "TimerFired", "ActivityCompleted"])
+        self.assertTrue(history[2].data["retry"])
+
+
+class TestParallelSteps(unittest.TestCase):
+    def setUp(self):
+        self.engine = WorkflowEngine()
+        self.runner = ActivityRunner()
+        self.executor = WorkflowExecutor(self.engine, self.runner)
+
+    def _register_sleeper(self, name, seconds, fail=False):
+        def activity():
+            time.sleep(seconds)
+            if fail:
+                raise RuntimeError(f"{name} failed")
+            return name
+        self.runner.register_activity(name, activity)
+
+    def _parallel(self, join, *names):
+        return WorkflowStep(type="parallel", name="", join=join,
+                            branches=[WorkflowStep(type="step", name=n) for n in names])
+
+    def test_all_join_runs_branches_concurrently(self):
+        self._register_sleeper("send_email", 0.2)
+        self._register_sleeper("update_crm", 0.2)
+        workflow = self.engine.create_workflow("PurchaseFlow")
+
+        started = time.perf_counter()
+        asyncio.run(self.executor.execute_workflow(workflow.id, [self._parallel("all", "send_email", "update_crm")]))
+        self.assertLess(time.perf_counter() - started, 0.35)
+
+        self.assertEqual(workflow.status, WorkflowStatus.COMPLETED)
+        self.assertEqual(workflow.events[-1].type, "ParallelCompleted")
+        self.assertEqual(workflow.state["completed_steps"], 1)
+        self.assertEqual(workflow.state["results"], {"0.0": "send_email", "0.1": "update_crm"})
+
+    def test_any_join_takes_first_success(self):
+        self._register_sleeper("slow", 0.3)
+        self._register_sleeper("broken", 0.0, fail=True)
+        self._register_sleeper("fast", 0.05)
+        workflow = self.engine.create_workflow("PurchaseFlow")
+
+        asyncio.run(self.executor.execute_workflow(workflow.id, [self._parallel("any", "slow", "broken", "fast")]))
+        self.assertEqual(workflow.status, WorkflowStatus.COMPLETED)
+        self.assertEqual(workflow.events[-1].data["winner"], 2)
+
+    def test_all_join_fails_on_branch_failure(self):
+        self._register_sleeper("ok", 0.0)
+        self._register_sleeper("broken", 0.0, fail=True)
+        workflow = self.engine.create_workflow("PurchaseFlow")
+
+        with self.assertRaises(ActivityExecutionError):
+            asyncio.run(self.executor.execute_workflow(workflow.id, [self._parallel("all", "ok", "broken")]))
+        self.assertEqual(workflow.status, WorkflowStatus.FAILED)
+
+    def test_completed_step_is_not_run_again(self):
+        calls = []
+        self.runner.register_activity("charge_card", lambda: calls.append(1) or "charged")
+        workflow = self.engine.create_workflow("PurchaseFlow")
+        steps = [WorkflowStep(type="step", name="charge_card")]
+        asyncio.run(self.executor.execute_workflow(workflow.id, steps))
+
+        # Running the step directly again returns the recorded result
+        done = asyncio.run(self.executor._execute_with_retries(workflow, "charge_card", {"step": 0}))
+        self.assertTrue(done)
+        self.assertEqual(calls, [1])
+        self.assertEqual(len(workflow.events), 1)
+
+    def test_repeated_activity_keeps_each_result(self):
+        outputs = iter(["first", "second", "third", "fourth"])
+        self.runner.register_activity("send_email", lambda: next(outputs))
+        workflow = self.engine.create_workflow("PurchaseFlow")
+        steps = [WorkflowStep(type="step", name="send_email"),
+                 self._parallel("all", "send_email", "send_email"),
+                 WorkflowStep(type="step", name="send_email")]
+        asyncio.run(self.executor.execute_workflow(workflow.id, steps))
+
+        results = workflow.state["results"]
+        self.assertEqual(set(results), {"0", "1.0", "1.1", "2"})
+        self.assertEqual(results["0"], "first")
+        self.assertEqual(set(results.values()), {"first", "second", "third", "fourth"})
+        self.assertEqual(results["2"], "fourth")
+
+    def test_replay_skips_completed_branches(self):
+        calls = []
+        for name in ("send_email", "update_crm"):
+            self.runner.register_activity(name, lambda name=name: calls.append(name) or name)
+        workflow = self.engine.create_workflow("PurchaseFlow")
+        # A previous run finished one branch before stopping
+        self.engine.record_event(workflow.id, "ActivityCompleted",
+                                 {"step": 0, "branch": 0, "activity": "send_email", "result": "send_email"})
+
+        asyncio.run(self.executor.execute_workflow(workflow.id, [self._parallel("all", "send_email", "update_crm")]))
+        self.assertEqual(calls, ["update_crm"])
+        self.assertEqual(workflow.state["completed_steps"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
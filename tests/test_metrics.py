@@ -0,0 +1,114 @@
+import unittest
+import asyncio
+import os
+import tempfile
+import shutil
+import urllib.request
+from localflow.core import metrics
+from localflow.core.metrics import Registry, parse_text, summarize
+from localflow.core.workflow import WorkflowEngine, EVENTS_RECORDED
+from localflow.engine.executor import WorkflowExecutor, ACTIVITY_RUN_SECONDS
+from localflow.dsl.parser import WorkflowStep
+from localflow.activities.runner import ActivityRunner
+
+
+class TestRegistry(unittest.TestCase):
+    def test_render_and_parse(self):
+        registry = Registry()
+        events = registry.counter("events_total", "Events")
+        latency = registry.histogram("latency_seconds", "Latency", labels=("activity",), buckets=(0.1, 1.0))
+        events.inc(3)
+        for value in (0.05, 0.5, 5.0):
+            latency.labels("charge_card").observe(value)
+
+        samples = parse_text(registry.render())
+        self.assertEqual(samples[("events_total", ())], 3)
+        self.assertEqual(samples[("latency_seconds_bucket", (("activity", "charge_card"), ("le", "0.1")))], 1)
+        self.assertEqual(samples[("latency_seconds_bucket", (("activity", "charge_card"), ("le", "+Inf")))], 3)
+        self.assertEqual(samples[("latency_seconds_count", (("activity", "charge_card"),))], 3)
+
+        summary = summarize(samples)
+        self.assertIn("  events_total: 3", summary)
+        self.assertTrue(any(line.startswith('  latency_seconds{activity="charge_card"}: count 3') for line in summary))
+
+    def test_span_only_times_when_enabled(self):
+        registry = Registry()
+        histogram = registry.histogram("block_seconds", "Block")
+        with registry.span(histogram):
+            pass
+        self.assertEqual(histogram.labels().count, 0)
+        registry.enabled = True
+        with registry.span(histogram):
+            pass
+        self.assertEqual(histogram.labels().count, 1)
+
+    def test_textfile_and_http(self):
+        registry = Registry()
+        registry.enabled = True
+        registry.counter("ticks_total", "Ticks").inc()
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, "metrics.prom")
+            stop = metrics.start_textfile_writer(path, interval=60, registry=registry)
+            stop()
+            with open(path) as f:
+                self.assertIn("ticks_total 1", f.read())
+        finally:
+            shutil.rmtree(temp_dir)
+
+        server = metrics.serve_http(0, registry=registry)
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+            with urllib.request.urlopen(url) as response:
+                self.assertIn("ticks_total 1", response.read().decode("utf-8"))
+        finally:
+            server.shutdown()
+
+    def test_textfiles_reads_one_layout(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, "metrics.prom")
+
+            def write(*paths):
+                for p in paths:
+                    with open(p, "w") as f:
+                        f.write("")
+
+            write(path)
+            self.assertEqual(metrics.textfiles(path), [path])
+            shards = [metrics.shard_textfile(path, i) for i in range(3)]
+            write(*shards)
+            self.assertEqual(metrics.textfiles(path), shards)
+
+            # A two-shard run drops the unsharded file and the third shard
+            metrics.remove_stale_textfiles(path, 2)
+            self.assertEqual(sorted(os.listdir(temp_dir)), ["metrics-0.prom", "metrics-1.prom"])
+            write(path)
+            metrics.remove_stale_textfiles(path)
+            self.assertEqual(metrics.textfiles(path), [path])
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        metrics.enable()
+
+    def tearDown(self):
+        metrics.REGISTRY.enabled = False
+
+    def test_engine_and_executor(self):
+        recorded = EVENTS_RECORDED.labels().value
+        runner = ActivityRunner()
+        runner.register_activity("metered", lambda: "ok")
+        engine = WorkflowEngine()
+        executor = WorkflowExecutor(engine, runner)
+        workflow = engine.create_workflow("PurchaseFlow")
+        asyncio.run(executor.execute_workflow(workflow.id, [WorkflowStep(type="step", name="metered")]))
+
+        self.assertEqual(EVENTS_RECORDED.labels().value, recorded + 1)
+        self.assertEqual(ACTIVITY_RUN_SECONDS.labels("metered").count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
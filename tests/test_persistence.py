@@ -1,8 +1,11 @@
 import unittest
+import asyncio
 import tempfile
 import os
+import threading
+import time
 from localflow.core.workflow import WorkflowEngine, WorkflowStatus, WorkflowEvent
-from localflow.state.persistence import StatePersistence
+from localflow.state.persistence import StatePersistence, history_path
 
 
 class TestStatePersistence(unittest.TestCase):
@@ -46,6 +49,214 @@ class TestStatePersistence(unittest.TestCase):
         self.assertEqual(loaded_events[0].type, "Event1")
         self.assertEqual(loaded_events[1].type, "Event2")
 
+        # Saving again only appends events that are not yet on disk
+        engine.record_event(workflow.id, "Event3", {"key": "value3"})
+        self.persistence.save_event_log(engine.event_log)
+        loaded_events = self.persistence.load_event_log()
+        self.assertEqual([e.type for e in loaded_events], ["Event1", "Event2", "Event3"])
+
+    def test_engine_appends_events(self):
+        engine = WorkflowEngine(self.persistence)
+        workflow = engine.create_workflow("test_workflow")
+        engine.record_event(workflow.id, "Event1", {"key": "value1"})
+        engine.record_event(workflow.id, "Event2", {"key": "value2"})
+        engine.update_status(workflow.id, WorkflowStatus.RUNNING)
+        self.persistence.close()
+
+        reopened = StatePersistence(self.temp_dir)
+        loaded_workflow = reopened.load_workflow(workflow.id)
+        self.assertEqual(loaded_workflow.status, WorkflowStatus.RUNNING)
+        self.assertEqual([e.type for e in loaded_workflow.events], ["Event1", "Event2"])
+        self.assertEqual(reopened.list_workflow_ids(), [workflow.id])
+
+    def test_save_workflow_is_idempotent(self):
+        engine = WorkflowEngine()
+        workflow = engine.create_workflow("test_workflow")
+        engine.record_event(workflow.id, "Event1", {})
+        self.persistence.save_workflow(workflow)
+        self.persistence.save_workflow(workflow)
+
+        loaded_workflow = self.persistence.load_workflow(workflow.id)
+        self.assertEqual(len(loaded_workflow.events), 1)
+
+    def test_resume_from_snapshot(self):
+        persistence = StatePersistence(self.temp_dir, snapshot_every=10)
+        engine = WorkflowEngine(persistence)
+        workflow = engine.create_workflow("test_workflow")
+        for i in range(25):
+            engine.record_event(workflow.id, "ActivityCompleted", {"activity": f"a{i}", "result": i})
+        persistence.close()
+
+        reopened = StatePersistence(self.temp_dir, snapshot_every=10)
+        resumed = reopened.resume_workflow(workflow.id)
+        self.assertEqual(resumed.event_offset, 20)
+        self.assertEqual(len(resumed.events), 5)
+        self.assertEqual(resumed.event_count, 25)
+        self.assertEqual(resumed.last_replay_index, 25)
+        self.assertEqual(resumed.state["completed_steps"], 25)
+        self.assertEqual(resumed.state["results"]["a24"], 24)
+
+        # Full history is still available and replays to the same state
+        loaded = reopened.load_workflow(workflow.id)
+        self.assertEqual(len(loaded.events), 25)
+        loaded.replay()
+        self.assertEqual(loaded.state, resumed.state)
+
+    def test_engine_resumes_evicted_workflow(self):
+        persistence = StatePersistence(self.temp_dir, snapshot_every=2)
+        engine = WorkflowEngine(persistence)
+        workflow = engine.create_workflow("test_workflow")
+        engine.record_event(workflow.id, "TimerFired", {"duration": 1})
+        engine.record_event(workflow.id, "TimerFired", {"duration": 1})
+        engine.record_event(workflow.id, "TimerFired", {"duration": 1})
+
+        fresh_engine = WorkflowEngine(persistence)
+        resumed = fresh_engine.resume_workflow(workflow.id)
+        self.assertEqual(resumed.state["completed_steps"], 3)
+        fresh_engine.record_event(workflow.id, "TimerFired", {"duration": 1})
+        self.assertEqual(resumed.state["completed_steps"], 4)
+        self.assertEqual(resumed.event_count, 4)
+
+    def test_snapshot_trims_history_in_memory(self):
+        persistence = StatePersistence(self.temp_dir, snapshot_every=10)
+        engine = WorkflowEngine(persistence)
+        workflow = engine.create_workflow("test_workflow")
+        for i in range(25):
+            engine.record_event(workflow.id, "ActivityCompleted", {"activity": f"a{i}", "result": i})
+
+        self.assertEqual(len(workflow.events), 5)
+        self.assertEqual(workflow.event_count, 25)
+        self.assertEqual(engine.record_event(workflow.id, "TimerFired", {"duration": 1}).id, 26)
+        persistence.close()
+
+        loaded = StatePersistence(self.temp_dir).load_workflow(workflow.id)
+        self.assertEqual([e.id for e in loaded.events], list(range(1, 27)))
+
+    def test_event_log_is_a_view_over_storage(self):
+        engine = WorkflowEngine(self.persistence)
+        first = engine.create_workflow("test_workflow")
+        second = engine.create_workflow("test_workflow")
+        engine.record_event(first.id, "Event1", {})
+        engine.record_event(second.id, "Event2", {})
+        engine.record_event(first.id, "Event3", {})
+
+        self.assertEqual(len(engine.event_log), 3)
+        self.assertEqual(sorted(e.type for e in engine.event_log), ["Event1", "Event2", "Event3"])
+        self.persistence.save_event_log(engine.event_log)
+        self.persistence.save_event_log(engine.event_log)
+        self.assertEqual(len(self.persistence.load_event_log()), 3)
+
+    def test_finished_workflows_are_evicted(self):
+        engine = WorkflowEngine(self.persistence, max_finished=2)
+        workflows = [engine.create_workflow("test_workflow") for _ in range(4)]
+        for workflow in workflows:
+            engine.update_status(workflow.id, WorkflowStatus.COMPLETED)
+        running = engine.create_workflow("test_workflow")
+        engine.update_status(running.id, WorkflowStatus.RUNNING)
+
+        self.assertEqual(set(engine.instances), {workflows[2].id, workflows[3].id, running.id})
+        resumed = engine.resume_workflow(workflows[0].id)
+        self.assertEqual(resumed.status, WorkflowStatus.COMPLETED)
+        self.assertNotIn(workflows[2].id, engine.instances)
+
+    def test_journal_restores_unsynced_batches(self):
+        engine = WorkflowEngine(self.persistence)
+        workflow = engine.create_workflow("test_workflow")
+        engine.record_events(workflow.id, [("Event1", {}), ("Event2", {})])
+        engine.record_event(workflow.id, "Event3", {})
+        self.persistence.sync()
+
+        # Simulate a crash that lost the unsynced tail of the workflow log
+        segment = os.path.join(history_path(self.temp_dir, workflow.id), "00000000.seg")
+        with open(segment, 'r+b') as f:
+            f.truncate(os.path.getsize(segment) - 5)
+        # A dead process no longer holds its journal lock
+        self.persistence._journal_lock.close()
+
+        reopened = StatePersistence(self.temp_dir)
+        loaded_workflow = reopened.load_workflow(workflow.id)
+        self.assertEqual([e.type for e in loaded_workflow.events], ["Event1", "Event2", "Event3"])
+        self.assertEqual([e.id for e in loaded_workflow.events], [e.id for e in workflow.events])
+        self.assertEqual(reopened.catalog.get(workflow.id).event_count, 3)
+        reopened.close()
+
+    def test_live_journals(self):
+        self.assertEqual(self.persistence.live_journals(), [])
+        # A second handle, e.g. the CLI next to a running worker
+        other = StatePersistence(self.temp_dir)
+        self.assertEqual(other.live_journals(), ["main"])
+        self.assertEqual(self.persistence.live_journals(), [os.path.basename(other.journal_name)])
+        other.close()
+        self.assertEqual(self.persistence.live_journals(), [])
+
+    def test_concurrent_commits_share_one_sync(self):
+        # A wide window keeps the test independent of machine load
+        self.persistence.commit_window = 0.1
+        engine = WorkflowEngine(self.persistence)
+        workflows = [engine.create_workflow("test_workflow") for _ in range(10)]
+        self.persistence.sync()
+        syncs = []
+        original_sync = self.persistence.sync
+
+        def counting_sync():
+            syncs.append(1)
+            original_sync()
+        self.persistence.sync = counting_sync
+
+        async def task(workflow_id):
+            async with engine.transaction(workflow_id) as tx:
+                tx.record("Event1", {})
+                tx.record("Event2", {})
+
+        async def main():
+            await asyncio.gather(*(task(w.id) for w in workflows))
+        asyncio.run(main())
+
+        self.assertEqual(len(syncs), 1)
+        self.assertTrue(all(len(w.events) == 2 for w in workflows))
+
+    def test_iter_history_filters(self):
+        persistence = StatePersistence(self.temp_dir, snapshot_every=4)
+        engine = WorkflowEngine(persistence)
+        workflow = engine.create_workflow("test_workflow")
+        for i in range(10):
+            event_type = "TimerFired" if i % 3 == 0 else "ActivityCompleted"
+            engine.record_event(workflow.id, event_type, {"activity": f"a{i}", "duration": 1})
+
+        self.assertEqual([e.id for e in persistence.iter_history(workflow.id)], list(range(1, 11)))
+        self.assertEqual([e.id for e in persistence.iter_history(workflow.id, since_seq=6)], [6, 7, 8, 9, 10])
+        self.assertEqual([e.id for e in persistence.iter_history(workflow.id, types=["TimerFired"])], [1, 4, 7, 10])
+        self.assertEqual([e.id for e in persistence.iter_history(workflow.id, tail=3)], [8, 9, 10])
+        self.assertEqual(
+            [e.id for e in persistence.iter_history(workflow.id, since_seq=2, types=["TimerFired"], tail=2)],
+            [7, 10]
+        )
+        with self.assertRaises(FileNotFoundError):
+            list(persistence.iter_history("missing"))
+        persistence.close()
+
+    def test_iter_history_follow(self):
+        engine = WorkflowEngine(self.persistence)
+        workflow = engine.create_workflow("test_workflow")
+        engine.record_event(workflow.id, "Event1", {})
+
+        def finish():
+            time.sleep(0.05)
+            engine.record_event(workflow.id, "Event2", {})
+            time.sleep(0.05)
+            engine.record_event(workflow.id, "Event3", {})
+            engine.update_status(workflow.id, WorkflowStatus.COMPLETED)
+
+        writer = threading.Thread(target=finish)
+        writer.start()
+        followed = [e.type for e in self.persistence.iter_history(workflow.id, follow=True, poll_interval=0.01)]
+        writer.join()
+        self.assertEqual(followed, ["Event1", "Event2", "Event3"])
+
+    def test_load_missing_workflow(self):
+        with self.assertRaises(FileNotFoundError):
+            self.persistence.load_workflow("missing")
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
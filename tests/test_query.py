@@ -0,0 +1,148 @@
+import unittest
+import csv
+import json
+import shutil
+import tempfile
+from datetime import datetime
+from localflow.core.clock import VirtualClock
+from localflow.core.workflow import WorkflowEngine, WorkflowStatus
+from localflow.state.persistence import StatePersistence
+from localflow.state.query import (Aggregate, EventQuery, aggregate_events, export_events, format_rows,
+                                   parse_time, plan_chunks)
+
+DAY = 86400.0
+
+
+class TestHistoryQuery(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        persistence = StatePersistence(self.temp_dir)
+        clock = VirtualClock(start=10 * DAY)
+        engine = WorkflowEngine(persistence, clock=clock)
+        # Ten orders a day apart; every third card charge fails after
+        # running 3s, the others run 1s. Each waits 10s in a queue first,
+        # which is not part of its run time.
+        for index in range(10):
+            workflow_id = f"order-{index}"
+            clock.now = (10 + index) * DAY
+            engine.create_workflow("PurchaseFlow", workflow_id)
+            engine.record_event(workflow_id, "WorkflowStarted", {})
+            if index % 3 == 0:
+                clock.now += 13
+                engine.record_event(workflow_id, "ActivityFailed", {
+                    "activity": "charge_card", "error": "declined", "error_type": "CardError", "duration": 3.0
+                })
+                engine.update_status(workflow_id, WorkflowStatus.FAILED)
+                continue
+            clock.now += 11
+            engine.record_event(workflow_id, "ActivityCompleted",
+                                {"activity": "charge_card", "result": "ok", "duration": 1.0})
+            clock.now += 10.5
+            # Events written before run times were recorded have none
+            email = {"activity": "send_email", "result": "sent"}
+            if index != 1:
+                email["duration"] = 0.5
+            engine.record_event(workflow_id, "ActivityCompleted", email)
+            engine.update_status(workflow_id, WorkflowStatus.COMPLETED)
+        engine.create_workflow("RefundFlow", "refund-0")
+        persistence.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_export_failed_charges_in_a_window(self):
+        query = EventQuery(types=["ActivityFailed"], activities=["charge_card"],
+                           since=13 * DAY, until=19 * DAY)
+        rows = [json.loads(line) for line in export_events(self.temp_dir, query)]
+        self.assertEqual([r["workflow_id"] for r in rows], ["order-3", "order-6"])
+        self.assertEqual(rows[0]["data"]["error"], "declined")
+        self.assertEqual(rows[0]["seq"], 2)
+        self.assertEqual(rows[0]["status"], "failed")
+
+    def test_export_csv_and_limit(self):
+        lines = list(export_events(self.temp_dir, EventQuery(names=["PurchaseFlow"]), fmt="csv", limit=4))
+        rows = list(csv.DictReader(lines))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual([r["type"] for r in rows[:2]], ["WorkflowStarted", "ActivityFailed"])
+        self.assertEqual(rows[1]["activity"], "charge_card")
+        self.assertEqual(json.loads(rows[1]["data"])["error_type"], "CardError")
+        self.assertEqual(list(export_events(self.temp_dir, EventQuery(), limit=0)), [])
+
+    def test_activity_failure_rates(self):
+        rows = {r["activity"]: r for r in aggregate_events(self.temp_dir, EventQuery()).rows()}
+        self.assertEqual(set(rows), {"charge_card", "send_email"})
+        charge = rows["charge_card"]
+        self.assertEqual((charge["completed"], charge["failed"]), (6, 4))
+        self.assertEqual(charge["failure_rate"], 0.4)
+        # Recorded run times: 4 x 3s and 6 x 1s
+        self.assertAlmostEqual(charge["mean_s"], 1.8)
+        self.assertEqual(charge["p50_s"], 1.0)
+        self.assertEqual(charge["p95_s"], 5.0)
+        email = rows["send_email"]
+        self.assertEqual((email["completed"], email["mean_s"], email["p50_s"]), (6, 0.5, 0.5))
+
+    def test_workflows_and_types(self):
+        workflows = aggregate_events(self.temp_dir, EventQuery(), "workflows").rows()
+        self.assertEqual([(r["name"], r["status"], r["workflows"], r["events"]) for r in workflows], [
+            ("PurchaseFlow", "completed", 6, 18), ("PurchaseFlow", "failed", 4, 8), ("RefundFlow", "pending", 1, 0)
+        ])
+        types = aggregate_events(self.temp_dir, EventQuery(statuses=["failed", "pending"]), "types").rows()
+        self.assertEqual(types, [{"type": "ActivityFailed", "events": 4}, {"type": "WorkflowStarted", "events": 4}])
+        # Event filters leave out workflows without a matching event
+        failed = aggregate_events(self.temp_dir, EventQuery(types=["ActivityFailed"]), "workflows").rows()
+        self.assertEqual([(r["status"], r["workflows"]) for r in failed], [("failed", 4)])
+
+    def test_durations(self):
+        rows = aggregate_events(self.temp_dir, EventQuery(activities=["charge_card"]), "durations").rows()
+        self.assertEqual([(r["le_s"], r["count"]) for r in rows], [(1.0, 6), (5.0, 4)])
+
+    def test_chunks_and_processes_agree(self):
+        query = EventQuery(names=["PurchaseFlow", "RefundFlow"])
+        chunks = list(plan_chunks(self.temp_dir, query, chunk_events=5))
+        self.assertEqual(sum(len(c) for c in chunks), 11)
+        self.assertGreater(len(chunks), 2)
+        expected = aggregate_events(self.temp_dir, query).rows()
+        self.assertEqual(aggregate_events(self.temp_dir, query, processes=2, chunk_events=5).rows(), expected)
+        self.assertEqual(list(export_events(self.temp_dir, query, processes=2, chunk_events=5)),
+                         list(export_events(self.temp_dir, query)))
+        selected = list(export_events(self.temp_dir, EventQuery(workflow_ids=["order-1", "missing"])))
+        self.assertEqual(len(selected), 3)
+
+    def test_empty_store(self):
+        empty = tempfile.mkdtemp()
+        try:
+            self.assertEqual(list(export_events(empty, EventQuery())), [])
+            self.assertEqual(aggregate_events(empty, EventQuery()).rows(), [])
+        finally:
+            shutil.rmtree(empty)
+
+
+class TestQueryHelpers(unittest.TestCase):
+    def test_parse_time(self):
+        now = datetime(2024, 5, 2, 15, 30).timestamp()
+        self.assertEqual(parse_time("1700000000", now), 1700000000.0)
+        self.assertEqual(parse_time("90m", now), now - 5400)
+        self.assertEqual(parse_time("2d", now), now - 2 * DAY)
+        self.assertEqual(parse_time("today", now), datetime(2024, 5, 2).timestamp())
+        self.assertEqual(parse_time("yesterday", now), datetime(2024, 5, 1).timestamp())
+        self.assertEqual(parse_time("2024-05-01T12:00", now), datetime(2024, 5, 1, 12).timestamp())
+        with self.assertRaises(ValueError):
+            parse_time("last week", now)
+
+    def test_format_rows(self):
+        rows = [{"activity": "charge_card", "failed": 12}, {"activity": "send_email", "failed": 0}]
+        self.assertEqual(list(format_rows(rows)), [
+            "activity     failed",
+            "charge_card      12",
+            "send_email        0",
+        ])
+        self.assertEqual(list(format_rows(rows, "csv")), ["activity,failed", "charge_card,12", "send_email,0"])
+        self.assertEqual(json.loads(list(format_rows(rows, "jsonl"))[1]), rows[1])
+
+    def test_unknown_aggregate(self):
+        with self.assertRaises(ValueError):
+            Aggregate("median")
+
+
+if __name__ == '__main__':
+    unittest.main()
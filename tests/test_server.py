@@ -0,0 +1,167 @@
+import unittest
+import asyncio
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from localflow.core.workflow import WorkflowEngine, WorkflowStatus
+from localflow.dsl.parser import WorkflowStep
+from localflow.engine.client import ClientError, LocalFlowClient
+from localflow.engine.executor import WorkflowExecutor
+from localflow.engine.server import SIGNAL_EVENT, WorkflowServer
+from localflow.engine.worker import WorkflowWorker
+from localflow.activities.runner import ActivityRunner
+from localflow.state.persistence import StatePersistence
+
+
+class ServerThread:
+    # Runs a server on its own event loop, for the blocking client
+    def __init__(self, server: WorkflowServer, port: bool = False, socket_path: str = None, main=None):
+        self.server = server
+        self.loop = asyncio.new_event_loop()
+        self.listening = threading.Event()
+        self.stopped = None
+        self.main = main
+        self.port = port
+        self.socket_path = socket_path
+        self.thread = threading.Thread(target=self.loop.run_until_complete, args=(self._serve(),))
+        self.thread.start()
+        self.listening.wait(5)
+
+    async def _serve(self):
+        self.stopped = asyncio.Event()
+        await self.server.listen(self.socket_path, 0 if self.port else None)
+        self.listening.set()
+        if self.main is not None:
+            task = asyncio.ensure_future(self.main())
+            await self.stopped.wait()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        else:
+            await self.stopped.wait()
+        await self.server.close()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.stopped.set)
+        self.thread.join(5)
+        self.loop.close()
+
+
+class TestWorkflowServer(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.persistence = StatePersistence(self.temp_dir)
+        self.engine = WorkflowEngine(self.persistence)
+        self.socket_path = os.path.join(self.temp_dir, "lf.sock")
+        self.server = WorkflowServer(self.engine)
+        self.thread = ServerThread(self.server, socket_path=self.socket_path)
+        self.client = LocalFlowClient(self.socket_path, window=4, batch_size=10).connect()
+
+    def tearDown(self):
+        self.client.close()
+        self.thread.stop()
+        self.persistence.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_start_many_pipelines_batches(self):
+        ids = self.client.start_many(["PurchaseFlow"] * 95)
+        self.assertEqual(len(set(ids)), 95)
+        self.assertEqual(self.persistence.catalog.count(status=WorkflowStatus.PENDING.value), 95)
+        # Ten batches of at most ten, four in flight at a time
+        self.assertEqual(self.server.requests, 10)
+        # Nothing in this process runs them, so they are not kept in memory
+        self.assertEqual(len(self.engine.instances), 0)
+
+    def test_start_with_known_id_is_idempotent(self):
+        first = self.client.start("PurchaseFlow", "order-1")
+        self.engine.resume_workflow("order-1")
+        self.engine.update_status("order-1", WorkflowStatus.COMPLETED)
+        again = self.client.start("PurchaseFlow", "order-1")
+        self.assertEqual(first, again)
+        self.assertEqual(self.client.query("order-1")["status"], "completed")
+
+    def test_signal_is_recorded_durably(self):
+        workflow_id = self.client.start("PurchaseFlow")
+        event_id = self.client.signal(workflow_id, "approve", {"by": "ops"})
+        self.assertEqual(event_id, 1)
+        workflow = self.persistence.load_workflow(workflow_id)
+        self.assertEqual(workflow.events[0].type, SIGNAL_EVENT)
+        self.assertEqual(workflow.events[0].data, {"signal": "approve", "payload": {"by": "ops"}})
+        self.assertEqual(self.client.query(workflow_id)["events"], 1)
+
+    def test_finished_workflow_rejects_signals(self):
+        workflow_id = self.client.start("PurchaseFlow")
+        self.engine.resume_workflow(workflow_id)
+        self.engine.update_status(workflow_id, WorkflowStatus.FAILED)
+        with self.assertRaises(ClientError) as raised:
+            self.client.signal(workflow_id, "approve")
+        self.assertEqual(str(raised.exception), f"Workflow {workflow_id} is failed")
+
+    def test_errors_do_not_break_the_connection(self):
+        with self.assertRaises(ClientError):
+            self.client.signal("missing", "approve")
+        with self.assertRaises(ClientError):
+            self.client.call("explode")
+        with self.assertRaises(ClientError):
+            self.client.query("missing")
+        responses = self.client.call_many([{"op": "ping"}, {"op": "start", "workflows": "x"}, {"op": "ping"}])
+        self.assertEqual(["result" in r for r in responses], [True, False, True])
+
+    def test_invalid_spec_rejects_the_whole_batch(self):
+        with self.assertRaises(ClientError):
+            self.client.call("start", workflows=[{"name": "PurchaseFlow"}, {"id": "order-2"}])
+        self.assertEqual(self.persistence.catalog.count(), 0)
+
+    def test_malformed_line(self):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(self.socket_path)
+            sock.sendall(b"not json\n")
+            reply = sock.makefile("rb").readline()
+        self.assertIn(b"Malformed", reply)
+        self.assertIn("pid", self.client.ping())
+
+    def test_closed_server_removes_socket(self):
+        self.client.close()
+        self.thread.stop()
+        self.assertFalse(os.path.exists(self.socket_path))
+        with self.assertRaises(OSError):
+            LocalFlowClient(self.socket_path).connect()
+        self.thread = ServerThread(self.server, socket_path=self.socket_path)
+
+
+class TestServerWithWorker(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.persistence = StatePersistence(self.temp_dir)
+        engine = WorkflowEngine(self.persistence)
+        runner = ActivityRunner()
+        runner.register_activity("send_email", lambda: "sent")
+        self.executor = WorkflowExecutor(engine, runner)
+        self.executor.register_definition("EmailFlow", [WorkflowStep(type="step", name="send_email")])
+
+    def tearDown(self):
+        self.persistence.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_started_workflows_run_without_waiting_for_a_poll(self):
+        worker = WorkflowWorker(self.executor, follow=True, poll_interval=60)
+        server = WorkflowServer(self.executor.workflow_engine, evict_started=False,
+                                on_start=lambda ids: worker.wake())
+        thread = ServerThread(server, port=True, main=worker.run)
+        try:
+            with LocalFlowClient(port=server.port) as client:
+                ids = client.start_many(["EmailFlow"] * 5)
+                deadline = time.monotonic() + 5
+                while time.monotonic() < deadline:
+                    if all(client.query(i)["status"] == "completed" for i in ids):
+                        break
+                    time.sleep(0.01)
+                self.assertEqual({client.query(i)["status"] for i in ids}, {"completed"})
+        finally:
+            thread.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import unittest
+import asyncio
+import tempfile
+import shutil
+import os
+import threading
+import time
+from localflow.activities.runner import ActivityRunner
+from localflow.core.clock import VirtualClock
+from localflow.core.workflow import WorkflowEngine, WorkflowStatus, shard_of
+from localflow.core.sharding import ShardedWorkflowEngine
+from localflow.dsl.parser import WorkflowStep
+from localflow.engine.executor import WorkflowExecutor
+from localflow.engine.worker import WorkflowWorker
+from localflow.state.persistence import StatePersistence, history_path
+from localflow.timers.scheduler import TimerScheduler
+
+
+class TestShardedWorkflowEngine(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.engine = ShardedWorkflowEngine.open(self.temp_dir, 4)
+
+    def tearDown(self):
+        self.engine.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_workflows_are_routed_by_id(self):
+        workflows = [self.engine.create_workflow("PurchaseFlow") for _ in range(20)]
+        for workflow in workflows:
+            shard = self.engine.shards[shard_of(workflow.id, 4)]
+            self.assertIs(shard.get_workflow(workflow.id), workflow)
+            self.assertIs(self.engine.get_workflow(workflow.id), workflow)
+        self.assertEqual(len(self.engine.instances), 20)
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.temp_dir, "journals"))),
+            ["shard-0", "shard-0.lock", "shard-1", "shard-1.lock",
+             "shard-2", "shard-2.lock", "shard-3", "shard-3.lock"]
+        )
+
+    def test_concurrent_threads_lose_no_updates(self):
+        workflows = [self.engine.create_workflow("PurchaseFlow") for _ in range(8)]
+
+        def record(workflow_id):
+            for i in range(200):
+                self.engine.record_event(workflow_id, "ActivityCompleted", {"activity": f"a{i}", "result": i})
+
+        # Two threads per workflow so shards and workflows both see contention
+        threads = [threading.Thread(target=record, args=(w.id,)) for w in workflows for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for workflow in workflows:
+            self.assertEqual(workflow.state["completed_steps"], 400)
+            self.assertEqual(workflow.event_count, 400)
+        self.engine.close()
+
+        reopened = ShardedWorkflowEngine.open(self.temp_dir, 4)
+        for workflow in workflows:
+            loaded = reopened.shard_for(workflow.id).persistence.load_workflow(workflow.id)
+            self.assertEqual([e.id for e in loaded.events], list(range(1, 401)))
+        self.engine = reopened
+
+    def test_commit_with_transactions(self):
+        workflows = [self.engine.create_workflow("PurchaseFlow") for _ in range(10)]
+
+        async def task(workflow_id):
+            async with self.engine.transaction(workflow_id) as tx:
+                tx.record("Event1", {})
+            self.engine.update_status(workflow_id, WorkflowStatus.COMPLETED)
+
+        async def main():
+            await asyncio.gather(*(task(w.id) for w in workflows))
+        asyncio.run(main())
+
+        for workflow in workflows:
+            self.assertEqual(workflow.status, WorkflowStatus.COMPLETED)
+            self.assertEqual(len(workflow.events), 1)
+
+    def test_shard_journal_has_one_owner(self):
+        with self.assertRaises(RuntimeError):
+            StatePersistence(self.temp_dir, shard=0)
+
+    def test_orphaned_journal_is_recovered(self):
+        self.engine.close()
+        crashed = StatePersistence(self.temp_dir, shard=5)
+        engine = WorkflowEngine(crashed)
+        workflow = engine.create_workflow("PurchaseFlow")
+        engine.record_event(workflow.id, "Event1", {})
+        crashed.sync()
+        segment = os.path.join(history_path(self.temp_dir, workflow.id), "00000000.seg")
+        with open(segment, 'r+b') as f:
+            f.truncate(0)
+        # A dead process no longer holds its journal lock
+        crashed._journal_lock.close()
+
+        self.engine = ShardedWorkflowEngine.open(self.temp_dir, 4)
+        loaded = self.engine.shards[0].persistence.load_workflow(workflow.id)
+        self.assertEqual([e.type for e in loaded.events], ["Event1"])
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, "journals", "shard-5")))
+
+    def test_runs_under_the_executor_scheduler_and_worker(self):
+        def run(clock=None):
+            self.engine.close()
+            self.engine = ShardedWorkflowEngine.open(self.temp_dir, 4, clock=clock)
+            runner = ActivityRunner()
+            runner.register_activity("send_email", lambda: "sent")
+            executor = WorkflowExecutor(self.engine, runner, TimerScheduler(self.engine))
+            executor.register_definition("SleepFlow", [
+                WorkflowStep(type="wait", name="", duration=3600),
+                WorkflowStep(type="step", name="send_email")
+            ])
+            return asyncio.run(WorkflowWorker(executor).run())
+
+        # Fixed ids that land on every shard
+        ids = [self.engine.create_workflow("SleepFlow", f"sleep-{i}").id for i in range(8)]
+        self.assertEqual({shard_of(workflow_id, 4) for workflow_id in ids}, {0, 1, 2, 3})
+        report = run()
+        self.assertEqual((report.completed, report.suspended), (0, 8))
+
+        # The timers outlive the engine; virtual time fires them at once
+        report = run(VirtualClock(time.time()))
+        self.assertEqual((report.completed, report.timers_fired), (8, 8))
+        for workflow_id in ids:
+            self.assertEqual(self.engine.persistence.catalog.get(workflow_id).status, "completed")
+            self.assertEqual(self.engine.resume_workflow(workflow_id).status, WorkflowStatus.COMPLETED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from localflow.benchmarks.bench_startup import WORKFLOW_ID, _prepare, regressions, run_benchmark
+from localflow.cli.main import cli_env, parse_importtime
+
+# Modules that only commands which execute workflows should pay for
+HEAVY = ["asyncio", "concurrent.futures", "http.server", "urllib.request",
+         "localflow.engine.executor", "localflow.activities.runner", "localflow.dsl.parser"]
+
+REPORT = """
+import json, sys
+from localflow.cli.main import LocalFlowCLI
+LocalFlowCLI().run(sys.argv[1:])
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+class TestStartup(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        _prepare(self.temp_dir, events=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _loaded(self, *args):
+        result = subprocess.run([sys.executable, "-c", REPORT, *args], cwd=self.temp_dir, env=cli_env(),
+                                capture_output=True, text=True, check=True)
+        *output, modules = result.stdout.splitlines()
+        return "\n".join(output), set(json.loads(modules))
+
+    def test_read_only_commands_skip_the_engine(self):
+        for args, expected in ((["inspect", WORKFLOW_ID], "PurchaseFlow"), (["list"], WORKFLOW_ID),
+                               (["history", WORKFLOW_ID], "ActivityCompleted"),
+                               (["query", "--processes", "1"], "step_0")):
+            output, modules = self._loaded(*args)
+            self.assertEqual([m for m in HEAVY if m in modules], [], args)
+            self.assertIn(expected, output)
+
+    def test_inspect_reads_the_catalog(self):
+        output, modules = self._loaded("inspect", WORKFLOW_ID)
+        self.assertIn("Status: completed", output)
+        self.assertIn("Events: 3", output)
+        self.assertNotIn("localflow.state.persistence", modules)
+
+    def test_history_does_not_open_the_store(self):
+        empty = tempfile.mkdtemp()
+        try:
+            result = subprocess.run([sys.executable, "-c", REPORT, "history", WORKFLOW_ID], cwd=empty,
+                                    env=cli_env(), capture_output=True, text=True, check=True)
+            self.assertIn("not found", result.stdout)
+            self.assertEqual(os.listdir(empty), [])
+        finally:
+            shutil.rmtree(empty)
+
+    def test_profile_startup(self):
+        result = subprocess.run(
+            [sys.executable, "-c", REPORT, "--profile-startup", "inspect", WORKFLOW_ID],
+            cwd=self.temp_dir, env=cli_env(), capture_output=True, text=True, check=True
+        )
+        self.assertIn("Status: completed", result.stdout)
+        self.assertIn("Startup profile of `lf inspect", result.stdout)
+        self.assertIn("localflow.state.catalog", result.stdout)
+
+    def test_parse_importtime(self):
+        imports, other = parse_importtime(
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       120 |        120 |     zlib\n"
+            "import time:       300 |        420 |   json\n"
+            "Traceback: boom\n"
+        )
+        self.assertEqual(imports, [(120, 120, 2, "zlib"), (300, 420, 1, "json")])
+        self.assertEqual(other, ["Traceback: boom"])
+
+    def test_benchmark(self):
+        run = run_benchmark(runs=1, commands=["python", "inspect"])
+        self.assertEqual(set(run["results"]), {"python", "inspect"})
+        self.assertGreater(run["results"]["inspect"]["modules"], run["results"]["python"]["modules"])
+        slower = dict(run, results={"inspect": dict(run["results"]["inspect"], median_ms=1e-3)})
+        self.assertEqual(regressions(run, slower, 0.2), ["inspect"])
+        self.assertEqual(regressions(run, run, 0.2), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,16 @@
 import unittest
 from unittest.mock import patch
+import asyncio
 import time
+import tempfile
+import shutil
+from localflow.timers.driver import TimerDriver
 from localflow.timers.scheduler import TimerScheduler
-from localflow.core.workflow import WorkflowEngine
+from localflow.core.workflow import WorkflowEngine, WorkflowStatus
+from localflow.dsl.parser import WorkflowStep
+from localflow.engine.executor import WorkflowExecutor
+from localflow.activities.runner import ActivityRunner
+from localflow.state.persistence import StatePersistence
 
 
 class TestTimerScheduler(unittest.TestCase):
@@ -35,6 +43,174 @@ class TestTimerScheduler(unittest.TestCase):
         ready_timers = self.scheduler.get_ready_timers()
         self.assertEqual(len(ready_timers), 0)
 
+    @patch('time.time')
+    def test_ready_timers_in_fire_order_and_batches(self, mock_time):
+        mock_time.return_value = 100
+        late = self.scheduler.schedule_timer("workflow1", 30)
+        early = self.scheduler.schedule_timer("workflow2", 10)
+        middle = self.scheduler.schedule_timer("workflow3", 20)
+        self.scheduler.schedule_timer("workflow4", 60)
+
+        mock_time.return_value = 150
+        first_batch = self.scheduler.get_ready_timers(limit=2)
+        self.assertEqual([t.id for t in first_batch], [early.id, middle.id])
+        second_batch = self.scheduler.get_ready_timers(limit=2)
+        self.assertEqual([t.id for t in second_batch], [late.id])
+        self.assertEqual(self.scheduler.get_ready_timers(), [])
+        self.assertEqual(self.scheduler.next_fire_time(), 160)
+
+    @patch('time.time')
+    def test_cancelled_timer_is_skipped(self, mock_time):
+        mock_time.return_value = 100
+        cancelled = self.scheduler.schedule_timer("workflow1", 5)
+        kept = self.scheduler.schedule_timer("workflow2", 10)
+        self.scheduler.remove_timer(cancelled.id)
+        self.assertEqual(self.scheduler.next_fire_time(), kept.fire_time)
+
+        mock_time.return_value = 200
+        self.assertEqual([t.id for t in self.scheduler.get_ready_timers()], [kept.id])
+        self.assertEqual(len(self.scheduler), 1)
+        self.scheduler.remove_timer(kept.id)
+        self.assertEqual(len(self.scheduler), 0)
+
+
+class TestDurableTimers(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _scheduler(self, **kwargs):
+        persistence = StatePersistence(self.temp_dir)
+        return persistence, TimerScheduler(WorkflowEngine(persistence), **kwargs)
+
+    @patch('time.time')
+    def test_timers_survive_restart(self, mock_time):
+        mock_time.return_value = 100
+        persistence, scheduler = self._scheduler()
+        removed = scheduler.schedule_timer("workflow1", 5)
+        delivered = scheduler.schedule_timer("workflow2", 5)
+        pending = scheduler.schedule_timer("workflow3", 50)
+        scheduler.remove_timer(removed.id)
+        mock_time.return_value = 110
+        self.assertEqual([t.id for t in scheduler.get_ready_timers()], [delivered.id])
+        persistence.close()
+
+        # Delivered but unacknowledged timers are delivered again
+        persistence, scheduler = self._scheduler()
+        self.assertEqual(set(scheduler.timers), {delivered.id, pending.id})
+        self.assertEqual([t.id for t in scheduler.get_ready_timers()], [delivered.id])
+        persistence.close()
+
+    @patch('time.time')
+    def test_compaction_keeps_live_timers(self, mock_time):
+        mock_time.return_value = 100
+        persistence, scheduler = self._scheduler(compact_threshold=10)
+        keep = scheduler.schedule_timer("workflow1", 1000)
+        for _ in range(20):
+            scheduler.remove_timer(scheduler.schedule_timer("workflow2", 5).id)
+        self.assertLess(scheduler._log_records, 10)
+        persistence.close()
+
+        persistence, scheduler = self._scheduler()
+        self.assertEqual(list(scheduler.timers), [keep.id])
+        persistence.close()
+
+
+class RecordingExecutor:
+    def __init__(self):
+        self.workflow_engine = WorkflowEngine()
+        self.timer_scheduler = TimerScheduler(self.workflow_engine)
+        self.lags = []
+
+    async def fire_timer(self, timer):
+        self.lags.append(time.time() - timer.fire_time)
+        self.timer_scheduler.remove_timer(timer.id)
+
+
+class TestTimerDriver(unittest.TestCase):
+    def setUp(self):
+        self.executor = RecordingExecutor()
+        self.scheduler = self.executor.timer_scheduler
+        self.driver = TimerDriver(self.executor)
+
+    async def _run_until(self, count, timeout=5.0):
+        task = asyncio.ensure_future(self.driver.run())
+        started = time.monotonic()
+        while self.driver.fired < count and time.monotonic() - started < timeout:
+            await asyncio.sleep(0.01)
+        self.driver.stop()
+        await task
+
+    def test_fires_at_deadline(self):
+        for delay in (0.05, 0.1, 0.15):
+            self.scheduler.schedule_timer("workflow", delay)
+        asyncio.run(self._run_until(3))
+        self.assertEqual(len(self.executor.lags), 3)
+        self.assertLess(max(self.executor.lags), 0.05)
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_earlier_timer_wakes_driver(self):
+        self.scheduler.schedule_timer("workflow", 3600)
+
+        async def main():
+            run = asyncio.ensure_future(self._run_until(1))
+            await asyncio.sleep(0.02)
+            self.scheduler.schedule_timer("workflow", 0.05)
+            await run
+
+        started = time.monotonic()
+        asyncio.run(main())
+        self.assertEqual(self.driver.fired, 1)
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertIsNone(self.scheduler.on_schedule)
+
+    def test_resumes_waiting_workflow(self):
+        engine = WorkflowEngine()
+        runner = ActivityRunner()
+        runner.register_activity("send_email", lambda: "sent")
+        executor = WorkflowExecutor(engine, runner, TimerScheduler(engine))
+        steps = [WorkflowStep(type="wait", name="", duration=0.05), WorkflowStep(type="step", name="send_email")]
+        workflow = engine.create_workflow("DelayedFlow")
+        self.driver = TimerDriver(executor)
+
+        async def main():
+            await executor.execute_workflow(workflow.id, steps)
+            await self._run_until(1)
+
+        asyncio.run(main())
+        self.assertEqual(workflow.status, WorkflowStatus.COMPLETED)
+        self.assertEqual([e.type for e in workflow.events], ["TimerStarted", "TimerFired", "ActivityCompleted"])
+
+    def test_failed_timer_is_counted_and_retried(self):
+        engine = WorkflowEngine()
+        runner = ActivityRunner()
+        runner.register_activity("send_email", lambda: "sent")
+        executor = WorkflowExecutor(engine, runner, TimerScheduler(engine))
+        executor.timer_retry_delay = 0.05
+        steps = [WorkflowStep(type="wait", name="", duration=0.05), WorkflowStep(type="step", name="send_email")]
+        workflow = engine.create_workflow("DelayedFlow")
+        errors = []
+        self.driver = TimerDriver(executor, on_error=errors.append)
+
+        async def main():
+            await executor.execute_workflow(workflow.id, steps)
+            del executor.definitions["DelayedFlow"]
+            task = asyncio.ensure_future(self._run_until(1))
+            deadline = time.monotonic() + 5
+            while not self.driver.failed and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+            self.assertEqual(len(executor.timer_scheduler), 1)
+            executor.register_definition("DelayedFlow", steps)
+            await task
+
+        asyncio.run(main())
+        self.assertEqual(self.driver.fired, 1)
+        self.assertGreaterEqual(self.driver.failed, 1)
+        self.assertIn("No definition", str(errors[0]))
+        self.assertEqual(workflow.status, WorkflowStatus.COMPLETED)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,166 @@
+import unittest
+import asyncio
+import functools
+import os
+import tempfile
+import shutil
+import time
+from unittest.mock import patch
+from localflow.cli.main import build_executor
+from localflow.core.clock import VirtualClock
+from localflow.core.workflow import WorkflowEngine
+from localflow.dsl.parser import WorkflowStep
+from localflow.engine.executor import WorkflowExecutor
+from localflow.engine.worker import WorkflowWorker, WorkerReport, percentile, run_worker_processes, shard_of
+from localflow.activities.runner import ActivityRunner, ExecutionPolicy
+from localflow.state.persistence import StatePersistence
+from localflow.timers.scheduler import TimerScheduler
+
+
+def child_pid():
+    return os.getpid()
+
+
+def process_activity_setup(storage_path, shard):
+    engine = WorkflowEngine(StatePersistence(storage_path, shard=shard[0]))
+    runner = ActivityRunner()
+    runner.register_activity("child_pid", child_pid, ExecutionPolicy(mode="process", pool="test-shards"))
+    executor = WorkflowExecutor(engine, runner)
+    executor.register_definition("ProcessFlow", [WorkflowStep(type="step", name="child_pid")])
+    return executor
+
+
+class TestWorkflowWorker(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.persistence = StatePersistence(self.temp_dir)
+        self.engine = WorkflowEngine(self.persistence)
+        runner = ActivityRunner()
+        runner.register_activity("charge_card", lambda: "charged")
+        self.scheduler = TimerScheduler(self.engine)
+        self.executor = WorkflowExecutor(self.engine, runner.run_activity, self.scheduler)
+        self.executor.register_definition("PurchaseFlow", [WorkflowStep(type="step", name="charge_card")])
+        self.executor.register_definition("DelayedFlow", [
+            WorkflowStep(type="wait", name="", duration=60),
+            WorkflowStep(type="step", name="charge_card"),
+        ])
+
+    def tearDown(self):
+        self.persistence.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_drains_pending_workflows(self):
+        ids = [self.engine.create_workflow("PurchaseFlow").id for _ in range(10)]
+        report = asyncio.run(WorkflowWorker(self.executor, max_inflight=3).run())
+
+        self.assertEqual(report.completed, 10)
+        self.assertEqual(len(report.step_latencies), 10)
+        for workflow_id in ids:
+            self.assertEqual(self.persistence.catalog.get(workflow_id).status, "completed")
+
+    def test_waiting_workflows_resume_when_timer_fires(self):
+        workflow = self.engine.create_workflow("DelayedFlow")
+        report = asyncio.run(WorkflowWorker(self.executor).run())
+        self.assertEqual((report.completed, report.suspended), (0, 1))
+        self.assertEqual(self.persistence.catalog.get(workflow.id).status, "running")
+
+        with patch('time.time', return_value=time.time() + 120):
+            report = asyncio.run(WorkflowWorker(self.executor).run())
+        self.assertEqual(report.timers_fired, 1)
+        self.assertEqual((report.completed, report.failed, report.suspended), (1, 0, 0))
+        self.assertEqual(self.persistence.catalog.get(workflow.id).status, "completed")
+
+    def test_timer_resumed_workflows_are_counted_and_released(self):
+        ids = [self.engine.create_workflow("DelayedFlow").id for _ in range(4)]
+        worker = WorkflowWorker(self.executor)
+        report = asyncio.run(worker.run())
+        self.assertEqual(report.suspended, 4)
+
+        with patch('time.time', return_value=time.time() + 120):
+            report = asyncio.run(worker.run())
+        self.assertEqual((report.completed, report.suspended, report.timers_fired), (4, 0, 4))
+        self.assertEqual(worker._claimed, set())
+        for workflow_id in ids:
+            self.assertEqual(self.persistence.catalog.get(workflow_id).status, "completed")
+
+    def test_missing_definition_is_reported(self):
+        workflow = self.engine.create_workflow("UnknownFlow")
+        report = asyncio.run(WorkflowWorker(self.executor).run())
+        self.assertEqual(report.failed, 1)
+        self.assertEqual(report.errors, [f"No definition for workflow UnknownFlow, skipped {workflow.id}"])
+        self.assertEqual(self.persistence.catalog.get(workflow.id).status, "pending")
+
+    def test_shard_only_claims_its_workflows(self):
+        ids = [self.engine.create_workflow("PurchaseFlow").id for _ in range(20)]
+        worker = WorkflowWorker(self.executor, shard=(0, 2))
+        report = asyncio.run(worker.run())
+
+        owned = [i for i in ids if shard_of(i, 2) == 0]
+        self.assertEqual(report.completed, len(owned))
+        self.assertEqual(self.persistence.catalog.count(status="pending"), len(ids) - len(owned))
+
+
+class TestWorkerProcesses(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_shards_can_run_process_activities(self):
+        persistence = StatePersistence(self.temp_dir)
+        engine = WorkflowEngine(persistence)
+        ids = [engine.create_workflow("ProcessFlow").id for _ in range(4)]
+        persistence.close()
+
+        report = run_worker_processes(functools.partial(process_activity_setup, self.temp_dir), 2)
+        self.assertEqual((report.completed, report.failed), (4, 0))
+        persistence = StatePersistence(self.temp_dir)
+        try:
+            for workflow_id in ids:
+                self.assertEqual(persistence.catalog.get(workflow_id).status, "completed")
+        finally:
+            persistence.close()
+
+    def test_timers_survive_a_change_in_process_count(self):
+        definitions = os.path.join(self.temp_dir, "definitions")
+        os.mkdir(definitions)
+        with open(os.path.join(definitions, "sleep.lf"), "w") as f:
+            f.write("workflow SleepFlow { wait 1h; step send_email; }")
+        persistence = StatePersistence(self.temp_dir)
+        engine = WorkflowEngine(persistence)
+        ids = [engine.create_workflow("SleepFlow").id for _ in range(4)]
+        persistence.close()
+
+        setup = functools.partial(build_executor, storage_path=self.temp_dir, definitions_dir=definitions)
+        report = run_worker_processes(setup, 2)
+        self.assertEqual((report.completed, report.suspended), (0, 4))
+
+        # One process reads neither shard's timer log
+        executor = setup(clock=VirtualClock(time.time()))
+        try:
+            report = asyncio.run(WorkflowWorker(executor).run())
+            self.assertEqual((report.completed, report.suspended, report.timers_fired), (4, 0, 4))
+            for workflow_id in ids:
+                self.assertEqual(executor.workflow_engine.persistence.catalog.get(workflow_id).status, "completed")
+        finally:
+            executor.workflow_engine.persistence.close()
+
+
+class TestWorkerReport(unittest.TestCase):
+    def test_percentile(self):
+        values = [i / 100 for i in range(101)]
+        self.assertAlmostEqual(percentile(values, 50), 0.5, places=2)
+        self.assertAlmostEqual(percentile(values, 99), 0.99, places=2)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_merge(self):
+        report = WorkerReport(completed=2, elapsed=1.0, step_latencies=[0.1])
+        report.merge(WorkerReport(completed=3, failed=1, elapsed=2.0, step_latencies=[0.2]))
+        self.assertEqual(report.completed, 5)
+        self.assertEqual(report.elapsed, 2.0)
+        self.assertEqual(report.workflows_per_second, 3.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
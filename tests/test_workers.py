@@ -0,0 +1,109 @@
+import unittest
+import asyncio
+import os
+import threading
+import time
+from localflow.activities.runner import ActivityRunner, ExecutionPolicy
+from localflow.activities.workers import WorkerError, WorkerPool, WorkerTimeout
+
+
+def current_pid():
+    return os.getpid()
+
+
+def add(a, b):
+    return a + b
+
+
+def chatty(lines):
+    for i in range(lines):
+        print(f"line {i}")
+    return lines
+
+
+def hang():
+    time.sleep(60)
+
+
+def broken():
+    raise KeyError("missing")
+
+
+class TestWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = WorkerPool(max_workers=2, max_tasks_per_child=3)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_workers_are_reused(self):
+        self.assertEqual(self.pool.call(add, (2, 3)), 5)
+        pids = {self.pool.call(current_pid) for _ in range(2)}
+        self.assertEqual(len(pids), 1)
+        self.assertNotIn(os.getpid(), pids)
+        # The third call recycled the worker, and a replacement was started
+        self.assertEqual(self.pool.spawned, 2)
+
+    def test_worker_is_recycled(self):
+        pids = [self.pool.call(current_pid) for _ in range(4)]
+        self.assertEqual(len(set(pids[:3])), 1)
+        self.assertNotEqual(pids[3], pids[0])
+
+    def test_output_is_streamed(self):
+        lines = []
+        self.assertEqual(self.pool.call(chatty, (3,), on_output=lines.append), 3)
+        self.assertEqual("".join(lines), "line 0\nline 1\nline 2\n")
+
+    def test_timeout_kills_worker(self):
+        pid = self.pool.call(current_pid)
+        started = time.perf_counter()
+        with self.assertRaises(WorkerTimeout):
+            self.pool.call(hang, timeout=0.2)
+        self.assertLess(time.perf_counter() - started, 5)
+        # The hung worker was replaced, and the pool keeps serving
+        self.assertNotEqual(self.pool.call(current_pid), pid)
+        self.assertEqual(self.pool.call(add, (1, 1)), 2)
+
+    def test_timeout_starts_when_a_worker_is_free(self):
+        pool = WorkerPool(max_workers=1)
+        self.addCleanup(pool.shutdown)
+        pool.call(add, (0, 0))
+        busy = threading.Thread(target=pool.call, args=(time.sleep, (0.5,)))
+        busy.start()
+        time.sleep(0.1)
+        # Waits about 0.4s for the only worker, then runs well within its timeout
+        self.assertEqual(pool.call(add, (1, 2), timeout=0.3), 3)
+        busy.join()
+
+    def test_errors_keep_their_type(self):
+        with self.assertRaises(WorkerError) as raised:
+            self.pool.call(broken)
+        self.assertEqual(raised.exception.error_type, "KeyError")
+        self.assertEqual(self.pool.call(add, (1, 2)), 3)
+
+    def test_submit(self):
+        futures = [self.pool.submit(add, i, i) for i in range(10)]
+        self.assertEqual([f.result() for f in futures], [2 * i for i in range(10)])
+
+
+class TestSubprocessActivities(unittest.TestCase):
+    def setUp(self):
+        self.runner = ActivityRunner()
+
+    def test_run_activity_subprocess(self):
+        self.runner.register_activity("pid", current_pid, ExecutionPolicy(mode="subprocess", pool="test-sub"))
+        result = self.runner.run_activity_subprocess("pid")
+        self.assertTrue(result.success)
+        self.assertNotEqual(result.output, str(os.getpid()))
+
+    def test_async_timeout(self):
+        self.runner.register_activity("hang", hang, ExecutionPolicy(
+            mode="subprocess", pool="test-sub-hang", start_to_close_timeout=0.2
+        ))
+        result = asyncio.run(self.runner.run_activity_async("hang"))
+        self.assertFalse(result.success)
+        self.assertEqual(result.error_type, "ActivityTimeout")
+
+
+if __name__ == '__main__':
+    unittest.main()
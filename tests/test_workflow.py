@@ -1,7 +1,9 @@
 import unittest
 from unittest.mock import Mock, patch
 from localflow.core.workflow import WorkflowEngine, WorkflowStatus, WorkflowEvent
-from localflow.dsl.parser import WorkflowParser, WorkflowStep
+from localflow.dsl.parser import WorkflowParser, WorkflowStep, PlanCache, ParseError
+import tempfile
+import shutil
 
 
 class TestWorkflowEngine(unittest.TestCase):
@@ -26,6 +28,44 @@ class TestWorkflowEngine(unittest.TestCase):
         self.assertEqual(event.type, "TestEvent")
         self.assertEqual(event.data["key"], "value")
 
+    def test_record_events(self):
+        workflow = self.engine.create_workflow("test_workflow")
+        events = self.engine.record_events(workflow.id, [
+            ("ActivityCompleted", {"activity": "a", "result": 1}),
+            ("ActivityCompleted", {"activity": "b", "result": 2})
+        ])
+
+        self.assertEqual(workflow.events, events)
+        self.assertEqual(self.engine.event_log, events)
+        self.assertEqual(workflow.state["completed_steps"], 2)
+        self.assertEqual(workflow.last_replay_index, 2)
+
+    def test_event_ids_are_sequence_numbers(self):
+        workflow = self.engine.create_workflow("test_workflow")
+        self.engine.record_event(workflow.id, "Event1", {})
+        self.engine.record_events(workflow.id, [("Event2", {}), ("Event3", {})])
+        self.assertEqual([e.id for e in workflow.events], [1, 2, 3])
+
+        other = self.engine.create_workflow("test_workflow")
+        self.assertEqual(self.engine.record_event(other.id, "Event1", {}).id, 1)
+        self.assertIs(other.events[0].type, workflow.events[0].type)
+        self.assertFalse(hasattr(workflow.events[0], "__dict__"))
+
+    def test_transaction(self):
+        workflow = self.engine.create_workflow("test_workflow")
+        with self.engine.transaction(workflow.id) as tx:
+            tx.record("Event1", {})
+            tx.record("Event2", {})
+            self.assertEqual(len(workflow.events), 0)
+        self.assertEqual([e.type for e in tx.events], ["Event1", "Event2"])
+        self.assertEqual(len(workflow.events), 2)
+
+        with self.assertRaises(RuntimeError):
+            with self.engine.transaction(workflow.id) as tx:
+                tx.record("Event3", {})
+                raise RuntimeError("abort")
+        self.assertEqual(len(workflow.events), 2)
+
     def test_update_status(self):
         workflow = self.engine.create_workflow("test_workflow")
         self.engine.update_status(workflow.id, WorkflowStatus.RUNNING)
@@ -75,6 +115,61 @@ workflow PurchaseFlow {
         self.assertEqual(steps[1].duration, 3600)
         self.assertEqual(steps[2].type, "step")
 
+    def test_parse_parallel_block(self):
+        source = """
+workflow PurchaseFlow {
+    step charge_card;
+    parallel {
+        step send_email;
+        step update_crm;
+    }
+    parallel any { step notify_a; step notify_b; }
+}
+"""
+        name, steps = self.parser.parse(source)
+        self.assertEqual([s.type for s in steps], ["step", "parallel", "parallel"])
+        self.assertEqual(steps[1].join, "all")
+        self.assertEqual([b.name for b in steps[1].branches], ["send_email", "update_crm"])
+        self.assertEqual(steps[2].join, "any")
+
+    def test_parse_invalid_parallel(self):
+        with self.assertRaises(ValueError):
+            self.parser.parse("workflow F { parallel { wait 1h; } }")
+        with self.assertRaises(ValueError):
+            self.parser.parse("workflow F { parallel { } }")
+        with self.assertRaises(ValueError):
+            self.parser.parse("workflow F { step a;")
+
+    def test_parse_records_positions(self):
+        source = "workflow F {\n    step a;\n    parallel { step b; }\n}"
+        _, steps = self.parser.parse(source)
+        self.assertEqual((steps[0].line, steps[0].column), (2, 5))
+        self.assertEqual((steps[1].branches[0].line, steps[1].branches[0].column), (3, 16))
+
+    def test_parse_error_reports_position(self):
+        with self.assertRaises(ParseError) as context:
+            WorkflowParser(PlanCache()).parse("workflow F {\n    step a\n}")
+        self.assertEqual(context.exception.line, 3)
+
+    def test_plan_cache(self):
+        cache = PlanCache()
+        parser = WorkflowParser(cache)
+        source = "workflow F { step a; wait 5m; }"
+        first = parser.parse(source)
+        self.assertIs(parser.parse(source), first)
+        self.assertEqual(len(cache.plans), 1)
+
+    def test_plan_cache_on_disk(self):
+        directory = tempfile.mkdtemp()
+        try:
+            source = "workflow F { step a; parallel any { step b; step c; } }"
+            expected = WorkflowParser(PlanCache(directory)).parse(source)
+
+            fresh = PlanCache(directory)
+            self.assertEqual(fresh.get(PlanCache.key(source)), expected)
+        finally:
+            shutil.rmtree(directory)
+
     def test_parse_duration_units(self):
         # Test hours
         duration = self.parser._parse_duration("1h")
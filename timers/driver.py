@@ -0,0 +1,90 @@
+import asyncio
+from typing import Callable, Optional, Set
+from .scheduler import Timer, TimerFireError
+
+
+class TimerDriver:
+    # Fires timers from the event loop as they come due. Between deadlines
+    # it sleeps until the earliest fire time in the heap, and scheduling an
+    # earlier timer wakes it, so nothing polls. Each due timer is delivered
+    # through executor.fire_timer on its own task, so a workflow that
+    # resumes into a slow activity does not hold up the timers behind it.
+    def __init__(self, executor, max_inflight: int = 256, batch_size: int = 500,
+                 on_error: Optional[Callable[[TimerFireError], None]] = None):
+        self.executor = executor
+        self.scheduler = executor.timer_scheduler
+        self.clock = executor.workflow_engine.clock
+        self.max_inflight = max_inflight
+        self.batch_size = batch_size
+        self.fired = 0
+        # Timers that could not be delivered; each stays registered and is
+        # retried, and on_error is called with the failure
+        self.failed = 0
+        self.on_error = on_error
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._deadline: Optional[float] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._stopped = False
+
+    def _on_schedule(self, timer: Timer):
+        # May be called from any thread
+        if self._deadline is None or timer.fire_time < self._deadline:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def stop(self):
+        self._stopped = True
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _sleep_until(self, deadline: Optional[float]):
+        self._deadline = deadline
+        waiter = asyncio.ensure_future(self._wakeup.wait())
+        pending = {waiter}
+        if deadline is not None:
+            pending.add(asyncio.ensure_future(self.clock.sleep(deadline - self.clock.time())))
+        try:
+            await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for future in pending:
+                future.cancel()
+            self._deadline = None
+            self._wakeup.clear()
+
+    async def _fire(self, timer: Timer):
+        try:
+            await self.executor.fire_timer(timer)
+        except TimerFireError as e:
+            self.failed += 1
+            if self.on_error is not None:
+                self.on_error(e)
+            return
+        except Exception:
+            # The timer fired and the workflow it resumed failed; that is
+            # the workflow's outcome, not the timer's
+            pass
+        finally:
+            self._slots.release()
+        self.fired += 1
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_inflight)
+        self.scheduler.on_schedule = self._on_schedule
+        try:
+            while not self._stopped:
+                fire_time = self.scheduler.next_fire_time()
+                if fire_time is None or fire_time > self.clock.time():
+                    await self._sleep_until(fire_time)
+                    continue
+                for timer in self.scheduler.get_ready_timers(self.batch_size):
+                    await self._slots.acquire()
+                    task = asyncio.ensure_future(self._fire(timer))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+            if self._tasks:
+                await asyncio.wait(self._tasks)
+        finally:
+            self.scheduler.on_schedule = None
@@ -1,10 +1,15 @@
 import heapq
-import time
-from typing import List, Dict, Any
+import itertools
+import json
+import uuid
+from typing import Callable, List, Dict, Any, Optional, Tuple
 from dataclasses import dataclass
 from ..core.workflow import WorkflowEngine
 
 
+TIMER_LOG = "timers"
+
+
 @dataclass
 class Timer:
     id: str
@@ -13,34 +18,158 @@ class Timer:
     duration: int  # seconds
 
 
+class TimerFireError(Exception):
+    # A due timer could not be delivered to its workflow. The timer stays
+    # registered and comes due again after WorkflowExecutor.timer_retry_delay.
+    def __init__(self, message: str, timer: Timer):
+        super().__init__(message)
+        self.timer = timer
+
+
+def _schedule_record(timer: Timer) -> Dict[str, Any]:
+    return {
+        "op": "schedule",
+        "id": timer.id,
+        "workflow_id": timer.workflow_id,
+        "fire_time": timer.fire_time,
+        "duration": timer.duration
+    }
+
+
 class TimerScheduler:
-    def __init__(self, workflow_engine: WorkflowEngine):
+    def __init__(self, workflow_engine: WorkflowEngine, compact_threshold: int = 10000,
+                 log_name: str = TIMER_LOG):
         self.workflow_engine = workflow_engine
-        self.timers: List[Timer] = []
-        self.timer_heap: List[float] = []
+        self.clock = workflow_engine.clock
+        # Timers persist through the engine's store when it has one
+        self.persistence = workflow_engine.persistence
+        self.log_name = log_name
+        self.compact_threshold = compact_threshold
+        self.timers: Dict[str, Timer] = {}
+        # (fire_time, sequence, timer_id); cancelled or already delivered
+        # timers stay in the heap until they surface and are skipped
+        self.timer_heap: List[Tuple[float, int, str]] = []
+        self._sequence = itertools.count()
+        # Ids popped by get_ready_timers that have not been removed yet
+        self._delivered = set()
+        self._log_records = 0
+        self._stale_entries = 0
+        # Called with every newly scheduled timer; a TimerDriver uses it to
+        # wake up early for a timer that is due before its current deadline
+        self.on_schedule: Optional[Callable[[Timer], None]] = None
+        if self.persistence:
+            self._recover()
+
+    def _recover(self):
+        for payload in self.persistence.iter_log(self.log_name):
+            record = json.loads(payload)
+            if record["op"] == "schedule":
+                timer = Timer(
+                    id=record["id"],
+                    workflow_id=record["workflow_id"],
+                    fire_time=record["fire_time"],
+                    duration=record["duration"]
+                )
+                self.timers[timer.id] = timer
+            else:
+                self.timers.pop(record["id"], None)
+            self._log_records += 1
+
+        # Timers that were delivered but never removed before a restart are
+        # due again, so delivery is at-least-once
+        self.timer_heap = [(t.fire_time, next(self._sequence), t.id) for t in self.timers.values()]
+        heapq.heapify(self.timer_heap)
+
+    def _log(self, record: Dict[str, Any]):
+        self.persistence.append_record(self.log_name, json.dumps(record, separators=(",", ":")).encode("utf-8"))
+        self._log_records += 1
 
     def schedule_timer(self, workflow_id: str, duration_seconds: int) -> Timer:
-        fire_time = time.time() + duration_seconds
+        fire_time = self.clock.time() + duration_seconds
         timer = Timer(
-            id=str(time.time()),
+            id=str(uuid.uuid4()),
             workflow_id=workflow_id,
             fire_time=fire_time,
             duration=duration_seconds
         )
-        heapq.heappush(self.timer_heap, fire_time)
-        self.timers.append(timer)
+        self._add(timer)
         return timer
 
-    def get_ready_timers(self) -> List[Timer]:
-        now = time.time()
+    def restore_timer(self, timer: Timer):
+        # Registers a timer that was started elsewhere, e.g. under another
+        # shard layout whose log this scheduler does not read
+        if timer.id not in self.timers:
+            self._add(timer)
+
+    def _add(self, timer: Timer):
+        if self.persistence:
+            self._log(_schedule_record(timer))
+        heapq.heappush(self.timer_heap, (timer.fire_time, next(self._sequence), timer.id))
+        self.timers[timer.id] = timer
+        if self.on_schedule is not None:
+            self.on_schedule(timer)
+
+    def next_fire_time(self) -> Optional[float]:
+        heap = self.timer_heap
+        while heap and heap[0][2] not in self.timers:
+            heapq.heappop(heap)
+            self._stale_entries -= 1
+        return heap[0][0] if heap else None
+
+    def get_ready_timers(self, limit: Optional[int] = None, now: Optional[float] = None) -> List[Timer]:
+        # Pops due timers off the heap. They stay registered (and survive a
+        # restart) until the caller acknowledges them with remove_timer.
+        if now is None:
+            now = self.clock.time()
+        heap = self.timer_heap
         ready = []
-        for timer in self.timers:
-            if timer.fire_time <= now:
-                ready.append(timer)
+        while heap and heap[0][0] <= now and (limit is None or len(ready) < limit):
+            _, _, timer_id = heapq.heappop(heap)
+            timer = self.timers.get(timer_id)
+            if timer is None:
+                self._stale_entries -= 1
+                continue
+            self._delivered.add(timer_id)
+            ready.append(timer)
         return ready
 
+    def retry_timer(self, timer: Timer, delay: float):
+        # A delivered timer that could not be fired is due again after
+        # ``delay``; it was never removed, so it also survives a restart
+        if timer.id not in self.timers or timer.id not in self._delivered:
+            return
+        self._delivered.discard(timer.id)
+        heapq.heappush(self.timer_heap, (self.clock.time() + delay, next(self._sequence), timer.id))
+        if self.on_schedule is not None:
+            self.on_schedule(timer)
+
     def remove_timer(self, timer_id: str):
-        self.timers = [t for t in self.timers if t.id != timer_id]
-        # Rebuild heap
-        self.timer_heap = [t.fire_time for t in self.timers]
-        heapq.heapify(self.timer_heap)
\ No newline at end of file
+        timer = self.timers.pop(timer_id, None)
+        if timer is None:
+            return
+        if self.persistence:
+            self._log({"op": "remove", "id": timer_id})
+        # Heap entries of delivered timers are already gone; only cancelled
+        # timers that are still waiting leave a stale entry behind
+        if timer_id in self._delivered:
+            self._delivered.discard(timer_id)
+        else:
+            self._stale_entries += 1
+        if self._stale_entries > self.compact_threshold and self._stale_entries > len(self.timers):
+            self.timer_heap = [entry for entry in self.timer_heap if entry[2] in self.timers]
+            heapq.heapify(self.timer_heap)
+            self._stale_entries = 0
+        if self._log_records > self.compact_threshold and self._log_records > 4 * len(self.timers):
+            self.compact()
+
+    def compact(self):
+        if not self.persistence:
+            return
+        self.persistence.rewrite_log(self.log_name, (
+            json.dumps(_schedule_record(timer), separators=(",", ":")).encode("utf-8")
+            for timer in self.timers.values()
+        ))
+        self._log_records = len(self.timers)
+
+    def __len__(self) -> int:
+        return len(self.timers)